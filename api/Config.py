@@ -1,10 +1,10 @@
 import warnings
-import json
 import logging
 import os
 import sys
 
 # import logging_loki
+from api.utils.logs import parse_levels, setup_logging
 from dotenv import find_dotenv, load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -23,6 +23,100 @@ loki_url = os.environ.get('loki_url')
 loki_user = os.environ.get('loki_user')
 loki_pw = os.environ.get('loki_pw')
 
+# write-behind queue for reports
+report_queue_batch_size = int(os.environ.get('report_queue_batch_size', 5_000))
+report_queue_flush_interval = float(os.environ.get('report_queue_flush_interval', 1.0))
+report_queue_max_size = int(os.environ.get('report_queue_max_size', 100_000))
+
+# name -> player id cache
+player_name_cache_size = int(os.environ.get('player_name_cache_size', 500_000))
+player_name_negative_ttl = float(os.environ.get('player_name_negative_ttl', 60))
+
+# seconds a token's permissions, ratelimit and active status are cached, changes made
+# in the database (revoking a token included) take up to this long to apply, see invalidate_token
+token_cache_ttl = float(os.environ.get('token_cache_ttl', 300))
+# the api usage of a user is counted in memory and reconciled with apiUsage, which has the usage of
+# every replica, every ratelimit_sync_interval seconds
+ratelimit_sync_interval = float(os.environ.get('ratelimit_sync_interval', 60))
+
+# scrape scheduler, leases live in the memory of one process (uvicorn runs one per pod).
+# sharding is off unless every pod is given its own scrape_shard, for example from the
+# apps.kubernetes.io/pod-index label of a StatefulSet through the downward api
+scrape_lease_seconds = float(os.environ.get('scrape_lease_seconds', 900))
+scrape_shard = os.environ.get('scrape_shard')
+scrape_shards = int(os.environ.get('scrape_shards', 1))
+
+# ingestion journal, it only survives what its directory survives: the deployments mount
+# an emptyDir, which outlives a container restart but not the deletion of the pod
+journal_dir = os.environ.get('journal_dir', f"{os.getcwd()}/journal")
+journal_max_bytes = int(os.environ.get('journal_max_bytes', 2**30))
+journal_concurrency = int(os.environ.get('journal_concurrency', 4))
+
+# contribution counters, new reports and ban label changes are applied as deltas every refresh interval,
+# report_batch report ids per transaction. Rows older than max age are recomputed when they are read,
+# that is only a repair for changes made outside of the api
+contribution_refresh_interval = float(os.environ.get('contribution_refresh_interval', 30))
+contribution_report_batch = int(os.environ.get('contribution_report_batch', 100_000))
+contribution_max_age = float(os.environ.get('contribution_max_age', 86400))
+
+# heatmap tiles, ban transitions and new reports (report_batch report ids per transaction) are applied
+# to the tiles every refresh interval.
+# Regions that were never computed or are older than max age are recomputed when they are read
+heatmap_refresh_interval = float(os.environ.get('heatmap_refresh_interval', 60))
+heatmap_report_batch = int(os.environ.get('heatmap_report_batch', 100_000))
+heatmap_max_age = float(os.environ.get('heatmap_max_age', 86400))
+
+# players with new hiscores get their compact history appended to every interval
+hiscore_history_interval = float(os.environ.get('hiscore_history_interval', 60))
+
+# xp gains over a window start at the last scrape before it, looked up this many days back
+xp_change_lookback_days = int(os.environ.get('xp_change_lookback_days', 7))
+
+# export jobs, at most export_concurrency files are built at once from chunks of export_chunk_size rows,
+# the status of a job is stored in export_jobs and can be polled on any replica for export_job_ttl seconds
+export_concurrency = int(os.environ.get('export_concurrency', 2))
+export_chunk_size = int(os.environ.get('export_chunk_size', 5_000))
+export_job_ttl = float(os.environ.get('export_job_ttl', 86400))
+# the linked accounts of an export are queried export_account_concurrency at a time, each within export_account_timeout seconds
+export_account_concurrency = int(os.environ.get('export_account_concurrency', 4))
+export_account_timeout = float(os.environ.get('export_account_timeout', 600))
+
+# worker processes for cpu bound work, every lane caps how many of its jobs run at once
+worker_processes = int(os.environ.get('worker_processes', min(os.cpu_count() or 1, 4)))
+worker_ingest_concurrency = int(os.environ.get('worker_ingest_concurrency', worker_processes))
+worker_default_concurrency = int(os.environ.get('worker_default_concurrency', max(worker_processes - 1, 1)))
+worker_export_concurrency = int(os.environ.get('worker_export_concurrency', 1))
+
+# batch_function runs at most this many batches at once
+batch_concurrency = int(os.environ.get('batch_concurrency', 8))
+
+# identical reads in flight at the same time share one query, up to this many distinct reads
+coalesce_max_keys = int(os.environ.get('coalesce_max_keys', 10_000))
+
+# connection pools, pool_size + max_overflow is the most connections one replica opens per engine
+playerdata_pool_size = int(os.environ.get('playerdata_pool_size', 20))
+playerdata_max_overflow = int(os.environ.get('playerdata_max_overflow', 10))
+discord_pool_size = int(os.environ.get('discord_pool_size', 5))
+discord_max_overflow = int(os.environ.get('discord_max_overflow', 5))
+pool_timeout = float(os.environ.get('pool_timeout', 30))
+
+# concurrent requests per kind of route, requests wait up to max wait seconds for a slot.
+# the limits split the playerdata pool between the kinds, 30% ingest, 60% read and 10% export,
+# so together they never wait on each other for a connection
+playerdata_connections = playerdata_pool_size + playerdata_max_overflow
+bulkhead_ingest_limit = int(os.environ.get('bulkhead_ingest_limit', max(1, playerdata_connections * 3 // 10)))
+bulkhead_read_limit = int(os.environ.get('bulkhead_read_limit', max(1, playerdata_connections * 6 // 10)))
+bulkhead_export_limit = int(os.environ.get('bulkhead_export_limit', max(1, playerdata_connections // 10)))
+bulkhead_max_wait = float(os.environ.get('bulkhead_max_wait', 10))
+
+# deadlocks and lock wait timeouts are retried with backoff, within the deadline of the statement
+# and the deadline of the request
+sql_retry_attempts = int(os.environ.get('sql_retry_attempts', 5))
+sql_retry_base = float(os.environ.get('sql_retry_base', 0.05))
+sql_retry_cap = float(os.environ.get('sql_retry_cap', 2.0))
+sql_retry_deadline = float(os.environ.get('sql_retry_deadline', 10))
+request_deadline = float(os.environ.get('request_deadline', 30))
+
 # create application
 app = FastAPI()
 
@@ -42,23 +136,9 @@ app.add_middleware(
 )
 
 
-# setup logging
+# setup logging, records are written by a background thread, see api.utils.logs
 file_handler = logging.FileHandler(filename="logs/error.log", mode='a')
 stream_handler = logging.StreamHandler(sys.stdout)
-# # log formatting
-formatter = logging.Formatter(json.dumps(
-    {
-        'ts': '%(asctime)s',
-        'name': '%(name)s',
-        'function': '%(funcName)s',
-        'level':'%(levelname)s',
-        'msg': json.dumps('%(message)s')
-    }
-))
-
-
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
 
 handlers = [
     file_handler,
@@ -67,25 +147,22 @@ handlers = [
 
 
 # if not loki_url is None:
-#     loki_handler = logging_loki.LokiQueueHandler(
-#         Queue(-1),
+#     loki_handler = logging_loki.LokiHandler(
 #         url=f"{loki_url}",  # https://my-loki-instance/loki/api/v1/push
 #         tags={"application": "api"},
 #         auth=(f"{loki_user}", f"{loki_pw}"),
 #         version="1",
 #     )
-#     loki_handler.setFormatter(formatter)
 #     handlers.append(loki_handler)
 
-logging.basicConfig(level=logging.DEBUG, handlers=handlers)
-
-# set imported loggers to warning
-logging.getLogger("requests").setLevel(logging.DEBUG)
-logging.getLogger("urllib3").setLevel(logging.DEBUG)
-logging.getLogger("uvicorn").setLevel(logging.DEBUG)
+# log_levels sets the level per logger, as logger=LEVEL pairs separated by commas
+log_level = os.environ.get('log_level', 'DEBUG')
+log_levels = parse_levels(os.environ.get('log_levels', 'apscheduler=WARNING,aiomysql=ERROR'))
+# keep 1 in log_debug_sample debug records of every log statement
+log_debug_sample = int(os.environ.get('log_debug_sample', 1))
+log_queue_size = int(os.environ.get('log_queue_size', 10_000))
 
-logging.getLogger("apscheduler").setLevel(logging.WARNING)
-logging.getLogger("aiomysql").setLevel(logging.ERROR)
+setup_logging(handlers, level=log_level, levels=log_levels, debug_sample=log_debug_sample, max_queue=log_queue_size)
 
 logging.getLogger("uvicorn.error").propagate = False
 
@@ -1,11 +1,17 @@
 
-from concurrent.futures.process import ProcessPoolExecutor
-
 import api.Config
 import api.middleware
 from api.Config import app
-from api.routers import (feedback, hiscore, label, legacy, legacy_debug,
-                         player, prediction, report, scraper)
+from api.database.contributions import contribution_queue
+from api.database.exports import export_jobs
+from api.database.functions import usage_queue
+from api.database.heatmaps import heatmap_queue
+from api.database.hiscore_history import history_queue
+from api.utils.journal import ingest_journal
+from api.utils.workers import worker_pool
+from api.routers import (export, feedback, heatmap, hiscore, label, legacy,
+                         legacy_debug, metrics, player, prediction, report,
+                         scraper)
 
 app.include_router(hiscore.router)
 app.include_router(player.router)
@@ -15,18 +21,36 @@ app.include_router(report.router)
 app.include_router(legacy.router)
 app.include_router(scraper.router)
 app.include_router(label.router)
+app.include_router(heatmap.router)
+app.include_router(export.router)
 app.include_router(legacy_debug.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-# @app.on_event("startup")
-# async def startup_event():
-#     app.state.executor = ProcessPoolExecutor()
-
+@app.on_event("startup")
+async def start_queues():
+    worker_pool.start()
+    report.report_queue.start()
+    usage_queue.start()
+    ingest_journal.start()
+    contribution_queue.start()
+    heatmap_queue.start()
+    history_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_queues():
+    # flush everything that is still queued before the process exits
+    await report.report_queue.stop()
+    await usage_queue.stop()
+    await ingest_journal.stop()
+    await contribution_queue.stop()
+    await heatmap_queue.stop()
+    await history_queue.stop()
+    await export_jobs.stop()
+    await worker_pool.stop()
 
-# @app.on_event("shutdown")
-# async def on_shutdown():
-#     app.state.executor.shutdown()
@@ -0,0 +1,65 @@
+import logging
+from typing import Hashable, Optional
+
+from api import Config
+from api.database.database import EngineType, get_session
+from api.utils.metrics import Counter, Gauge
+from api.utils.single_flight import SingleFlight
+from sqlalchemy.engine import Result
+
+logger = logging.getLogger(__name__)
+
+READS = Counter('db_coalesced_reads_total', 'Reads by result: executed, coalesced (saved a query) or bypassed.', ('engine', 'result'))
+IN_FLIGHT = Gauge('db_coalesce_inflight_keys', 'Distinct reads currently in flight.')
+
+flight = SingleFlight()
+IN_FLIGHT.set_function(lambda: len(flight))
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def query_key(engine_type: EngineType, sql, params: dict = None) -> Optional[Hashable]:
+    '''
+        (engine, statement, params) of a read, statements built with the expression language
+        carry their params in the compiled statement. None if it can not be keyed.
+    '''
+    try:
+        compiled = sql.compile()
+        key = (engine_type, str(compiled), _hashable(compiled.params), _hashable(params or {}))
+        hash(key)
+    except Exception:
+        return None
+    return key
+
+
+async def _read(engine_type: EngineType, sql, params: dict = None):
+    async with get_session(engine_type) as session:
+        result = await session.execute(sql, params)
+        # buffered, so the rows can be handed out to every waiter
+        return result.freeze()
+
+
+async def read_sql(sql, params: dict = None, engine_type: EngineType = EngineType.PLAYERDATA) -> Result:
+    '''
+        Executes a read, identical reads that are in flight at the same time share one query.
+        Every caller gets its own Result, ORM objects in it are shared and must not be modified.
+        Only use for deterministic reads, not for order by rand() or locking reads.
+    '''
+    engine = engine_type.name.lower()
+    key = query_key(engine_type, sql, params)
+
+    # the key space is bounded, past the limit reads just run on their own
+    if key is None or (key not in flight and len(flight) >= Config.coalesce_max_keys):
+        READS.inc(engine=engine, result='bypassed')
+        frozen = await _read(engine_type, sql, params)
+        return frozen()
+
+    READS.inc(engine=engine, result='coalesced' if key in flight else 'executed')
+    frozen = await flight.do(key, lambda: _read(engine_type, sql, params))
+    return frozen()
@@ -0,0 +1,124 @@
+import asyncio
+import io
+import logging
+from typing import AsyncGenerator, List
+
+from api.database.database import EngineType
+from api.database.streaming import stream_partitions
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import types
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def arrow_type(column_type: types.TypeEngine):
+    '''the arrow type for a sqlalchemy column type, anything unknown is sent as text'''
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, types.BigInteger):
+        return pa.int64()
+    if isinstance(column_type, types.SmallInteger):
+        return pa.int16()
+    if isinstance(column_type, types.Integer):
+        # mysql TINYINT is an Integer subclass, int32 keeps it simple
+        return pa.int32()
+    if isinstance(column_type, types.Float):
+        return pa.float64()
+    if isinstance(column_type, types.DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, types.Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(sql):
+    '''schema from the selected columns of sql, so the types come from the models'''
+    fields = []
+    for column in sql.selected_columns:
+        fields.append(pa.field(column.name, arrow_type(column.type)))
+    return pa.schema(fields)
+
+
+class _ChunkSink(io.RawIOBase):
+    '''write only file that keeps what is written until it is drained'''
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def record_batch(rows: List, schema):
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = []
+    for column, field in zip(columns, schema):
+        if field.type == pa.string():
+            column = [None if value is None else str(value) for value in column]
+        arrays.append(pa.array(column, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def columnar_bytes(sql, fmt: str, engine_type: EngineType, chunk_size: int) -> AsyncGenerator[bytes, None]:
+    schema = arrow_schema(sql)
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode='w')
+
+    if fmt == 'parquet':
+        # every chunk becomes a row group
+        writer = pq.ParquetWriter(output, schema)
+        write = writer.write_table
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+        write = writer.write_batch
+
+    def encode(rows):
+        batch = record_batch(rows, schema)
+        write(pa.Table.from_batches([batch]) if fmt == 'parquet' else batch)
+        return sink.drain()
+
+    async for rows in stream_partitions(sql, engine_type, chunk_size):
+        # building the arrays is cpu bound, keep it off the event loop
+        yield await asyncio.to_thread(encode, rows)
+
+    writer.close()
+    yield sink.drain()
+
+
+def columnar_response(sql, fmt: str, engine_type: EngineType = EngineType.PLAYERDATA, chunk_size: int = 50_000) -> StreamingResponse:
+    '''
+        Arrow IPC stream or Parquet file of sql, built per chunk of rows from the cursor.
+        pyarrow is optional, without it the columnar formats are not available.
+    '''
+    if pa is None:
+        raise HTTPException(status_code=501, detail=f"{fmt} export is not available, pyarrow is not installed.")
+
+    return StreamingResponse(
+        columnar_bytes(sql, fmt, engine_type, chunk_size),
+        media_type=COLUMNAR_MEDIA_TYPES[fmt],
+    )
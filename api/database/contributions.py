@@ -0,0 +1,520 @@
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, TypeVar
+
+from api import Config
+from api.database.database import EngineType, get_session
+from api.database.functions import execute_sql
+from api.database.player_names import player_names
+from api.database.retry import default_policy
+from api.database.statements import insert_statement, update_statement
+from api.utils.write_behind import QueueFull, WriteBehindQueue
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+COUNTER_COLUMNS = [
+    'manual_reports', 'manual_bans', 'manual_possible_bans', 'manual_incorrect_reports',
+    'passive_reports', 'passive_bans', 'passive_possible_bans', 'feedback', 'total_xp_removed'
+]
+
+LABEL_COLUMNS = ['possible_ban', 'confirmed_ban', 'confirmed_player', 'xp']
+
+# The counters of a reporter are made of the distinct (reported player, manual_detect) pairs of
+# their Reports up to the watermark, weighted with the labels of the reported player in
+# reporterContributionLabels (a player without a row has no labels and no xp).
+# New reports move the watermark and label changes update reporterContributionLabels, both apply
+# their difference to the counters. sql_refresh recomputes reporters from scratch, for repair.
+
+sql_select_watermark = text('SELECT last_report_id FROM reporterContributionWatermark WHERE id = 1 LOCK IN SHARE MODE')
+sql_lock_watermark = text('SELECT last_report_id FROM reporterContributionWatermark WHERE id = 1 FOR UPDATE')
+sql_update_watermark = text('UPDATE reporterContributionWatermark SET last_report_id = :to_id WHERE id = 1')
+sql_max_report_id = text('SELECT MAX(ID) FROM Reports')
+
+# recompute the counters of a set of reporters,
+# the counts are over distinct (reported player, manual_detect) pairs like the old pandas dedupe
+sql_refresh = text(f'''
+    INSERT INTO reporterContributions (reporter_id, {', '.join(COUNTER_COLUMNS)}, updated_at)
+    SELECT
+        pl.id,
+        COALESCE(rs.manual_reports, 0),
+        COALESCE(rs.manual_bans, 0),
+        COALESCE(rs.manual_possible_bans, 0),
+        COALESCE(rs.manual_incorrect_reports, 0),
+        COALESCE(rs.passive_reports, 0),
+        COALESCE(rs.passive_bans, 0),
+        COALESCE(rs.passive_possible_bans, 0),
+        COALESCE(fb.feedback, 0),
+        COALESCE(xp.total_xp, 0),
+        CURRENT_TIMESTAMP
+    FROM Players pl
+    LEFT JOIN (
+        SELECT
+            d.reportingID,
+            SUM(d.detect = 1) AS manual_reports,
+            SUM(d.detect = 1 AND lb.confirmed_ban <=> 1) AS manual_bans,
+            SUM(d.detect = 1 AND lb.possible_ban <=> 1) - SUM(d.detect = 1 AND lb.confirmed_ban <=> 1) AS manual_possible_bans,
+            SUM(d.detect = 1 AND lb.confirmed_player <=> 1) AS manual_incorrect_reports,
+            SUM(d.detect = 0) AS passive_reports,
+            SUM(d.detect = 0 AND lb.confirmed_ban <=> 1) AS passive_bans,
+            SUM(d.detect = 0 AND lb.possible_ban <=> 1) - SUM(d.detect = 0 AND lb.confirmed_ban <=> 1) AS passive_possible_bans
+        FROM (
+            SELECT DISTINCT reportingID, reportedID, IFNULL(manual_detect, 0) AS detect
+            FROM Reports
+            WHERE reportingID IN :reporter_ids
+                AND ID <= :watermark
+        ) d
+        LEFT JOIN reporterContributionLabels lb ON (lb.player_id = d.reportedID)
+        GROUP BY d.reportingID
+    ) rs ON (rs.reportingID = pl.id)
+    LEFT JOIN (
+        SELECT voter_id, COUNT(*) AS feedback
+        FROM PredictionsFeedback
+        WHERE voter_id IN :reporter_ids
+        GROUP BY voter_id
+    ) fb ON (fb.voter_id = pl.id)
+    LEFT JOIN (
+        SELECT b.reportingID, SUM(lb.xp) AS total_xp
+        FROM (
+            SELECT DISTINCT reportingID, reportedID
+            FROM Reports
+            WHERE reportingID IN :reporter_ids
+                AND ID <= :watermark
+        ) b
+        JOIN reporterContributionLabels lb ON (lb.player_id = b.reportedID)
+        GROUP BY b.reportingID
+    ) xp ON (xp.reportingID = pl.id)
+    WHERE pl.id IN :reporter_ids
+    ON DUPLICATE KEY UPDATE
+        {', '.join(f'{c} = VALUES({c})' for c in COUNTER_COLUMNS)},
+        updated_at = VALUES(updated_at)
+''')
+
+# the reports from from_id to to_id whose (reported player, manual_detect) pair is new for the reporter
+sql_apply_reports = text('''
+    UPDATE reporterContributions rc
+    JOIN (
+        SELECT
+            n.reportingID,
+            SUM(n.detect = 1) AS manual_reports,
+            SUM(n.detect = 1 AND lb.confirmed_ban <=> 1) AS manual_bans,
+            SUM(n.detect = 1 AND lb.possible_ban <=> 1) - SUM(n.detect = 1 AND lb.confirmed_ban <=> 1) AS manual_possible_bans,
+            SUM(n.detect = 1 AND lb.confirmed_player <=> 1) AS manual_incorrect_reports,
+            SUM(n.detect = 0) AS passive_reports,
+            SUM(n.detect = 0 AND lb.confirmed_ban <=> 1) AS passive_bans,
+            SUM(n.detect = 0 AND lb.possible_ban <=> 1) - SUM(n.detect = 0 AND lb.confirmed_ban <=> 1) AS passive_possible_bans
+        FROM (
+            SELECT DISTINCT reportingID, reportedID, IFNULL(manual_detect, 0) AS detect
+            FROM Reports
+            WHERE ID > :from_id AND ID <= :to_id
+        ) n
+        LEFT JOIN reporterContributionLabels lb ON (lb.player_id = n.reportedID)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM Reports o
+            WHERE o.reportedID = n.reportedID
+                AND o.reportingID = n.reportingID
+                AND IFNULL(o.manual_detect, 0) = n.detect
+                AND o.ID <= :from_id
+        )
+        GROUP BY n.reportingID
+    ) d ON (d.reportingID = rc.reporter_id)
+    SET
+        rc.manual_reports = rc.manual_reports + d.manual_reports,
+        rc.manual_bans = rc.manual_bans + d.manual_bans,
+        rc.manual_possible_bans = rc.manual_possible_bans + d.manual_possible_bans,
+        rc.manual_incorrect_reports = rc.manual_incorrect_reports + d.manual_incorrect_reports,
+        rc.passive_reports = rc.passive_reports + d.passive_reports,
+        rc.passive_bans = rc.passive_bans + d.passive_bans,
+        rc.passive_possible_bans = rc.passive_possible_bans + d.passive_possible_bans
+''')
+
+# the xp of banned players that a reporter reported for the first time from from_id to to_id
+sql_apply_reports_xp = text('''
+    UPDATE reporterContributions rc
+    JOIN (
+        SELECT n.reportingID, SUM(lb.xp) AS xp
+        FROM (
+            SELECT DISTINCT reportingID, reportedID
+            FROM Reports
+            WHERE ID > :from_id AND ID <= :to_id
+        ) n
+        JOIN reporterContributionLabels lb ON (lb.player_id = n.reportedID)
+        WHERE lb.xp <> 0
+            AND NOT EXISTS (
+                SELECT 1
+                FROM Reports o
+                WHERE o.reportedID = n.reportedID
+                    AND o.reportingID = n.reportingID
+                    AND o.ID <= :from_id
+            )
+        GROUP BY n.reportingID
+    ) d ON (d.reportingID = rc.reporter_id)
+    SET rc.total_xp_removed = rc.total_xp_removed + d.xp
+''')
+
+sql_insert_labels = insert_statement('reporterContributionLabels', ['player_id'], ignore=True)
+sql_update_labels = update_statement('reporterContributionLabels', LABEL_COLUMNS, key='player_id')
+sql_lock_labels = text(f'''
+    SELECT player_id, {', '.join(LABEL_COLUMNS)}
+    FROM reporterContributionLabels
+    WHERE player_id IN :player_ids
+    FOR UPDATE
+''')
+sql_select_labels = text('''
+    SELECT
+        pl.id AS player_id,
+        pl.possible_ban,
+        pl.confirmed_ban,
+        pl.confirmed_player,
+        IF(pl.confirmed_ban = 1, COALESCE(hdl.total, 0), 0) AS xp
+    FROM Players pl
+    LEFT JOIN playerHiscoreDataLatest hdl ON (hdl.Player_id = pl.id)
+    WHERE pl.id IN :player_ids
+''')
+
+# the change of every label per player, they are added to the counters of everyone who reported the player
+label_changes_create = text('''
+    CREATE TEMPORARY TABLE IF NOT EXISTS tmpLabelChanges (
+        player_id INT PRIMARY KEY,
+        bans INT,
+        possible_bans INT,
+        incorrect_reports INT,
+        xp BIGINT
+    ) ENGINE=MEMORY
+''')
+label_changes_clear = text('DELETE FROM tmpLabelChanges')
+label_changes_insert = insert_statement('tmpLabelChanges', ['player_id', 'bans', 'possible_bans', 'incorrect_reports', 'xp'])
+label_changes_drop = text('DROP TEMPORARY TABLE IF EXISTS tmpLabelChanges')
+sql_apply_labels = text('''
+    UPDATE reporterContributions rc
+    JOIN (
+        SELECT
+            d.reportingID,
+            SUM((d.detect = 1) * d.bans) AS manual_bans,
+            SUM((d.detect = 1) * d.possible_bans) AS manual_possible_bans,
+            SUM((d.detect = 1) * d.incorrect_reports) AS manual_incorrect_reports,
+            SUM((d.detect = 0) * d.bans) AS passive_bans,
+            SUM((d.detect = 0) * d.possible_bans) AS passive_possible_bans
+        FROM (
+            SELECT DISTINCT r.reportingID, r.reportedID, IFNULL(r.manual_detect, 0) AS detect, c.bans, c.possible_bans, c.incorrect_reports
+            FROM tmpLabelChanges c
+            JOIN Reports r ON (r.reportedID = c.player_id)
+            WHERE r.ID <= :watermark
+        ) d
+        GROUP BY d.reportingID
+    ) d ON (d.reportingID = rc.reporter_id)
+    SET
+        rc.manual_bans = rc.manual_bans + d.manual_bans,
+        rc.manual_possible_bans = rc.manual_possible_bans + d.manual_possible_bans,
+        rc.manual_incorrect_reports = rc.manual_incorrect_reports + d.manual_incorrect_reports,
+        rc.passive_bans = rc.passive_bans + d.passive_bans,
+        rc.passive_possible_bans = rc.passive_possible_bans + d.passive_possible_bans
+''')
+sql_apply_labels_xp = text('''
+    UPDATE reporterContributions rc
+    JOIN (
+        SELECT d.reportingID, SUM(d.xp) AS xp
+        FROM (
+            SELECT DISTINCT r.reportingID, r.reportedID, c.xp
+            FROM tmpLabelChanges c
+            JOIN Reports r ON (r.reportedID = c.player_id)
+            WHERE r.ID <= :watermark
+                AND c.xp <> 0
+        ) d
+        GROUP BY d.reportingID
+    ) d ON (d.reportingID = rc.reporter_id)
+    SET rc.total_xp_removed = rc.total_xp_removed + d.xp
+''')
+
+# the feedback counter is a count on the voter_id index
+sql_refresh_feedback = text('''
+    UPDATE reporterContributions rc
+    JOIN (
+        SELECT voter_id, COUNT(*) AS feedback
+        FROM PredictionsFeedback
+        WHERE voter_id IN :voter_ids
+        GROUP BY voter_id
+    ) fb ON (fb.voter_id = rc.reporter_id)
+    SET rc.feedback = fb.feedback
+''')
+
+# reported players of these reporters whose labels in reporterContributionLabels are not the current ones
+sql_select_drifted = text('''
+    SELECT DISTINCT r.reportedID
+    FROM Reports r
+    JOIN Players pl ON (pl.id = r.reportedID)
+    LEFT JOIN reporterContributionLabels lb ON (lb.player_id = r.reportedID)
+    WHERE r.reportingID IN :reporter_ids
+        AND (
+            NOT pl.possible_ban <=> IFNULL(lb.possible_ban, 0)
+            OR NOT pl.confirmed_ban <=> IFNULL(lb.confirmed_ban, 0)
+            OR NOT pl.confirmed_player <=> IFNULL(lb.confirmed_player, 0)
+        )
+''')
+
+
+async def sql_select_contributions(reporter_ids: List[int]) -> List[dict]:
+    sql = f'''
+        SELECT reporter_id, {', '.join(COUNTER_COLUMNS)}, UNIX_TIMESTAMP(updated_at) AS updated_at
+        FROM reporterContributions
+        WHERE reporter_id IN :reporter_ids
+    '''
+    data = await execute_sql(sql, param={'reporter_ids': tuple(reporter_ids)})
+    return [dict(r) for r in data.rows2dict()]
+
+
+async def in_transaction(fn: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    '''run fn(session) in one transaction, it is retried on a deadlock or lock wait timeout'''
+    async def run():
+        async with get_session(EngineType.PLAYERDATA) as session:
+            result = await fn(session)
+            await session.commit()
+            return result
+    return await default_policy.run(run)
+
+
+def label_changes(old: List[dict], new: List[dict]) -> List[dict]:
+    '''
+        the change of the counted labels of every player whose labels changed, with the new labels.
+        Possible bans are counted without the confirmed bans, like in sql_refresh.
+    '''
+    def labels(row):
+        return {c: int(row[c] or 0) for c in LABEL_COLUMNS}
+
+    zero = dict.fromkeys(LABEL_COLUMNS, 0)
+    old = {r['player_id']: labels(r) for r in old}
+
+    changes = []
+    for row in new:
+        after, before = labels(row), old.get(row['player_id'], zero)
+        if after == before:
+            continue
+        changes.append({
+            'player_id': row['player_id'],
+            'bans': after['confirmed_ban'] - before['confirmed_ban'],
+            'possible_bans': (after['possible_ban'] - after['confirmed_ban']) - (before['possible_ban'] - before['confirmed_ban']),
+            'incorrect_reports': after['confirmed_player'] - before['confirmed_player'],
+            'xp': after['xp'] - before['xp'],
+            'labels': dict(after, player_id=row['player_id']),
+        })
+    return changes
+
+
+async def apply_label_changes(player_ids: List[int]) -> int:
+    '''
+        add the change of the labels of these players to the counters of everyone who reported them,
+        then store the labels as counted. Returns the players whose labels changed.
+    '''
+    async def apply(session):
+        param = {'player_ids': tuple(player_ids)}
+        watermark = (await session.execute(sql_select_watermark)).scalar()
+
+        # the counted labels are locked, so a change is applied once by one replica
+        await session.execute(sql_insert_labels, [{'player_id': i} for i in player_ids])
+        old = (await session.execute(sql_lock_labels, param)).mappings().all()
+        new = (await session.execute(sql_select_labels, param)).mappings().all()
+
+        changes = label_changes(old, new)
+        if not changes:
+            return 0
+
+        await session.execute(label_changes_create)
+        await session.execute(label_changes_clear)
+        await session.execute(label_changes_insert, [{k: v for k, v in c.items() if k != 'labels'} for c in changes])
+        await session.execute(sql_apply_labels, {'watermark': watermark})
+        await session.execute(sql_apply_labels_xp, {'watermark': watermark})
+        await session.execute(label_changes_drop)
+        await session.execute(sql_update_labels, [c['labels'] for c in changes])
+        return len(changes)
+
+    return await in_transaction(apply)
+
+
+async def apply_new_reports(batch_size: int = 100_000) -> int:
+    '''add the reports after the watermark to the counters, batch_size ids at a time. Returns the ids moved over'''
+    async def apply(session):
+        from_id = (await session.execute(sql_lock_watermark)).scalar()
+        max_id = (await session.execute(sql_max_report_id)).scalar() or 0
+        to_id = min(max_id, from_id + batch_size)
+        if to_id <= from_id:
+            return 0
+
+        param = {'from_id': from_id, 'to_id': to_id}
+        await session.execute(sql_apply_reports, param)
+        await session.execute(sql_apply_reports_xp, param)
+        await session.execute(sql_update_watermark, param)
+        return to_id - from_id
+
+    moved = 0
+    while True:
+        step = await in_transaction(apply)
+        moved += step
+        if step < batch_size:
+            return moved
+
+
+async def sql_refresh_feedback_counts(voter_ids: List[int]) -> None:
+    await execute_sql(sql_refresh_feedback, param={'voter_ids': tuple(voter_ids)})
+
+
+async def select_drifted(reporter_ids: List[int]) -> List[int]:
+    async with get_session(EngineType.PLAYERDATA) as session:
+        data = await session.execute(sql_select_drifted, {'reporter_ids': tuple(reporter_ids)})
+    return [r[0] for r in data]
+
+
+async def sql_refresh_contributions(reporter_ids: List[int]) -> None:
+    '''recompute reporters from scratch, the watermark is share locked so no new reports are applied meanwhile'''
+    async def refresh(session):
+        watermark = (await session.execute(sql_select_watermark)).scalar()
+        await session.execute(sql_refresh, {'reporter_ids': tuple(reporter_ids), 'watermark': watermark})
+
+    await in_transaction(refresh)
+
+
+async def repair_contributions(reporter_ids: List[int]) -> None:
+    '''
+        recompute the counters of reporters, for reporters without counters and for repair.
+        Label changes of their reported players that were never applied (changed outside of the api)
+        are applied first, for everyone who reported those players.
+    '''
+    drifted = await select_drifted(reporter_ids)
+    for i in range(0, len(drifted), 1_000):
+        await apply_label_changes(drifted[i:i + 1_000])
+    await sql_refresh_contributions(reporter_ids)
+
+
+async def refresh_contributions(rows: List[dict]) -> None:
+    '''
+        Flush of the refresh queue, rows are one of:
+            {'reported_id': id} the ban labels of a player changed, the change is applied to everyone who reported it
+            {'reports': 1} reports were added, the reports after the watermark are applied on every flush
+            {'voter_id': id} a player gave feedback, their feedback is counted again
+            {'reporter_id': id} the counters of a reporter are missing or old, they are recomputed
+        Every player is handled once per flush, however often it was marked.
+    '''
+    reported_ids = sorted({r['reported_id'] for r in rows if 'reported_id' in r})
+    voter_ids = sorted({r['voter_id'] for r in rows if 'voter_id' in r})
+    reporter_ids = sorted({r['reporter_id'] for r in rows if 'reporter_id' in r})
+
+    changed = 0
+    for i in range(0, len(reported_ids), 1_000):
+        changed += await apply_label_changes(reported_ids[i:i + 1_000])
+
+    # reports reach Reports from stgReports some time after they were marked,
+    # every flush applies what is there by then
+    reports = await apply_new_reports(Config.contribution_report_batch)
+
+    for i in range(0, len(voter_ids), 1_000):
+        await sql_refresh_feedback_counts(voter_ids[i:i + 1_000])
+
+    for i in range(0, len(reporter_ids), 500):
+        await repair_contributions(reporter_ids[i:i + 500])
+
+    logger.debug({
+        "message": "contributions refreshed", "label_changes": changed, "report_ids": reports,
+        "voters": len(voter_ids), "recomputed": len(reporter_ids)
+    })
+
+
+contribution_queue = WriteBehindQueue(
+    name='contributions',
+    flush_function=refresh_contributions,
+    batch_size=10_000,
+    flush_interval=Config.contribution_refresh_interval,
+    max_size=1_000_000
+)
+
+
+async def mark(rows: List[dict], what: str) -> None:
+    try:
+        await contribution_queue.put(rows)
+    except QueueFull:
+        logger.warning({"message": "contribution refresh dropped, queue is full", "marked": what, "rows": len(rows)})
+
+
+async def mark_reports() -> None:
+    '''reports were added, they are counted by the first flush after they are in Reports'''
+    await mark([{'reports': 1}], 'reports')
+
+
+async def mark_voters(voter_ids: List[int]) -> None:
+    '''these players gave feedback'''
+    await mark([{'voter_id': i} for i in set(voter_ids)], 'voters')
+
+
+async def mark_reporters(reporter_ids: List[int]) -> None:
+    '''the counters of these players are missing or old, recompute them'''
+    await mark([{'reporter_id': i} for i in set(reporter_ids)], 'reporters')
+
+
+async def mark_reported(reported_ids: List[int]) -> None:
+    '''the ban labels of these players changed'''
+    await mark([{'reported_id': i} for i in set(reported_ids)], 'reported')
+
+
+async def get_contributions(names: List[str]) -> Dict[str, int]:
+    '''
+        summed counters of the given normalized names, one row per account.
+        Rows that are missing or older than contribution_max_age are queued for a refresh,
+        the current values are returned right away.
+    '''
+    player_ids = await player_names.resolve(names)
+    reporter_ids = list(set(player_ids.values()))
+
+    totals = {c: 0 for c in COUNTER_COLUMNS}
+    if not reporter_ids:
+        return totals
+
+    rows = await sql_select_contributions(reporter_ids)
+    for row in rows:
+        for c in COUNTER_COLUMNS:
+            totals[c] += int(row[c] or 0)
+
+    now = time.time()
+    fresh = {r['reporter_id'] for r in rows if now - r['updated_at'] < Config.contribution_max_age}
+    stale = [i for i in reporter_ids if i not in fresh]
+    if stale:
+        await mark_reporters(stale)
+    return totals
+
+
+async def contribution_stats(names: List[str], version: str = None, add_patron_stats: bool = False) -> dict:
+    '''the /stats/contributions/ response from the materialized counters'''
+    counters = await get_contributions(names)
+
+    manual_dict = {
+        "reports": counters['manual_reports'],
+        "bans": counters['manual_bans'],
+        "possible_bans": counters['manual_possible_bans'],
+        "incorrect_reports": counters['manual_incorrect_reports']
+    }
+
+    passive_dict = {
+        "reports": counters['passive_reports'],
+        "bans": counters['passive_bans'],
+        "possible_bans": counters['passive_possible_bans']
+    }
+
+    total_dict = {
+        "reports": passive_dict['reports'] + manual_dict['reports'],
+        "bans": passive_dict['bans'] + manual_dict['bans'],
+        "possible_bans": passive_dict['possible_bans'] + manual_dict['possible_bans'],
+        'feedback': counters['feedback']
+    }
+
+    if version in ['1.3', '1.3.1']:
+        return total_dict
+
+    if add_patron_stats:
+        total_dict["total_xp_removed"] = counters['total_xp_removed']
+
+    return {
+        "passive": passive_dict,
+        "manual": manual_dict,
+        "total": total_dict
+    }
@@ -1,8 +1,12 @@
+import time
 from enum import Enum, auto
 from typing import AsyncGenerator
 
 from api import Config
+from api.database.instrumentation import instrument_engine
+from api.utils.metrics import Counter, Gauge
 from contextlib import asynccontextmanager
+from sqlalchemy.exc import TimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
@@ -13,14 +17,24 @@ class EngineType(Enum):
     DISCORD = auto()
 
 
+POOL_SIZE = Gauge('db_pool_size', 'Configured connections kept open by the pool.', ('engine',))
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections currently checked out of the pool.', ('engine',))
+POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections open above pool_size.', ('engine',))
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Sessions that got a connection.', ('engine',))
+POOL_WAIT_SECONDS = Counter('db_pool_wait_seconds_total', 'Time sessions waited for a connection.', ('engine',))
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Sessions that gave up waiting for a connection after pool_timeout.', ('engine',))
+
+
 class Engine():
     def __init__(self, engine_type: EngineType = EngineType.PLAYERDATA):
         self.type = engine_type
         
         if self.type == EngineType.PLAYERDATA:
             connection_string = Config.sql_uri
+            pool_size, max_overflow = Config.playerdata_pool_size, Config.playerdata_max_overflow
         elif self.type == EngineType.DISCORD:
             connection_string = Config.discord_sql_uri
+            pool_size, max_overflow = Config.discord_pool_size, Config.discord_max_overflow
         else:
             raise ValueError(f"Engine type {engine_type} not valid.")
 
@@ -28,13 +42,22 @@ class Engine():
             connection_string, 
             poolclass=QueuePool,
             pool_pre_ping=True,
-            pool_size=100, 
-            max_overflow=5000,
+            pool_size=pool_size, 
+            max_overflow=max_overflow,
+            pool_timeout=Config.pool_timeout,
             pool_recycle=3600
         )
         # self.engine.echo = True
         self.session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=True)
 
+        name = self.type.name.lower()
+        pool = self.engine.sync_engine.pool
+        POOL_SIZE.set(pool_size, engine=name)
+        POOL_CHECKED_OUT.set_function(pool.checkedout, engine=name)
+        # negative while the pool has not opened pool_size connections yet
+        POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0), engine=name)
+        instrument_engine(self.engine.sync_engine, name)
+
 
 """Our Database Engines"""
 PLAYERDATA_ENGINE = Engine(EngineType.PLAYERDATA)
@@ -45,16 +68,25 @@ DISCORD_ENGINE = Engine(EngineType.DISCORD)
 async def get_session(type: EngineType) -> AsyncGenerator[AsyncSession, None]:
     """Provides an AsyncGenerator to allow creation of a database session."""
     if type == EngineType.PLAYERDATA:
-        async with PLAYERDATA_ENGINE.session() as session:
-            yield session
-
-            await session.close()
-
+        engine = PLAYERDATA_ENGINE
     elif type == EngineType.DISCORD:
-        async with DISCORD_ENGINE.session() as session:
-            yield session
+        engine = DISCORD_ENGINE
+    else:
+        raise ValueError(f"Engine type {type} not valid.")
 
-            await session.close()
+    async with engine.session() as session:
+        # check out the connection up front, to measure the wait for it
+        name = type.name.lower()
+        start = time.perf_counter()
+        try:
+            await session.connection()
+        except TimeoutError:
+            POOL_TIMEOUTS.inc(engine=name)
+            raise
+        finally:
+            POOL_WAIT_SECONDS.inc(time.perf_counter() - start, engine=name)
+        POOL_CHECKOUTS.inc(engine=name)
 
-    else:
-        raise ValueError(f"Engine type {type} not valid.")
\ No newline at end of file
+        yield session
+
+        await session.close()
@@ -0,0 +1,358 @@
+'''
+    Export jobs, the ban export of a discord user is built in the background.
+    Submitting returns a job that can be polled, the rows of every linked account are
+    streamed from the database into a csv or xlsx writer, and the finished file is
+    registered in export_links to be downloaded with /discord/download_export.
+    The status of a job is kept in export_jobs in the discord database, any replica can report it.
+'''
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import random
+import secrets
+import string
+import threading
+import time
+from typing import List, Optional, Set
+
+from api import Config
+from api.database.database import EngineType
+from api.database.functions import execute_sql
+from api.database.statements import insert_statement, update_statement
+from api.database.streaming import stream_partitions
+from api.utils.cache import LRUCache
+from api.utils.export_writers import EXTENSIONS, WRITERS
+from api.utils.fan_out import fan_out
+from api.utils.metrics import Counter, Gauge
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+EXPORT_JOBS = Counter('export_jobs_total', 'Finished export jobs by status, done or failed.', ('status',))
+EXPORT_ROWS = Counter('export_rows_total', 'Rows streamed from the database into exports.')
+EXPORTS_RUNNING = Gauge('export_jobs_running', 'Export jobs building a file.')
+
+NO_ACCOUNTS = "User doesn't have any accounts linked."
+NO_DATA = "No ban data available for the linked account(s). Possibly the server timed out."
+
+sql_ban_rows = text('''
+    SELECT
+        pl1.name reporter,
+        lbl.label,
+        hdl.*
+    FROM Reports rp
+    INNER JOIN Players pl1 ON (rp.reportingID = pl1.id)
+    INNER JOIN Players pl2 on (rp.reportedID = pl2.id)
+    INNER JOIN Labels lbl ON (pl2.label_id = lbl.id)
+    INNER JOIN playerHiscoreDataLatest hdl on (pl2.id = hdl.Player_id)
+    where 1=1
+        and lower(pl1.name) = :player_name
+        and pl2.confirmed_ban = 1
+        and pl2.possible_ban = 1
+''')
+
+
+# rows is a reserved word in mysql, the column is row_count
+JOB_COLUMNS = ['status', 'accounts', 'accounts_done', 'failed_accounts', 'row_count', 'url', 'error', 'finished_at']
+
+sql_insert_job = insert_statement('export_jobs', ['job_id', 'discord_id', 'file_type', 'created_at'] + JOB_COLUMNS)
+sql_update_job = update_statement('export_jobs', JOB_COLUMNS, key='job_id')
+sql_expire_jobs = text('DELETE FROM export_jobs WHERE created_at < :expired')
+sql_select_job = text('''
+    SELECT *
+    FROM export_jobs
+    WHERE job_id = :job_id
+        AND created_at >= :expired
+''')
+
+
+class ExportFailed(Exception):
+    pass
+
+
+async def sql_get_discord_linked_accounts(discord_id: int):
+    sql = 'SELECT * FROM verified_players WHERE Discord_id = :discord_id and Verified_status = 1'
+
+    param = {
+        'discord_id': discord_id
+    }
+
+    data = await execute_sql(sql, param, engine_type=EngineType.DISCORD)
+    return data.rows2dict() if data is not None else {}
+
+
+async def insert_export_link(export_info: dict):
+
+    sql = insert_statement('export_links', export_info.keys(), ignore=True)
+
+    await execute_sql(sql, param=export_info, engine_type=EngineType.DISCORD)
+    return
+
+
+async def create_random_link():
+    pool = string.ascii_letters + string.digits
+
+    link = ''.join(random.choice(pool) for i in range(12))
+
+    return link
+
+
+async def ban_rows(player_name: str):
+    '''the ban rows of one account, in chunks of export_chunk_size rows'''
+    sql = sql_ban_rows.bindparams(player_name=player_name)
+    async for partition in stream_partitions(sql, chunk_size=Config.export_chunk_size):
+        yield [dict(row._mapping) for row in partition]
+
+
+class ExportJob:
+    '''status of one export, status is queued, running, done or failed'''
+    def __init__(self, discord_id: int, display_name: str, file_type: str):
+        self.id = secrets.token_urlsafe(12)
+        self.discord_id = discord_id
+        self.display_name = display_name
+        self.file_type = file_type
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.accounts = 0
+        self.accounts_done = 0
+        self.failed_accounts: List[str] = []
+        self.rows = 0
+        self.url: Optional[str] = None
+        self.error: Optional[str] = None
+        self.done = asyncio.Event()
+
+    def to_row(self) -> dict:
+        '''the export_jobs row of the job'''
+        return {
+            'job_id': self.id,
+            'discord_id': self.discord_id,
+            'file_type': self.file_type,
+            'status': self.status,
+            'accounts': self.accounts,
+            'accounts_done': self.accounts_done,
+            'failed_accounts': json.dumps(self.failed_accounts),
+            'row_count': self.rows,
+            'url': self.url,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'file_type': self.file_type,
+            'accounts': self.accounts,
+            'accounts_done': self.accounts_done,
+            'failed_accounts': self.failed_accounts,
+            'rows': self.rows,
+            'url': self.url,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+def job_status(row: dict) -> dict:
+    '''the status of a job from its export_jobs row, like ExportJob.to_dict'''
+    return {
+        'job_id': row['job_id'],
+        'status': row['status'],
+        'file_type': row['file_type'],
+        'accounts': row['accounts'],
+        'accounts_done': row['accounts_done'],
+        'failed_accounts': json.loads(row['failed_accounts'] or '[]'),
+        'rows': row['row_count'],
+        'url': row['url'],
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'finished_at': row['finished_at'],
+    }
+
+
+async def sql_insert_export_job(job: ExportJob, job_ttl: float) -> None:
+    '''register a new job, the jobs older than job_ttl are removed'''
+    await execute_sql(sql_expire_jobs, param={'expired': time.time() - job_ttl}, engine_type=EngineType.DISCORD)
+    await execute_sql(sql_insert_job, param=job.to_row(), engine_type=EngineType.DISCORD)
+
+
+async def sql_select_export_job(job_id: str, job_ttl: float) -> Optional[dict]:
+    data = await execute_sql(sql_select_job, param={'job_id': job_id, 'expired': time.time() - job_ttl}, engine_type=EngineType.DISCORD)
+    rows = data.rows2dict()
+    return dict(rows[0]) if rows else None
+
+
+async def save_export_job(job: ExportJob) -> None:
+    '''write the status of a job, a failed write leaves the previous status for the other replicas'''
+    try:
+        await execute_sql(sql_update_job, param=job.to_row(), engine_type=EngineType.DISCORD)
+    except Exception as e:
+        logger.warning({"message": "export status not saved", "job_id": job.id, "status": job.status, "error": str(e)})
+
+
+async def build_ban_export(job: ExportJob) -> None:
+    '''stream the ban rows of every linked account into the export file and register its download link'''
+    linked_accounts = await sql_get_discord_linked_accounts(job.discord_id)
+    if len(linked_accounts) == 0:
+        raise ExportFailed(NO_ACCOUNTS)
+    job.accounts = len(linked_accounts)
+    await save_export_job(job)
+
+    export_dir = f"{os.getcwd()}/exports/"
+    pathlib.Path(export_dir).mkdir(parents=True, exist_ok=True)
+
+    file_name = f"{job.display_name}_bans.{EXTENSIONS[job.file_type]}"
+    file_path = export_dir + file_name
+    # written under a temporary name, a download never gets a half written file
+    partial_path = f"{file_path}.{job.id}.part"
+
+    writer = await asyncio.to_thread(WRITERS[job.file_type], partial_path)
+    # the accounts are streamed in parallel, their chunks are written one at a time.
+    # The lock is taken in the writing thread, a write of a timed out account still finishes before the next
+    write_lock = threading.Lock()
+
+    def write(name, rows):
+        with write_lock:
+            writer.write(name, rows)
+
+    def close():
+        with write_lock:
+            writer.close()
+
+    def discard():
+        try:
+            close()
+        except Exception:
+            pass
+        _remove(partial_path)
+
+    async def export_account(account):
+        async with contextlib.aclosing(ban_rows(account.name)) as chunks:
+            async for rows in chunks:
+                await asyncio.to_thread(write, account.name, rows)
+                job.rows += len(rows)
+                EXPORT_ROWS.inc(len(rows))
+        job.accounts_done += 1
+        await save_export_job(job)
+
+    try:
+        outcomes = await fan_out(
+            export_account,
+            linked_accounts,
+            concurrency=Config.export_account_concurrency,
+            timeout=Config.export_account_timeout,
+            name='export_accounts'
+        )
+        await asyncio.to_thread(close)
+    except BaseException:
+        await asyncio.to_thread(discard)
+        raise
+
+    # an account that failed is left out or incomplete, the export is still made of the others
+    job.failed_accounts = [o.item.name for o in outcomes if not o.ok]
+
+    if writer.rows == 0:
+        await asyncio.to_thread(_remove, partial_path)
+        raise ExportFailed(NO_DATA)
+
+    os.replace(partial_path, file_path)
+
+    export_data = {
+        "url_text": await create_random_link(),
+        "discord_id": job.discord_id,
+        "file_name": file_name,
+        "is_csv" if job.file_type == 'csv' else "is_excel": 1,
+    }
+    await insert_export_link(export_data)
+    job.url = export_data["url_text"]
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportJobs:
+    '''
+        Runs export jobs in the background, at most concurrency at a time.
+        The status of a job is written to export_jobs when it starts, at every finished account and when it ends,
+        it can be polled on any replica for job_ttl seconds. A job whose replica goes away mid export keeps its last status.
+    '''
+    def __init__(self, concurrency: int, job_ttl: float, max_jobs: int = 10_000, build=build_ban_export):
+        self.build = build
+        self.job_ttl = job_ttl
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs = LRUCache(max_size=max_jobs, ttl=job_ttl)
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, discord_id: int, display_name: str, file_type: str) -> ExportJob:
+        if file_type not in WRITERS:
+            raise ValueError(f"File type specified is invalid: {file_type}")
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        job = ExportJob(discord_id, display_name, file_type)
+        # registered before the job id is returned, a poll on another replica finds it
+        await sql_insert_export_job(job, self.job_ttl)
+        self._jobs.set(job.id, job)
+
+        # the job keeps running when the request that submitted it goes away
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        '''a job that was submitted to this replica'''
+        return self._jobs.get(job_id, None)
+
+    async def status(self, job_id: str) -> Optional[dict]:
+        '''the status of a job of any replica, None when it is unknown or expired'''
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+
+        row = await sql_select_export_job(job_id, self.job_ttl)
+        return None if row is None else job_status(row)
+
+    async def _run(self, job: ExportJob) -> None:
+        async with self._semaphore:
+            job.status = 'running'
+            EXPORTS_RUNNING.inc()
+            await save_export_job(job)
+            try:
+                await self.build(job)
+                job.status = 'done'
+            except ExportFailed as e:
+                job.status, job.error = 'failed', str(e)
+            except asyncio.CancelledError:
+                job.status, job.error = 'failed', 'Export was cancelled.'
+                raise
+            except Exception as e:
+                logger.error({"message": "export failed", "job_id": job.id, "error": str(e)})
+                job.status, job.error = 'failed', NO_DATA
+            finally:
+                EXPORTS_RUNNING.dec()
+                EXPORT_JOBS.inc(status=job.status)
+                job.finished_at = time.time()
+                await asyncio.shield(save_export_job(job))
+                job.done.set()
+
+    async def stop(self) -> None:
+        '''cancel the running jobs, their partial files are removed'''
+        tasks: List[asyncio.Task] = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+export_jobs = ExportJobs(concurrency=Config.export_concurrency, job_ttl=Config.export_job_ttl)
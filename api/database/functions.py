@@ -1,9 +1,8 @@
-import asyncio
+import base64
+import json
 import logging
-import random
 import re
-import traceback
-from asyncio.tasks import create_task
+import time
 from collections import namedtuple
 from datetime import datetime, timedelta
 from typing import List
@@ -11,13 +10,22 @@ from typing import List
 # Although never directly used, the engines are imported to add a permanent reference
 # to these entities to prevent the
 # garbage collector from trying to dispose of our engines.
+from api import Config
+from api.database.coalesce import read_sql
 from api.database.database import (DISCORD_ENGINE, PLAYERDATA_ENGINE, Engine,
                                    EngineType, get_session)
 from api.database.models import ApiPermission, ApiUsage, ApiUser, ApiUserPerm
-from fastapi import HTTPException
-from sqlalchemy import text
-from sqlalchemy.exc import InternalError, OperationalError
+from api.database.retry import SqlError, default_policy
+from api.database.statements import text_statement
+from api.database.streaming import loaded_columns
+from api.utils.cache import MISSING, LRUCache
+from api.utils.fan_out import fan_out, raise_failed
+from api.utils.ratelimit import SlidingWindowRateLimiter
+from api.utils.single_flight import SingleFlight
+from api.utils.write_behind import QueueFull, WriteBehindQueue
+from fastapi import HTTPException, Response
 from sqlalchemy.sql.expression import insert, select
+from sqlalchemy.sql.functions import func
 
 logger = logging.getLogger(__name__)
 
@@ -39,57 +47,88 @@ async def jagexify_names_list(names: List[str]) -> List[str]:
     return [await to_jagex_name(n) for n in names if await is_valid_rsn(n)]
 
 
-async def execute_sql(sql, param={}, debug=False, engine_type=EngineType.PLAYERDATA, row_count=100_000, page=1, is_retry=False, has_return=None, retry_attempt=0):
-    # retry breakout
-    if retry_attempt >= 5:
-        logger.debug({'message':'Too many retries'})
+async def execute_sql(sql, param={}, debug=False, engine_type=EngineType.PLAYERDATA, row_count=100_000, page=1):
+    '''
+        Executes a raw sql statement, deadlocks and lock wait timeouts are retried (see api.database.retry).
+        sql is a string or a prepared statement from api.database.statements, only strings are paginated.
+        Raises SqlError when the statement fails.
+    '''
+    if not isinstance(param, list):
+        param = dict(param)
+    has_return = True if str(sql).strip().lower().startswith('select') else False
+
+    if has_return and isinstance(sql, str):
+        # add pagination to every query
+        # max number of rows = 100k
+        row_count = row_count if row_count <= 100_000 else 100_000
+        page = page if page >= 1 else 1
+        offset = (page - 1)*row_count
+        # add limit to sql
+        sql = f'{sql} limit :offset, :row_count;'
+        # add the param
+        param['offset'] = offset
+        param['row_count'] = row_count
+
+    # parsing, the same text() object is reused for the same sql
+    if isinstance(sql, str):
+        sql = text_statement(sql)
+
+    async def execute():
+        if has_return:
+            # identical concurrent reads share one query
+            rows = await read_sql(sql, param, engine_type)
+            return sql_cursor(rows)
+
+        async with get_session(engine_type) as session:
+            await session.execute(sql, param)
+            await session.commit()
         return None
-    sleep = 5 * retry_attempt
 
-    if not is_retry:
-        has_return = True if sql.strip().lower().startswith('select') else False
+    try:
+        return await default_policy.run(execute)
+    except SqlError as e:
+        logger.error({"message": "sql failed", "reason": e.reason, "error": str(e.__cause__) if debug else str(e)})
+        raise
+
+
+def encode_cursor(value) -> str:
+    '''opaque pagination cursor, holding the last seen key'''
+    return base64.urlsafe_b64encode(json.dumps([value]).encode()).decode()
 
-        if has_return:
-            # add pagination to every query
-            # max number of rows = 100k
-            row_count = row_count if row_count <= 100_000 else 100_000
-            page = page if page >= 1 else 1
-            offset = (page - 1)*row_count
-            # add limit to sql
-            sql = f'{sql} limit :offset, :row_count;'
-            # add the param
-            param['offset'] = offset
-            param['row_count'] = row_count
-
-        # parsing
-        sql = text(sql)
 
+def decode_cursor(cursor: str):
     try:
-        async with get_session(engine_type) as session:
-            # execute session
-            rows = await session.execute(sql, param)
-            # parse data
-            records = sql_cursor(rows) if has_return else None
-            # commit session
-            await session.commit()
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))[0]
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
-    # OperationalError = Deadlock, InternalError = lock timeout
-    except OperationalError as e:
-        e = e if debug else ''
-        logger.debug({"message": f'Deadlock, Retry Attempt: {retry_attempt}, retrying {e}'})
-        await asyncio.sleep(random.uniform(0.1, sleep))
-        records = await execute_sql(sql, param, debug, engine_type, row_count, page, is_retry=True, has_return=has_return, retry_attempt=retry_attempt+1)
-    except InternalError as e:
-        e = e if debug else ''
-        logger.debug({"message": f'Lock, Retry Attempt: {retry_attempt}, retrying: {e}'})
-        await asyncio.sleep(random.uniform(0.1, sleep))
-        records = await execute_sql(sql, param, debug, engine_type, row_count, page, is_retry=True, has_return=has_return, retry_attempt=retry_attempt+1)
-    except Exception as e:
-        logger.error({"message":'Unknown Error', "error": e})
-        logger.error(traceback.print_exc())
-        records = None
-
-    return records
+
+def keyset_paginate(sql, column, row_count: int, cursor: str = None, page: int = 1):
+    '''
+        Seek pagination on a unique, indexed column: rows after the cursor, in column order.
+        Without a cursor, page > 1 falls back to the deprecated offset pagination.
+    '''
+    sql = sql.order_by(column).limit(row_count)
+
+    if cursor is not None:
+        return sql.where(column > decode_cursor(cursor))
+
+    return sql.offset(row_count*(page-1))
+
+
+def paginate_rows(rows: List[dict], key: str, row_count: int, cursor: str = None, page: int = 1) -> List[dict]:
+    '''keyset_paginate for rows that are already in memory, sorted on key'''
+    if cursor is not None:
+        last = decode_cursor(cursor)
+        return [r for r in rows if r[key] > last][:row_count]
+
+    return rows[row_count*(page-1):row_count*page]
+
+
+def set_next_cursor(response: Response, rows: List[dict], key: str, row_count: int) -> None:
+    '''a full page means there may be more rows, the next page starts after the last key'''
+    if len(rows) == row_count:
+        response.headers['X-Next-Cursor'] = encode_cursor(rows[-1][key])
 
 
 class sql_cursor:
@@ -109,15 +148,36 @@ class sqlalchemy_result:
         self.rows = [row[0] for row in rows]
 
     def rows2dict(self):
-        return [{col.name: getattr(row, col.name) for col in row.__table__.columns} for row in self.rows]
+        # deferred columns are not loaded, reading them would query again
+        return [{col.name: getattr(row, col.name) for col in loaded_columns(type(row))} for row in self.rows]
 
     def rows2tuple(self):
-        columns = [col.name for col in self.rows[0].__table__.columns]
+        columns = [col.name for col in loaded_columns(type(self.rows[0]))]
         Record = namedtuple('Record', columns)
-        return [Record(*[getattr(row, col.name) for col in row.__table__.columns]) for row in self.rows]
+        return [Record(*[getattr(row, c) for c in columns]) for row in self.rows]
 
 
-async def verify_token(token: str, verification: str, route: str = None) -> bool:
+token_cache = LRUCache(max_size=10_000, ttl=Config.token_cache_ttl)
+rate_limiter = SlidingWindowRateLimiter(window=3600)
+usage_sync = SingleFlight()
+
+
+def invalidate_token(token: str = None) -> None:
+    '''
+        Drop the cached permissions of a token, or of all tokens, so the next request reads them again.
+        Call it after changing a user's permissions, ratelimit or active status. It only clears the cache
+        of this process, other replicas pick the change up within token_cache_ttl seconds.
+    '''
+    if token is None:
+        token_cache.clear()
+        return
+
+    for key in token_cache.keys():
+        if key[0] == token:
+            token_cache.delete(key)
+
+
+async def sql_get_api_user(token: str, verification: str) -> dict:
     sql = select(ApiUser)
     sql = sql.where(ApiUser.token == token)
     sql = sql.where(ApiPermission.permission == verification)
@@ -126,42 +186,85 @@ async def verify_token(token: str, verification: str, route: str = None) -> bool
         ApiPermission, ApiUserPerm.permission_id == ApiPermission.id
     )
 
-    sql_usage = select(ApiUsage)
-    sql_usage = sql_usage.where(ApiUser.id == ApiUsage.user_id)
-    sql_usage = sql_usage.where(ApiUser.token == token)
-    sql_usage = sql_usage.where(
+    async with get_session(EngineType.PLAYERDATA) as session:
+        api_user = await session.execute(sql)
+
+    api_user = sqlalchemy_result(api_user).rows2dict()
+    return None if len(api_user) == 0 else api_user[0]
+
+
+async def sql_count_api_usage(user_id: int) -> int:
+    sql = select(func.count(ApiUsage.id))
+    sql = sql.where(ApiUsage.user_id == user_id)
+    sql = sql.where(
         ApiUsage.timestamp >= datetime.utcnow() - timedelta(hours=1)
     )
 
     async with get_session(EngineType.PLAYERDATA) as session:
-        api_user = await session.execute(sql)
-        usage_data = await session.execute(sql_usage)
+        usage = await session.execute(sql)
+    return usage.scalar()
 
-        api_user = sqlalchemy_result(api_user)
-        usage_data = sqlalchemy_result(usage_data)
 
-        api_user = api_user.rows2dict()
-        usage_data = usage_data.rows2dict()
+async def sql_insert_api_usage(usage: List[dict]) -> None:
+    sql = insert(ApiUsage)
+    async with get_session(EngineType.PLAYERDATA) as session:
+        await session.execute(sql, usage)
+        await session.commit()
 
-        # Checks to see if there is a user ID
-        if not len(api_user) == 0:
-            insert_values = {}
-            insert_values['route'] = route
-            insert_values['user_id'] = api_user[0]['id']
-            insert_usage = insert(ApiUsage).values(insert_values)
-            await session.execute(insert_usage)
-            await session.commit()
 
-    # If len api_user == 0; user does not have necessary permissions
-    if len(api_user) == 0:
+usage_queue = WriteBehindQueue(
+    name='api_usage',
+    flush_function=sql_insert_api_usage,
+    batch_size=1_000,
+    flush_interval=5.0
+)
+
+
+async def sync_usage(user_id: int) -> None:
+    '''read the usage of a user from apiUsage, concurrent requests of the user share one read'''
+    async def sync():
+        count = await sql_count_api_usage(user_id)
+        rate_limiter.prune()
+        rate_limiter.seed(user_id, count)
+
+    await usage_sync.do(user_id, sync)
+
+
+async def verify_token(token: str, verification: str, route: str = None) -> bool:
+    # permissions are cached, a token without the permission is cached as None.
+    # permissions, ratelimits and active status are changed in the database, not through the api,
+    # a change takes effect within token_cache_ttl seconds, or right away after invalidate_token
+    api_user = token_cache.get((token, verification))
+
+    if api_user is MISSING:
+        api_user = await sql_get_api_user(token, verification)
+        token_cache.set((token, verification), api_user)
+
+    # If api_user is None; user does not have necessary permissions
+    if api_user is None:
         raise HTTPException(status_code=401, detail=f"Insufficent Permissions")
 
-    api_user = api_user[0]
+    user_id = api_user['id']
+
+    # the usage of the last hour is read from the database, then counted in memory until the next sync.
+    # apiUsage has the requests of every replica, so the limit holds across them within the sync interval
+    seeded_at = rate_limiter.seeded_at(user_id)
+    if seeded_at is None or time.time() - seeded_at > Config.ratelimit_sync_interval:
+        await sync_usage(user_id)
+
+    # the usage before this request, like the count of apiUsage before its insert
+    usage = rate_limiter.count(user_id)
+    rate_limiter.hit(user_id)
+
+    try:
+        await usage_queue.put([{'user_id': user_id, 'route': route}])
+    except QueueFull:
+        logger.warning({"message": "api usage queue full, usage not stored", "user_id": user_id})
 
     if api_user['is_active'] != 1:
         raise HTTPException(status_code=403, detail=f"Insufficent Permissions")
         
-    if (len(usage_data) > api_user['ratelimit']) and (api_user['ratelimit'] != -1):
+    if (usage > api_user['ratelimit']) and (api_user['ratelimit'] != -1):
         raise HTTPException(status_code=429, detail=f"Your Ratelimit has been reached.")
 
     return True
@@ -169,7 +272,8 @@ async def verify_token(token: str, verification: str, route: str = None) -> bool
 
 async def batch_function(function, data, batch_size=100):
     '''
-        smaller transactions, can reduce locks, but individual transaction, can cause connection pool overflow
+        smaller transactions, can reduce locks, at most batch_concurrency batches run at once
+        so the batches never take the whole connection pool
     '''
     batches = []
     for i in range(0, len(data), batch_size):
@@ -177,8 +281,7 @@ async def batch_function(function, data, batch_size=100):
         batch = data[i:i+batch_size]
         batches.append(batch)
 
-    await asyncio.gather(*[
-        create_task(function(batch)) for batch in batches
-    ])
+    outcomes = await fan_out(function, batches, concurrency=Config.batch_concurrency, name=function.__name__)
+    raise_failed(outcomes)
 
     return
@@ -0,0 +1,291 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from api import Config
+from api.database.database import EngineType, get_session
+from api.database.functions import execute_sql
+from api.database.retry import default_policy
+from api.database.statements import insert_statement
+from api.utils.single_flight import SingleFlight
+from api.utils.write_behind import QueueFull, WriteBehindQueue
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# The tiles count the reports up to the watermark (the last counted Reports.ID) of the players in heatmapBans,
+# the confirmed bans as the tiles know them. New reports after the watermark are added per tile, a ban
+# transition of a player adds or subtracts its reports per tile, both in every computed region only.
+# A region is recomputed in full the first time it is read and once it is expired.
+
+sql_select_watermark = text('SELECT last_report_id FROM heatmapWatermark WHERE id = 1 LOCK IN SHARE MODE')
+sql_lock_watermark = text('SELECT last_report_id FROM heatmapWatermark WHERE id = 1 FOR UPDATE')
+sql_update_watermark = text('UPDATE heatmapWatermark SET last_report_id = :to_id WHERE id = 1')
+sql_max_report_id = text('SELECT MAX(ID) FROM Reports')
+
+# recompute the tiles of a set of regions, counts every report of a banned player like the old heatmap
+sql_clear_tiles = text('DELETE FROM heatmapTiles WHERE region_id IN :region_ids')
+sql_refresh_tiles = text('''
+    INSERT INTO heatmapTiles (region_id, x_coord, y_coord, confirmed_ban)
+    SELECT rpts.region_id, rpts.x_coord, rpts.y_coord, COUNT(*)
+    FROM Reports rpts
+    JOIN heatmapBans ban ON (ban.player_id = rpts.reportedID)
+    WHERE rpts.region_id IN :region_ids
+        AND rpts.ID <= :watermark
+    GROUP BY rpts.region_id, rpts.x_coord, rpts.y_coord
+''')
+sql_refresh_regions = text('''
+    INSERT INTO heatmapRegions (region_id, updated_at)
+    VALUES (:region_id, CURRENT_TIMESTAMP)
+    ON DUPLICATE KEY UPDATE updated_at = VALUES(updated_at)
+''')
+
+# players whose ban is not the one in heatmapBans, the rows are locked until the transition is applied
+sql_select_transitions = text('''
+    SELECT pl.id, pl.confirmed_ban <=> 1 AS banned
+    FROM Players pl
+    LEFT JOIN heatmapBans ban ON (ban.player_id = pl.id)
+    WHERE pl.id IN :player_ids
+        AND (pl.confirmed_ban <=> 1) <> (ban.player_id IS NOT NULL)
+    FOR UPDATE OF ban
+''')
+# the reports of players per tile, added with sign 1 or subtracted with sign -1, in the computed regions only
+sql_apply_transitions = text('''
+    INSERT INTO heatmapTiles (region_id, x_coord, y_coord, confirmed_ban)
+    SELECT rpts.region_id, rpts.x_coord, rpts.y_coord, :sign * COUNT(*)
+    FROM Reports rpts
+    JOIN heatmapRegions hr ON (hr.region_id = rpts.region_id)
+    WHERE rpts.reportedID IN :player_ids
+        AND rpts.ID <= :watermark
+    GROUP BY rpts.region_id, rpts.x_coord, rpts.y_coord
+    ON DUPLICATE KEY UPDATE confirmed_ban = confirmed_ban + VALUES(confirmed_ban)
+''')
+# the reports from from_id to to_id of banned players, in the computed regions only
+sql_apply_reports = text('''
+    INSERT INTO heatmapTiles (region_id, x_coord, y_coord, confirmed_ban)
+    SELECT rpts.region_id, rpts.x_coord, rpts.y_coord, COUNT(*)
+    FROM Reports rpts
+    JOIN heatmapBans ban ON (ban.player_id = rpts.reportedID)
+    JOIN heatmapRegions hr ON (hr.region_id = rpts.region_id)
+    WHERE rpts.ID > :from_id AND rpts.ID <= :to_id
+    GROUP BY rpts.region_id, rpts.x_coord, rpts.y_coord
+    ON DUPLICATE KEY UPDATE confirmed_ban = confirmed_ban + VALUES(confirmed_ban)
+''')
+sql_insert_bans = insert_statement('heatmapBans', ['player_id'], ignore=True)
+sql_delete_bans = text('DELETE FROM heatmapBans WHERE player_id IN :player_ids')
+
+# players reported in these regions whose ban changed outside of the api
+sql_select_drifted = text('''
+    SELECT DISTINCT rpts.reportedID
+    FROM Reports rpts
+    JOIN Players pl ON (pl.id = rpts.reportedID)
+    LEFT JOIN heatmapBans ban ON (ban.player_id = rpts.reportedID)
+    WHERE rpts.region_id IN :region_ids
+        AND (pl.confirmed_ban <=> 1) <> (ban.player_id IS NOT NULL)
+''')
+
+
+async def sql_refresh_heatmaps(region_ids: List[int]) -> None:
+    param = {'region_ids': tuple(region_ids)}
+
+    # one transaction, readers never see a region without its tiles
+    async def refresh():
+        async with get_session(EngineType.PLAYERDATA) as session:
+            # share locked, no new reports are applied meanwhile
+            watermark = (await session.execute(sql_select_watermark)).scalar()
+            await session.execute(sql_clear_tiles, param)
+            await session.execute(sql_refresh_tiles, dict(param, watermark=watermark))
+            await session.execute(sql_refresh_regions, [{'region_id': r} for r in region_ids])
+            await session.commit()
+
+    await default_policy.run(refresh)
+
+
+async def apply_transitions(player_ids: List[int]) -> int:
+    '''apply the ban transitions of these players to the tiles, returns the players that had one'''
+    async def apply():
+        async with get_session(EngineType.PLAYERDATA) as session:
+            watermark = (await session.execute(sql_select_watermark)).scalar()
+            rows = await session.execute(sql_select_transitions, {'player_ids': tuple(player_ids)})
+            banned, unbanned = split_transitions(rows.mappings().all())
+
+            if banned:
+                await session.execute(sql_apply_transitions, {'player_ids': tuple(banned), 'sign': 1, 'watermark': watermark})
+                await session.execute(sql_insert_bans, [{'player_id': i} for i in banned])
+            if unbanned:
+                await session.execute(sql_apply_transitions, {'player_ids': tuple(unbanned), 'sign': -1, 'watermark': watermark})
+                await session.execute(sql_delete_bans, {'player_ids': tuple(unbanned)})
+            await session.commit()
+            return len(banned) + len(unbanned)
+
+    return await default_policy.run(apply)
+
+
+async def apply_new_reports(batch_size: int = 100_000) -> int:
+    '''add the reports after the watermark to the tiles, batch_size ids at a time. Returns the ids moved over'''
+    async def apply():
+        async with get_session(EngineType.PLAYERDATA) as session:
+            from_id = (await session.execute(sql_lock_watermark)).scalar()
+            max_id = (await session.execute(sql_max_report_id)).scalar() or 0
+            to_id = min(max_id, from_id + batch_size)
+            if to_id <= from_id:
+                return 0
+
+            param = {'from_id': from_id, 'to_id': to_id}
+            await session.execute(sql_apply_reports, param)
+            await session.execute(sql_update_watermark, param)
+            await session.commit()
+            return to_id - from_id
+
+    moved = 0
+    while True:
+        step = await default_policy.run(apply)
+        moved += step
+        if step < batch_size:
+            return moved
+
+
+def split_transitions(rows: List[dict]) -> Tuple[List[int], List[int]]:
+    '''the newly banned and the unbanned players of sql_select_transitions'''
+    banned = [r['id'] for r in rows if r['banned']]
+    unbanned = [r['id'] for r in rows if not r['banned']]
+    return banned, unbanned
+
+
+async def select_drifted(region_ids: List[int]) -> List[int]:
+    async with get_session(EngineType.PLAYERDATA) as session:
+        data = await session.execute(sql_select_drifted, {'region_ids': tuple(region_ids)})
+    return [r[0] for r in data]
+
+
+async def recompute_regions(region_ids: List[int]) -> None:
+    '''
+        compute regions from scratch, for cold and expired regions.
+        Bans of their reported players that changed outside of the api are applied first.
+    '''
+    drifted = await select_drifted(region_ids)
+    for i in range(0, len(drifted), 1_000):
+        await apply_transitions(drifted[i:i + 1_000])
+    await sql_refresh_heatmaps(region_ids)
+
+
+async def sql_select_heatmap(region_id: int) -> dict:
+    '''
+        the tiles of a region and when they were computed, updated_at is None if they never were.
+        Tiles that an unban took back to 0 are left out, the next recompute deletes them.
+    '''
+    sql = '''
+        SELECT x_coord, y_coord, confirmed_ban
+        FROM heatmapTiles
+        WHERE region_id = :region_id
+            AND confirmed_ban > 0
+        ORDER BY x_coord, y_coord
+    '''
+    tiles = await execute_sql(sql, param={'region_id': region_id})
+
+    sql = 'SELECT UNIX_TIMESTAMP(updated_at) AS updated_at FROM heatmapRegions WHERE region_id = :region_id'
+    region = await execute_sql(sql, param={'region_id': region_id})
+    region = region.rows2dict()
+
+    return {
+        'tiles': [dict(t) for t in tiles.rows2dict()],
+        'updated_at': region[0]['updated_at'] if region else None
+    }
+
+
+async def refresh_heatmaps(rows: List[dict]) -> None:
+    '''
+        Flush of the refresh queue. Rows are {'player_id': id} for a ban label change,
+        which is added to or subtracted from the tiles the player was reported on,
+        {'reports': 1} for new reports, or {'region_id': id} for a region that is not computed or expired,
+        which is recomputed. Every player and region is handled once per flush, however often it was marked.
+    '''
+    player_ids = sorted({r['player_id'] for r in rows if 'player_id' in r})
+    region_ids = sorted({r['region_id'] for r in rows if 'region_id' in r})
+
+    transitions = 0
+    for i in range(0, len(player_ids), 1_000):
+        transitions += await apply_transitions(player_ids[i:i + 1_000])
+
+    # reports reach Reports from stgReports some time after they were marked,
+    # every flush applies what is there by then
+    reports = await apply_new_reports(Config.heatmap_report_batch)
+
+    for i in range(0, len(region_ids), 50):
+        await recompute_regions(region_ids[i:i + 50])
+
+    logger.debug({
+        "message": "heatmaps refreshed", "players": len(player_ids), "transitions": transitions,
+        "report_ids": reports, "regions": len(region_ids)
+    })
+
+
+region_flight = SingleFlight()
+
+heatmap_queue = WriteBehindQueue(
+    name='heatmaps',
+    flush_function=refresh_heatmaps,
+    batch_size=10_000,
+    flush_interval=Config.heatmap_refresh_interval,
+    max_size=1_000_000
+)
+
+
+async def mark_banned(player_ids: List[int]) -> None:
+    '''the ban labels of these players changed'''
+    try:
+        await heatmap_queue.put([{'player_id': i} for i in set(player_ids)])
+    except QueueFull:
+        logger.warning({"message": "heatmap refresh dropped, queue is full", "players": len(player_ids)})
+
+
+async def mark_heatmap_reports() -> None:
+    '''reports were added, they are counted by the first flush after they are in Reports'''
+    try:
+        await heatmap_queue.put([{'reports': 1}])
+    except QueueFull:
+        logger.warning({"message": "heatmap refresh dropped, queue is full", "marked": "reports"})
+
+
+def zoom_tiles(tiles: List[dict], zoom: int) -> List[dict]:
+    '''merge tiles into blocks of 2**zoom by 2**zoom tiles, a block is named after its lowest coordinates'''
+    if zoom == 0:
+        return tiles
+
+    blocks: Dict[tuple, int] = {}
+    for tile in tiles:
+        key = (tile['x_coord'] >> zoom << zoom, tile['y_coord'] >> zoom << zoom)
+        blocks[key] = blocks.get(key, 0) + tile['confirmed_ban']
+    return [{'x_coord': x, 'y_coord': y, 'confirmed_ban': c} for (x, y), c in sorted(blocks.items())]
+
+
+async def get_heatmap(region_id: int, zoom: int = 0, compute: bool = False) -> Optional[List[dict]]:
+    '''
+        confirmed bans per tile of a region, from the tile store.
+        A region that was never computed is queued and None is returned, or with compute it is computed now.
+        One older than heatmap_max_age is queued and returned as it is.
+    '''
+    heatmap = await sql_select_heatmap(region_id)
+
+    if heatmap['updated_at'] is None and compute:
+        # concurrent reads of the same cold region share one computation
+        await region_flight.do(region_id, lambda: recompute_regions([region_id]))
+        heatmap = await sql_select_heatmap(region_id)
+    elif heatmap['updated_at'] is None or time.time() - heatmap['updated_at'] > Config.heatmap_max_age:
+        try:
+            await heatmap_queue.put([{'region_id': region_id}])
+        except QueueFull:
+            logger.warning({"message": "heatmap refresh dropped, queue is full", "region_id": region_id})
+
+    if heatmap['updated_at'] is None:
+        return None
+    return zoom_tiles(heatmap['tiles'], zoom)
+
+
+def to_arrays(tiles: List[dict]) -> dict:
+    '''column arrays instead of one object per tile'''
+    return {
+        'x_coord': [t['x_coord'] for t in tiles],
+        'y_coord': [t['y_coord'] for t in tiles],
+        'confirmed_ban': [t['confirmed_ban'] for t in tiles],
+    }
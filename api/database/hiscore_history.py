@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from api import Config
+from api.database.database import EngineType, get_session
+from api.database.functions import execute_sql
+from api.utils.hiscore_codec import encode_history, history_state
+from api.utils.write_behind import QueueFull, WriteBehindQueue
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# compare and set on last_id, a history that was appended to in the meantime is left alone
+sql_upsert_history = '''
+    INSERT INTO playerHiscoreHistory (Player_id, snapshots, last_id, last_ts_date, data)
+    VALUES (:Player_id, :snapshots, :last_id, :last_ts_date, :data)
+    ON DUPLICATE KEY UPDATE
+        snapshots = IF(last_id <=> :previous_id, VALUES(snapshots), snapshots),
+        last_ts_date = IF(last_id <=> :previous_id, VALUES(last_ts_date), last_ts_date),
+        data = IF(last_id <=> :previous_id, VALUES(data), data),
+        last_id = IF(last_id <=> :previous_id, VALUES(last_id), last_id)
+'''
+
+
+async def sql_select_histories(player_ids: List[int]) -> Dict[int, dict]:
+    sql = '''
+        SELECT Player_id, snapshots, last_id, last_ts_date, data
+        FROM playerHiscoreHistory
+        WHERE Player_id IN :player_ids
+    '''
+    data = await execute_sql(sql, param={'player_ids': tuple(player_ids)}, row_count=100_000)
+    return {r['Player_id']: dict(r) for r in data.rows2dict()}
+
+
+# every hiscore of the players, without the row limit of execute_sql: a history is only written whole
+sql_select_hiscores_all = text('''
+    SELECT * FROM playerHiscoreData
+    WHERE Player_id IN :player_ids
+    ORDER BY Player_id, id
+''')
+sql_select_hiscores_since = text('''
+    SELECT * FROM playerHiscoreData
+    WHERE Player_id IN :player_ids
+        AND ts_date >= :since
+    ORDER BY Player_id, id
+''')
+
+
+async def sql_select_hiscores(player_ids: List[int], since=None) -> List[dict]:
+    '''the hiscores of players in id order, since a ts_date when given'''
+    param = {'player_ids': tuple(player_ids)}
+    sql = sql_select_hiscores_all
+    if since is not None:
+        sql, param['since'] = sql_select_hiscores_since, since
+
+    async with get_session(EngineType.PLAYERDATA) as session:
+        data = await session.execute(sql, param)
+    return [dict(r) for r in data.mappings()]
+
+
+def encode_histories(hiscores: List[dict], histories: Dict[int, dict]) -> List[dict]:
+    '''the upsert params of every player with hiscores that are not in their history yet'''
+    per_player: Dict[int, List[dict]] = {}
+    for hiscore in hiscores:
+        per_player.setdefault(hiscore['Player_id'], []).append(hiscore)
+
+    params = []
+    for player_id, player_rows in per_player.items():
+        history = histories.get(player_id)
+        if history is None:
+            data, snapshots, previous_id = encode_history(player_rows), len(player_rows), None
+        else:
+            player_rows = [r for r in player_rows if r['id'] > history['last_id']]
+            if not player_rows:
+                continue
+            data = history['data'] + encode_history(player_rows, history_state(history['data']))
+            snapshots, previous_id = history['snapshots'] + len(player_rows), history['last_id']
+
+        params.append({
+            'Player_id': player_id,
+            'snapshots': snapshots,
+            'last_id': player_rows[-1]['id'],
+            'last_ts_date': player_rows[-1]['ts_date'],
+            'data': data,
+            'previous_id': previous_id,
+        })
+
+    return params
+
+
+async def compact_players(player_ids: List[int]) -> int:
+    '''
+        new snapshots are encoded against the last one and appended, a player without
+        a history gets one from all of their hiscores. Returns the histories written.
+    '''
+    histories = await sql_select_histories(player_ids)
+
+    hiscores = []
+    new_players = [p for p in player_ids if p not in histories]
+    if new_players:
+        hiscores += await sql_select_hiscores(new_players)
+    if histories:
+        # only the days since the last snapshot are read for players that have a history
+        dates = [h['last_ts_date'] for h in histories.values() if h['last_ts_date'] is not None]
+        hiscores += await sql_select_hiscores(list(histories), min(dates) if dates else None)
+
+    # encoding is cpu bound, keep it off the event loop
+    params = await asyncio.to_thread(encode_histories, hiscores, histories)
+
+    if params:
+        await execute_sql(sql_upsert_history, param=params)
+    return len(params)
+
+
+async def compact_histories(rows: List[dict]) -> None:
+    '''flush of the history queue, rows are {'player_id': id} for players with new hiscores'''
+    player_ids = sorted({r['player_id'] for r in rows})
+
+    written = 0
+    for i in range(0, len(player_ids), 100):
+        written += await compact_players(player_ids[i:i + 100])
+
+    logger.debug({"message": "hiscore histories compacted", "players": len(player_ids), "written": written})
+
+
+history_queue = WriteBehindQueue(
+    name='hiscore_history',
+    flush_function=compact_histories,
+    batch_size=1_000,
+    flush_interval=Config.hiscore_history_interval,
+    max_size=1_000_000
+)
+
+
+async def mark_hiscores(player_ids: List[int]) -> None:
+    '''these players have new hiscores'''
+    try:
+        await history_queue.put([{'player_id': i} for i in set(player_ids)])
+    except QueueFull:
+        logger.warning({"message": "hiscore history dropped, queue is full", "players": len(player_ids)})
+
+
+async def get_history(player_id: int) -> Optional[bytes]:
+    '''
+        the encoded history of a player, see api.utils.hiscore_codec.
+        A player without one is compacted now, None when the player has no hiscores.
+    '''
+    histories = await sql_select_histories([player_id])
+    if player_id not in histories:
+        await compact_players([player_id])
+        histories = await sql_select_histories([player_id])
+
+    history = histories.get(player_id)
+    return None if history is None else history['data']
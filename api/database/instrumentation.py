@@ -0,0 +1,64 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from api.utils.metrics import Counter, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import default
+
+QUERY_SECONDS = Histogram('db_query_seconds', 'Time per statement on the database, by first keyword.', ('engine', 'statement'))
+QUERY_ROWS = Counter('db_query_rows_total', 'Rows returned or affected by statements, by first keyword.', ('engine', 'statement'))
+COMPILED_CACHE = Counter('db_compiled_cache_total', "Executions by SQLAlchemy's compiled cache result: hit, miss or uncached.", ('engine', 'result'))
+
+STATEMENTS = {'select', 'insert', 'update', 'delete', 'replace', 'create', 'drop'}
+
+
+class RequestStats:
+    '''database work of one request, filled in by the engine events'''
+    __slots__ = ('db_seconds', 'db_statements', 'db_rows')
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_statements = 0
+        self.db_rows = 0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def statement_kind(statement: str) -> str:
+    '''first keyword of a statement, other for anything unexpected to keep the labels bounded'''
+    kind = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+    return kind if kind in STATEMENTS else 'other'
+
+
+def instrument_engine(engine, name: str) -> None:
+    '''time statements and count compiled cache hits of a (sync) engine'''
+    cache_results = {default.CACHE_HIT: 'hit', default.CACHE_MISS: 'miss'}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        rows = max(getattr(cursor, 'rowcount', 0) or 0, 0)
+        kind = statement_kind(statement)
+
+        QUERY_SECONDS.observe(elapsed, engine=name, statement=kind)
+        QUERY_ROWS.inc(rows, engine=name, statement=kind)
+        COMPILED_CACHE.inc(engine=name, result=cache_results.get(getattr(context, 'cache_hit', None), 'uncached'))
+
+        stats = request_stats.get()
+        if stats is not None:
+            stats.db_seconds += elapsed
+            stats.db_statements += 1
+            stats.db_rows += rows
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # a failed statement never reaches after_cursor_execute
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
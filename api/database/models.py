@@ -1,9 +1,11 @@
 # coding: utf-8
 from datetime import datetime
-from sqlalchemy import BigInteger, Column, Date, DateTime, Float, ForeignKey, Index, Integer, String, TIMESTAMP, Text, text
+from sqlalchemy import BigInteger, Column, Date, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, TIMESTAMP, Text, text
+from sqlalchemy import Computed
+from sqlalchemy.dialects import mysql
 from sqlalchemy.dialects.mysql import TEXT, TINYINT, VARCHAR
 from sqlalchemy.dialects.mysql.types import DECIMAL, TINYTEXT
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.sqltypes import BIGINT
 
@@ -257,6 +259,13 @@ class Player(Base):
     hardcore_ironman = Column(TINYINT)
     ultimate_ironman = Column(TINYINT)
     normalized_name = Column(Text)
+    # first 64 bits of sha256(normalized_name), see api.database.player_names.name_key
+    # deferred, it is only for lookups and is not loaded with the player or returned by the api
+    name_key = deferred(Column(
+        mysql.BIGINT(unsigned=True),
+        Computed("cast(conv(left(sha2(normalized_name, 256), 16), 16, 10) as unsigned)", persisted=False),
+        index=True
+    ))
 
     label = relationship('Label')
 
@@ -657,3 +666,65 @@ class PlayerHiscoreDataXPChange(Base):
     zulrah = Column(Integer)
 
     Player = relationship('Player')
+
+
+class ReporterContributions(Base):
+    '''
+        Contribution counters per reporter, maintained by api.database.contributions.
+        The counts are over distinct (reported player, manual_detect) pairs of the reporter.
+    '''
+    __tablename__ = 'reporterContributions'
+
+    reporter_id = Column(ForeignKey('Players.id', ondelete='RESTRICT',
+                         onupdate='RESTRICT'), primary_key=True)
+    manual_reports = Column(Integer, nullable=False, server_default=text("'0'"))
+    manual_bans = Column(Integer, nullable=False, server_default=text("'0'"))
+    manual_possible_bans = Column(Integer, nullable=False, server_default=text("'0'"))
+    manual_incorrect_reports = Column(Integer, nullable=False, server_default=text("'0'"))
+    passive_reports = Column(Integer, nullable=False, server_default=text("'0'"))
+    passive_bans = Column(Integer, nullable=False, server_default=text("'0'"))
+    passive_possible_bans = Column(Integer, nullable=False, server_default=text("'0'"))
+    feedback = Column(Integer, nullable=False, server_default=text("'0'"))
+    total_xp_removed = Column(BigInteger, nullable=False, server_default=text("'0'"))
+    updated_at = Column(TIMESTAMP, nullable=False,
+                        server_default=text("CURRENT_TIMESTAMP"))
+
+    Player = relationship('Player')
+
+
+class HeatmapTile(Base):
+    '''
+        Reports of confirmed bans per tile of a region, maintained by api.database.heatmaps.
+        Planes (z_coord) are counted together.
+    '''
+    __tablename__ = 'heatmapTiles'
+
+    region_id = Column(Integer, primary_key=True)
+    x_coord = Column(Integer, primary_key=True)
+    y_coord = Column(Integer, primary_key=True)
+    confirmed_ban = Column(Integer, nullable=False, server_default=text("'0'"))
+
+
+class HeatmapRegion(Base):
+    '''when the tiles of a region were last computed'''
+    __tablename__ = 'heatmapRegions'
+
+    region_id = Column(Integer, primary_key=True)
+    updated_at = Column(TIMESTAMP, nullable=False,
+                        server_default=text("CURRENT_TIMESTAMP"))
+
+
+class PlayerHiscoreHistory(Base):
+    '''
+        The hiscores of a player as one delta encoded history, see api.utils.hiscore_codec.
+        Maintained by api.database.hiscore_history, last_id is the last playerHiscoreData row in data.
+    '''
+    __tablename__ = 'playerHiscoreHistory'
+
+    Player_id = Column(Integer, primary_key=True)
+    snapshots = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    last_ts_date = Column(Date)
+    data = Column(LargeBinary(16_777_215), nullable=False)
+    updated_at = Column(TIMESTAMP, nullable=False,
+                        server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"))
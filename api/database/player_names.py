@@ -0,0 +1,108 @@
+import hashlib
+import logging
+from typing import Dict, List
+
+from api import Config
+from api.database.database import EngineType, get_session
+from api.database.functions import jagexify_names_list
+from api.database.models import Player
+from api.utils.cache import MISSING, LRUCache
+from api.utils.metrics import Counter, Gauge
+from sqlalchemy.sql.expression import insert, select
+
+logger = logging.getLogger(__name__)
+
+NAME_CACHE_LOOKUPS = Counter('player_name_cache_lookups_total', 'Name to player id lookups.', ('result',))
+NAME_CACHE_SIZE = Gauge('player_name_cache_size', 'Entries in the name to player id cache.')
+
+
+def name_key(normalized_name: str) -> int:
+    '''first 64 bits of sha256, the same value as the generated Players.name_key column'''
+    return int.from_bytes(hashlib.sha256(normalized_name.encode()).digest()[:8], 'big')
+
+
+async def sql_select_players(names: List[str]) -> List[dict]:
+    names = set(await jagexify_names_list(names))
+    sql = select(Player.id, Player.normalized_name)
+    sql = sql.where(Player.name_key.in_(tuple({name_key(n) for n in names})))
+    async with get_session(EngineType.PLAYERDATA) as session:
+        data = await session.execute(sql)
+    # a key can be shared by other names, keep the exact matches
+    return [dict(row) for row in data.mappings() if row['normalized_name'] in names]
+
+
+async def sql_insert_player(new_names: List[dict]) -> None:
+    sql = insert(Player).prefix_with('ignore')
+    async with get_session(EngineType.PLAYERDATA) as session:
+        await session.execute(sql, new_names)
+        await session.commit()
+
+
+class PlayerNameResolver:
+    '''
+        Resolves normalized player names to player ids, backed by a bounded LRU cache.
+        Names that do not exist are cached as None for negative_ttl seconds.
+    '''
+    def __init__(self, max_size: int = 500_000, negative_ttl: float = 60, batch_size: int = 5_000):
+        self.cache = LRUCache(max_size=max_size)
+        self.negative_ttl = negative_ttl
+        self.batch_size = batch_size
+        NAME_CACHE_SIZE.set_function(lambda: len(self.cache))
+
+    async def resolve(self, names: List[str]) -> Dict[str, int]:
+        '''
+            returns {normalized_name: player_id}, names that do not exist are left out.
+        '''
+        found, missing = {}, []
+        for name in set(await jagexify_names_list(names)):
+            player_id = self.cache.get(name)
+            if player_id is MISSING:
+                missing.append(name)
+            elif player_id is not None:
+                found[name] = player_id
+
+        NAME_CACHE_LOOKUPS.inc(len(found), result='hit')
+        NAME_CACHE_LOOKUPS.inc(len(missing), result='miss')
+
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i+self.batch_size]
+            players = await sql_select_players(batch)
+            self.add(players)
+            found.update({p['normalized_name']: p['id'] for p in players})
+
+            # negative entries for names that are not in the database
+            for name in set(batch).difference(found):
+                self.cache.set(name, None, ttl=self.negative_ttl)
+
+        return found
+
+    async def resolve_or_create(self, names: List[str]) -> Dict[str, int]:
+        '''
+            returns {normalized_name: player_id}, players that do not exist yet are created.
+        '''
+        found = await self.resolve(names)
+        new_names = set(await jagexify_names_list(names)).difference(found)
+
+        if new_names:
+            await sql_insert_player([{"name": name, "normalized_name": name} for name in new_names])
+            self.forget(new_names)
+            found.update(await self.resolve(list(new_names)))
+        return found
+
+    def add(self, players: List[dict]) -> None:
+        '''add players (rows with id & normalized_name) to the cache'''
+        for player in players:
+            if player.get('normalized_name') is None:
+                continue
+            self.cache.set(player['normalized_name'], player['id'], ttl=None)
+
+    def forget(self, names: List[str]) -> None:
+        '''drop names from the cache, use after inserting or renaming players'''
+        for name in names:
+            self.cache.delete(name)
+
+
+player_names = PlayerNameResolver(
+    max_size=Config.player_name_cache_size,
+    negative_ttl=Config.player_name_negative_ttl
+)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from api import Config
+from api.utils.metrics import Counter
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# mysql error codes that are safe to retry, the transaction was rolled back
+RETRYABLE = {
+    1213: 'deadlock',
+    1205: 'lock_wait',
+}
+
+# mysql client errors of a refused or lost connection, not retried in place
+# because the statement may have run, but the database may be back later
+CONNECTION_ERRORS = {2002, 2003, 2006, 2013}
+
+SQL_RETRIES = Counter('db_retries_total', 'Statements retried, by reason.', ('reason',))
+SQL_RETRY_SECONDS = Counter('db_retry_seconds_total', 'Time spent backing off before a retry, by reason.', ('reason',))
+SQL_FAILURES = Counter('db_failures_total', 'Statements that failed for good, by reason.', ('reason',))
+
+_deadline: ContextVar[Optional[float]] = ContextVar('sql_deadline', default=None)
+
+
+class SqlError(Exception):
+    '''
+        A statement failed, after retrying if it could be retried.
+        reason is deadlock, lock_wait, deadline (no time left to retry),
+        connection (no connection to the database) or error.
+        Everything but error can succeed when it is tried again later.
+    '''
+    def __init__(self, reason: str, message: str = None):
+        super().__init__(message or reason)
+        self.reason = reason
+
+    @property
+    def retryable(self) -> bool:
+        return self.reason != 'error'
+
+
+def error_code(e: Exception) -> Optional[int]:
+    '''the mysql error code of a DBAPIError, None for other errors'''
+    if not isinstance(e, DBAPIError):
+        return None
+    args = getattr(e.orig, 'args', ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+
+def classify(e: Exception) -> Optional[str]:
+    '''the retry reason of an error, None if it should not be retried'''
+    return RETRYABLE.get(error_code(e))
+
+
+def is_connection_error(e: Exception) -> bool:
+    '''the database could not be reached, or the connection was lost'''
+    if isinstance(e, PoolTimeout):
+        return True
+    if isinstance(e, DBAPIError):
+        return e.connection_invalidated or error_code(e) in CONNECTION_ERRORS
+    return isinstance(e, (ConnectionError, asyncio.TimeoutError))
+
+
+@contextmanager
+def deadline(seconds: float):
+    '''statements in this context do not retry past now + seconds'''
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class RetryPolicy:
+    '''
+        Exponential backoff with full jitter, attempt n sleeps uniform(0, min(cap, base * 2**n)).
+        Stops after attempts tries or when the next sleep would end past the deadline,
+        the deadline is the policy's own or the one of the current request, whichever comes first.
+    '''
+    def __init__(self, attempts: int = 5, base: float = 0.05, cap: float = 2.0, deadline: float = 10.0):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        deadline_at = time.monotonic() + self.deadline
+        request_deadline = _deadline.get()
+        if request_deadline is not None:
+            deadline_at = min(deadline_at, request_deadline)
+
+        for attempt in range(self.attempts):
+            try:
+                return await fn()
+            except Exception as e:
+                reason = classify(e)
+                if reason is None:
+                    reason = 'connection' if is_connection_error(e) else 'error'
+                    SQL_FAILURES.inc(reason=reason)
+                    raise SqlError(reason, str(e)) from e
+
+                if attempt + 1 == self.attempts:
+                    SQL_FAILURES.inc(reason=reason)
+                    raise SqlError(reason, f'{reason}, gave up after {self.attempts} attempts') from e
+
+                sleep = self.backoff(attempt)
+                if time.monotonic() + sleep > deadline_at:
+                    SQL_FAILURES.inc(reason='deadline')
+                    raise SqlError('deadline', f'{reason}, no time left to retry') from e
+
+                logger.debug({"message": "retrying", "reason": reason, "attempt": attempt + 1, "sleep": sleep})
+                SQL_RETRIES.inc(reason=reason)
+                SQL_RETRY_SECONDS.inc(sleep, reason=reason)
+                await asyncio.sleep(sleep)
+
+
+default_policy = RetryPolicy(
+    attempts=Config.sql_retry_attempts,
+    base=Config.sql_retry_base,
+    cap=Config.sql_retry_cap,
+    deadline=Config.sql_retry_deadline
+)
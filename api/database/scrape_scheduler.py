@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Tuple
+
+from api import Config
+from api.database.functions import execute_sql
+from api.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SCRAPE_PENDING = Gauge('scrape_players_pending', 'Players queued to be leased to a scraper.')
+SCRAPE_LEASED = Gauge('scrape_players_leased', 'Players leased to a scraper and not yet returned.')
+SCRAPE_EXPIRED = Counter('scrape_players_expired_total', 'Leased players re-queued because the lease expired.')
+SCRAPE_REFILLS = Counter('scrape_refills_total', 'Refills of the scrape queue from playersToScrape.')
+
+
+class Lease:
+    def __init__(self, players: List[dict], expires_at: float):
+        self.id = uuid.uuid4().hex
+        self.expires_at = expires_at
+        self.player_ids = {p['id'] for p in players}
+        self.players = {p['id']: p for p in players}
+
+
+class ScrapeScheduler:
+    '''
+        Hands out disjoint leases of players to scrape.
+        Players are read from playersToScrape in id order (keyset), shuffled per chunk,
+        and queued in memory. A lease that is not returned before it expires is re-queued.
+        Leases are per process, replicas do not know each other's leases and can lease the same player,
+        a duplicate scrape costs a request and the hiscore insert ignores it.
+        With shards > 1 this process only reads the players where id % shards == shard,
+        the replicas are then disjoint when each one has its own shard.
+    '''
+    def __init__(self, lease_seconds: float = 900, refill_size: int = 50_000, shard: int = 0, shards: int = 1):
+        self.lease_seconds = lease_seconds
+        self.refill_size = refill_size
+        self.shard = shard
+        self.shards = shards
+
+        self._pending = deque()
+        self._leases: Dict[str, Lease] = {}
+        # player id -> lease id
+        self._leased: Dict[int, str] = {}
+        self._last_id = 0
+        self._lock = asyncio.Lock()
+
+        SCRAPE_PENDING.set_function(lambda: len(self._pending))
+        SCRAPE_LEASED.set_function(lambda: len(self._leased))
+
+    async def lease(self, amount: int) -> List[dict]:
+        async with self._lock:
+            self._requeue_expired()
+
+            if len(self._pending) < amount:
+                await self._refill(amount - len(self._pending))
+
+            players = [self._pending.popleft() for _ in range(min(amount, len(self._pending)))]
+
+            if players:
+                lease = Lease(players, time.monotonic() + self.lease_seconds)
+                self._leases[lease.id] = lease
+                self._leased.update({player_id: lease.id for player_id in lease.player_ids})
+
+        return players
+
+    def complete(self, player_ids: List[int]) -> None:
+        '''the scraper returned these players, release them from their lease'''
+        for player_id in player_ids:
+            lease_id = self._leased.pop(player_id, None)
+            if lease_id is None:
+                continue
+
+            lease = self._leases[lease_id]
+            lease.player_ids.discard(player_id)
+            if not lease.player_ids:
+                del self._leases[lease_id]
+
+    def _requeue_expired(self) -> None:
+        now = time.monotonic()
+        expired = [lease for lease in self._leases.values() if lease.expires_at < now]
+
+        for lease in expired:
+            del self._leases[lease.id]
+            for player_id in lease.player_ids:
+                self._leased.pop(player_id, None)
+                self._pending.append(lease.players[player_id])
+
+            SCRAPE_EXPIRED.inc(len(lease.player_ids))
+            logger.debug({"message": "lease expired", "lease": lease.id, "players": len(lease.player_ids)})
+
+    async def _refill(self, amount: int) -> None:
+        '''read the next chunk of players after the last seen id, wrap around at the end of the table'''
+        queued = {p['id'] for p in self._pending}
+        wrapped = False
+
+        while amount > 0:
+            sql = 'select * from playersToScrape WHERE id > :last_id'
+            param = {'last_id': self._last_id}
+
+            if self.shards > 1:
+                sql = f'{sql} AND MOD(id, :shards) = :shard'
+                param['shards'] = self.shards
+                param['shard'] = self.shard
+
+            sql = f'{sql} ORDER BY id'
+
+            row_count = max(amount, self.refill_size)
+            data = await execute_sql(sql, param=param, row_count=row_count)
+            players = [dict(p) for p in data.rows2dict()]
+            SCRAPE_REFILLS.inc()
+
+            end_of_table = len(players) < row_count
+            if players:
+                self._last_id = players[-1]['id']
+
+            players = [p for p in players if p['id'] not in self._leased and p['id'] not in queued]
+            random.shuffle(players)
+            self._pending.extend(players)
+            queued.update(p['id'] for p in players)
+            amount -= len(players)
+
+            if end_of_table:
+                # start over from the first id, at most once per refill
+                self._last_id = 0
+                if wrapped:
+                    break
+                wrapped = True
+
+
+def configured_shard() -> Tuple[int, int]:
+    '''
+        (shard, shards) of this process. A shard can not be derived from a Deployment's pod names,
+        so without an explicit scrape_shard every process reads every player.
+    '''
+    if Config.scrape_shards <= 1:
+        return 0, 1
+    if Config.scrape_shard is None:
+        logger.warning({"message": "scrape_shards is set without scrape_shard, sharding is off", "shards": Config.scrape_shards})
+        return 0, 1
+
+    shard = int(Config.scrape_shard)
+    if not 0 <= shard < Config.scrape_shards:
+        raise ValueError(f"scrape_shard {shard} is not in 0..{Config.scrape_shards - 1}.")
+    return shard, Config.scrape_shards
+
+
+scrape_shard, scrape_shards = configured_shard()
+scrape_scheduler = ScrapeScheduler(
+    lease_seconds=Config.scrape_lease_seconds,
+    shard=scrape_shard,
+    shards=scrape_shards
+)
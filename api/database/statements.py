@@ -0,0 +1,74 @@
+import re
+from typing import Callable, Hashable, Iterable
+
+from api.utils.cache import MISSING, LRUCache
+from api.utils.metrics import Counter, Gauge
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+STATEMENT_LOOKUPS = Counter('db_statement_registry_lookups_total', 'Lookups in the statement registry, hit or miss.', ('result',))
+STATEMENT_ENTRIES = Gauge('db_statement_registry_entries', 'Statements in the statement registry.')
+
+IDENTIFIER = re.compile(r'^\w+$')
+
+_statements = LRUCache(max_size=1_000)
+STATEMENT_ENTRIES.set_function(lambda: len(_statements))
+
+
+def _statement(key: Hashable, build: Callable[[], str]) -> TextClause:
+    statement = _statements.get(key)
+    if statement is not MISSING:
+        STATEMENT_LOOKUPS.inc(result='hit')
+        return statement
+
+    STATEMENT_LOOKUPS.inc(result='miss')
+    statement = text(build())
+    _statements.set(key, statement, ttl=None)
+    return statement
+
+
+def _identifiers(names: Iterable[str]) -> tuple:
+    # table and column names are put in the sql as is, only allow plain names
+    names = tuple(names)
+    for name in names:
+        if not IDENTIFIER.match(name):
+            raise ValueError(f"Not a valid identifier: {name!r}")
+    return names
+
+
+def text_statement(sql: str) -> TextClause:
+    '''a text() statement, the same object for the same sql'''
+    return _statement(('text', sql), lambda: sql)
+
+
+def insert_statement(table: str, columns: Iterable[str], ignore: bool = False, replace: bool = False) -> TextClause:
+    '''
+        insert [ignore] into table (columns) values (:columns), or replace into with replace=True.
+        Built once per (table, columns, operation), the params are named after the columns.
+    '''
+    table, = _identifiers([table])
+    columns = _identifiers(columns)
+    operation = 'replace' if replace else 'insert ignore' if ignore else 'insert'
+
+    def build():
+        names = ', '.join(columns)
+        values = ', '.join(f':{c}' for c in columns)
+        return f'{operation} into {table} ({names}) values ({values})'
+
+    return _statement((operation, table, columns), build)
+
+
+def update_statement(table: str, columns: Iterable[str], key: str, param: str = None) -> TextClause:
+    '''
+        update table set column=:column, ... where key=:param.
+        Built once per (table, columns, key), param defaults to the key column.
+    '''
+    table, key, param = _identifiers([table, key, param or key])
+    columns = _identifiers(columns)
+
+    def build():
+        values = ', '.join(f'{c}=:{c}' for c in columns)
+        return f'update {table} set {values} where {key}=:{param}'
+
+    return _statement(('update', table, columns, key, param), build)
+
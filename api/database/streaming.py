@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from typing import AsyncGenerator, Dict, List, Optional
+
+from api.database.database import EngineType, get_session
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import inspect
+from sqlalchemy.engine import Row
+
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def stream_format(request: Request, format: Optional[str] = None, media_types: Dict[str, str] = STREAM_MEDIA_TYPES) -> Optional[str]:
+    '''
+        the streaming format asked for with ?format= or the Accept header, None for a normal json response.
+    '''
+    if format in media_types:
+        return format
+
+    accept = request.headers.get('accept', '')
+    for fmt, media_type in media_types.items():
+        if media_type in accept:
+            return fmt
+    return None
+
+
+def loaded_columns(table) -> list:
+    '''the columns of a model that are loaded with it, deferred columns are left out'''
+    return [attr.columns[0] for attr in inspect(table).column_attrs if not attr.deferred]
+
+
+def core_columns(sql, table):
+    '''select the table columns instead of orm objects, rows are then plain mappings'''
+    return sql.with_only_columns(*loaded_columns(table))
+
+
+async def stream_partitions(sql, engine_type: EngineType = EngineType.PLAYERDATA, chunk_size: int = 1_000) -> AsyncGenerator[List[Row], None]:
+    '''
+        Yields the rows of sql in chunks, through a server side cursor,
+        so only chunk_size rows are in memory at a time.
+    '''
+    async with get_session(engine_type) as session:
+        result = await session.stream(sql)
+        async for partition in result.partitions(chunk_size):
+            yield partition
+
+
+async def stream_rows(sql, engine_type: EngineType = EngineType.PLAYERDATA, chunk_size: int = 1_000) -> AsyncGenerator[List[dict], None]:
+    async for partition in stream_partitions(sql, engine_type, chunk_size):
+        yield [dict(row._mapping) for row in partition]
+
+
+async def ndjson_lines(chunks: AsyncGenerator[List[dict], None]) -> AsyncGenerator[str, None]:
+    async for rows in chunks:
+        yield ''.join(json.dumps(row, default=str) + '\n' for row in rows)
+
+
+async def csv_lines(chunks: AsyncGenerator[List[dict], None]) -> AsyncGenerator[str, None]:
+    fieldnames = None
+    async for rows in chunks:
+        if not rows:
+            continue
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames or list(rows[0].keys()))
+
+        if fieldnames is None:
+            fieldnames = writer.fieldnames
+            writer.writeheader()
+
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def streaming_response(sql, fmt: str, engine_type: EngineType = EngineType.PLAYERDATA) -> StreamingResponse:
+    chunks = stream_rows(sql, engine_type)
+    lines = ndjson_lines(chunks) if fmt == 'ndjson' else csv_lines(chunks)
+    return StreamingResponse(lines, media_type=STREAM_MEDIA_TYPES[fmt])
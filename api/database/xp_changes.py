@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+from typing import List, Optional
+
+from api import Config
+from api.database.functions import execute_sql
+from api.utils.xp_changes import Snapshots, consecutive_gains, window_gains
+
+# the rows of one select of execute_sql
+ROW_LIMIT = 100_000
+
+
+async def sql_select_snapshots(player_ids: List[int], since: datetime.date, until: datetime.date) -> List[dict]:
+    '''
+        the hiscores of players from since to until, on the (Player_id, ts_date) index.
+        A player has at most one hiscore per day, so this is at most len(player_ids) times the days from
+        since to until rows. That must stay within ROW_LIMIT, see get_window_gains.
+    '''
+    sql = '''
+        SELECT *
+        FROM playerHiscoreData
+        WHERE Player_id IN :player_ids
+            AND ts_date BETWEEN :since AND :until
+    '''
+    param = {'player_ids': tuple(player_ids), 'since': since, 'until': until}
+    data = await execute_sql(sql, param=param, row_count=ROW_LIMIT)
+    return [dict(r) for r in data.rows2dict()]
+
+
+async def sql_select_latest_snapshots(player_id: int, count: int) -> List[dict]:
+    sql = '''
+        SELECT *
+        FROM playerHiscoreData
+        WHERE Player_id = :player_id
+        ORDER BY ts_date DESC
+    '''
+    data = await execute_sql(sql, param={'player_id': player_id}, row_count=count)
+    return [dict(r) for r in data.rows2dict()]
+
+
+async def get_latest_gains(player_id: int, count: int = 2) -> List[dict]:
+    '''the last count gains of a player from one scrape to the next, newest first'''
+    rows = await sql_select_latest_snapshots(player_id, count + 1)
+    return consecutive_gains(Snapshots(rows))[::-1]
+
+
+async def get_window_gains(player_ids: List[int], days: int, end: Optional[datetime.datetime] = None) -> List[dict]:
+    '''
+        per player, the gains over the days before end, see api.utils.xp_changes.gains_between.
+        The snapshots up to xp_change_lookback_days before the window are read to find where it starts,
+        for as many players per select as fit in ROW_LIMIT.
+    '''
+    end = end or datetime.datetime.utcnow()
+    since = (end - datetime.timedelta(days=days + Config.xp_change_lookback_days)).date()
+
+    players_per_select = max(1, ROW_LIMIT // ((end.date() - since).days + 1))
+    rows = []
+    for i in range(0, len(player_ids), players_per_select):
+        rows += await sql_select_snapshots(player_ids[i:i + players_per_select], since, end.date())
+
+    # building the matrix is cpu bound, keep it off the event loop
+    return await asyncio.to_thread(lambda: window_gains(Snapshots(rows), days, end))
@@ -2,18 +2,85 @@ import logging
 import time
 
 from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
 
+from api import Config
 from api.Config import app
+from api.database.instrumentation import RequestStats, request_stats
+from api.database.retry import SqlError, deadline
+from api.utils.metrics import Gauge, Histogram
 
 logger = logging.getLogger(__name__)
 
+# routes are labelled by their path template, so tokens and names in the path are not exported
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time from receiving a request until the last byte of the response.', ('method', 'route', 'status'))
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent on database statements per request.', ('method', 'route'))
+REQUEST_DB_ROWS = Histogram('http_request_db_rows', 'Rows returned or affected by the statements of a request.', ('method', 'route'), buckets=(0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000))
+RESPONSE_BYTES = Histogram('http_response_bytes', 'Size of the response body.', ('method', 'route'), buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled, including responses that are still streaming.')
+
+
+def route_name(request: Request) -> str:
+    '''path template of the route that handled the request'''
+    endpoint = request.scope.get('endpoint')
+    if endpoint is not None:
+        # an endpoint can be registered on more than one path
+        for route in request.app.router.routes:
+            if getattr(route, 'endpoint', None) is endpoint and route.matches(request.scope)[0] == Match.FULL:
+                return route.path
+    return 'unmatched'
+
+
+async def observe_body(body, request: Request, status: int, start: float, stats: RequestStats):
+    '''pass the response body through, the request is observed after its last chunk'''
+    size = 0
+    try:
+        async for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        method, route = request.method, route_name(request)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, route=route, status=status)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, method=method, route=route)
+        REQUEST_DB_ROWS.observe(stats.db_rows, method=method, route=route)
+        RESPONSE_BYTES.observe(size, method=method, route=route)
+
 
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
-    response = await call_next(request)
+    start = time.perf_counter()
+    stats = RequestStats()
+    REQUESTS_IN_FLIGHT.inc()
+
+    # statements of this request add their time to stats, and are not retried past the request deadline
+    token = request_stats.set(stats)
+    try:
+        with deadline(Config.request_deadline):
+            response = await call_next(request)
+    except Exception:
+        REQUESTS_IN_FLIGHT.dec()
+        raise
+    finally:
+        request_stats.reset(token)
     process_time = time.time() - start_time
 
+    response.body_iterator = observe_body(response.body_iterator, request, response.status_code, start, stats)
+
     url = request.url.remove_query_params('token')._url
-    logger.debug({"url": url, "process_time": process_time})
+    logger.debug({"url": url, "process_time": process_time, "db_time": stats.db_seconds, "db_statements": stats.db_statements})
     return response
+
+
+@app.exception_handler(SqlError)
+async def sql_error_handler(request: Request, exc: SqlError):
+    # deadlocks, lock waits and lost connections are worth retrying for the client, anything else is not
+    if exc.retryable:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Database is busy, please try again later."},
+            headers={'Retry-After': '1'}
+        )
+    return JSONResponse(status_code=500, content={"detail": "Database error."})
@@ -0,0 +1,47 @@
+from api.database.exports import export_jobs
+from api.database.functions import verify_token
+from api.utils.bulkhead import read_bulkhead
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+router = APIRouter()
+
+
+class ExportInfo(BaseModel):
+    discord_id: int
+    display_name: str
+    file_type: str
+
+
+@router.post("/v1/export/player_bans", tags=["Business"], dependencies=[Depends(read_bulkhead)])
+async def submit_ban_export(token: str, export_info: ExportInfo):
+    '''
+        Start building the ban export of the linked accounts of a discord user.
+        file_type is csv or excel, poll the returned job_id with GET /v1/export/{job_id}.
+        Business service: Discord
+    '''
+    await verify_token(token, verification='verify_players', route='[POST]/v1/export/player_bans')
+
+    try:
+        job = await export_jobs.submit(export_info.discord_id, export_info.display_name, export_info.file_type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="File type specified is invalid.")
+
+    return {'job_id': job.id, 'status': job.status}
+
+
+@router.get("/v1/export/{job_id}", tags=["Business"], dependencies=[Depends(read_bulkhead)])
+async def get_export_job(token: str, job_id: str):
+    '''
+        Status and progress of an export job, status is queued, running, done or failed.
+        When done, url is the id to download the file with /discord/download_export/{url},
+        failed_accounts are the linked accounts whose rows are missing or incomplete.
+        Business service: Discord
+    '''
+    await verify_token(token, verification='verify_players', route='[GET]/v1/export')
+
+    status = await export_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Export job not found, it may have expired.")
+
+    return status
@@ -1,10 +1,15 @@
 from typing import Optional
 from datetime import datetime
 
-from api.database.functions import (EngineType, get_session, sqlalchemy_result,
+from api.database.contributions import mark_voters
+from api.database.functions import (EngineType, get_session, keyset_paginate,
+                                    set_next_cursor, sqlalchemy_result,
                                     verify_token)
 from api.database.models import Player, PredictionsFeedback
-from fastapi import APIRouter, status, HTTPException, Query
+from api.database.streaming import (core_columns, stream_format,
+                                    streaming_response)
+from api.utils.bulkhead import read_bulkhead
+from fastapi import APIRouter, status, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from sqlalchemy.sql.expression import insert, select
 
@@ -21,7 +26,7 @@ class Feedback(BaseModel):
 
 router = APIRouter()
 
-@router.get("/v1/feedback/", tags=["Feedback"])
+@router.get("/v1/feedback/", tags=["Feedback"], dependencies=[Depends(read_bulkhead)])
 async def get_feedback(
         token: str,
         since_id:Optional[int]=None, 
@@ -35,7 +40,11 @@ async def get_feedback(
         feedback_text: Optional[str] = None,
         has_text:Optional[bool]=None, 
         row_count:Optional[int]=Query(100_000, ge=1, le=100_000), 
-        page:Optional[int]=Query(1, ge=1)):
+        page:Optional[int]=Query(1, ge=1, deprecated=True),
+        cursor:Optional[str]=None,
+        response:Response=None,
+        format:Optional[str]=Query(None, regex="^(json|ndjson|csv)$"),
+        request:Request=None):
     '''
         Get player feedback of a player
     '''
@@ -71,17 +80,23 @@ async def get_feedback(
     if not has_text == None:
         sql = sql.where(table.feedback_text != None)
 
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, table.id, row_count, cursor, page)
+
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, table), fmt)
 
     # execute query
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
 
 
-@router.post("/v1/feedback/", status_code=status.HTTP_201_CREATED, tags=["Feedback"])
+@router.post("/v1/feedback/", status_code=status.HTTP_201_CREATED, tags=["Feedback"], dependencies=[Depends(read_bulkhead)])
 async def post_feedback(feedback: Feedback):
     '''
         Insert feedback into database
@@ -105,4 +120,5 @@ async def post_feedback(feedback: Feedback):
         await session.execute(sql_insert)
         await session.commit()
 
+    await mark_voters([feedback["voter_id"]])
     return {"OK": "OK"}
@@ -0,0 +1,21 @@
+from api.database.functions import verify_token
+from api.database.heatmaps import get_heatmap, to_arrays
+from api.utils.bulkhead import read_bulkhead
+from fastapi import APIRouter, Depends, Query
+
+router = APIRouter()
+
+
+@router.get("/v1/heatmap", tags=["Business"], dependencies=[Depends(read_bulkhead)])
+async def get_region_heatmap(token: str, region_id: int, zoom: int = Query(0, ge=0, le=6)):
+    '''
+        Reports of confirmed bans per tile of a region, as column arrays.
+        zoom merges tiles into blocks of 2**zoom by 2**zoom tiles.
+        status is pending and the arrays are empty while a region is computed for the first time.
+        Business service: Discord
+    '''
+    await verify_token(token, verification='verify_players', route='[GET]/v1/heatmap')
+
+    tiles = await get_heatmap(region_id, zoom)
+    status = 'pending' if tiles is None else 'ready'
+    return {'region_id': region_id, 'zoom': zoom, 'status': status, **to_arrays(tiles or [])}
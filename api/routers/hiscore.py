@@ -1,11 +1,22 @@
+import asyncio
+import datetime
 from typing import Optional
 
+from api.database.columnar import COLUMNAR_MEDIA_TYPES, columnar_response
 from api.database.database import EngineType, get_session
-from api.database.functions import sqlalchemy_result, verify_token
+from api.database.functions import (keyset_paginate, paginate_rows,
+                                    set_next_cursor, sqlalchemy_result,
+                                    verify_token)
+from api.database.hiscore_history import get_history, mark_hiscores
 from api.database.models import (PlayerHiscoreDataLatest,
                                  PlayerHiscoreDataXPChange, playerHiscoreData, Player)
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from api.database.streaming import (core_columns, stream_format,
+                                    streaming_response)
+from api.database.xp_changes import get_window_gains
+from api.utils.bulkhead import export_bulkhead, ingest_bulkhead, read_bulkhead
+from api.utils.hiscore_codec import decode_deltas, decode_history
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field, conlist
 from sqlalchemy.sql.expression import insert, select
 import sqlalchemy.exc
 
@@ -103,19 +114,40 @@ class hiscore(BaseModel):
     zulrah: int
 
 
-@router.get("/v1/hiscore/", tags=["Hiscore"])
+async def history_response(player_id: int, decode, row_count: int, cursor: Optional[str], page: int, response: Response):
+    '''a page of rows decoded from the compact history of a player, see api.utils.hiscore_codec'''
+    history = await get_history(player_id)
+    # decoding a year of snapshots takes milliseconds, keep it off the event loop
+    data = [] if history is None else await asyncio.to_thread(decode, history, player_id)
+
+    data = paginate_rows(data, 'id', row_count, cursor, page)
+    set_next_cursor(response, data, 'id', row_count)
+    return data
+
+
+@router.get("/v1/hiscore/", tags=["Hiscore"], dependencies=[Depends(read_bulkhead)])
 async def get_player_hiscore_data(
     token: str,
     player_id: int = Query(..., ge=0),
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1)
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    format: Optional[str] = Query(None, regex="^(json|ndjson|csv)$"),
+    request: Request = None,
+    source: str = Query('table', regex="^(table|history)$"),
 ):
     '''
-        Select daily scraped hiscore data, by player_id
+        Select daily scraped hiscore data, by player_id.
+        source=history decodes the compact history of the player instead of reading a row per day,
+        it can be up to a minute behind the table.
     '''
     # verify token
     await verify_token(token, verification='verify_ban', route='[GET]/v1/hiscore')
 
+    if source == 'history':
+        return await history_response(player_id, decode_history, row_count, cursor, page, response)
+
     # query
     table = playerHiscoreData
     sql = select(table)
@@ -125,16 +157,22 @@ async def get_player_hiscore_data(
         sql = sql.where(table.Player_id == player_id)
 
     # paging
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, table.id, row_count, cursor, page)
+
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, table), fmt)
 
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
 
 
-@router.get("/v1/hiscore/Latest", tags=["Hiscore"])
+@router.get("/v1/hiscore/Latest", tags=["Hiscore"], dependencies=[Depends(read_bulkhead)])
 async def get_latest_hiscore_data_for_an_account(
     token: str,
     player_id: int = Query(..., ge=0)
@@ -160,11 +198,15 @@ async def get_latest_hiscore_data_for_an_account(
     return data.rows2dict()
 
 
-@router.get("/v1/hiscore/Latest/bulk", tags=["Hiscore"])
+@router.get("/v1/hiscore/Latest/bulk", tags=["Hiscore"], dependencies=[Depends(export_bulkhead)])
 async def get_latest_hiscore_data_by_player_features(
     token: str,
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1),
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    format: Optional[str] = Query(None, regex="^(json|ndjson|csv|arrow|parquet)$"),
+    request: Request = None,
     possible_ban: Optional[int] = Query(None, ge=0, le=1),
     confirmed_ban: Optional[int] = Query(None, ge=0, le=1),
     confirmed_player: Optional[int] = Query(None, ge=0, le=1),
@@ -200,32 +242,53 @@ async def get_latest_hiscore_data_by_player_features(
         sql = sql.where(Player.label_jagex == label_jagex)
 
     # paging
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, PlayerHiscoreDataLatest.id, row_count, cursor, page)
 
     # join
     sql = sql.join(Player)
 
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, PlayerHiscoreDataLatest), fmt)
+
+    # columnar export for the ML feature pulls
+    fmt = stream_format(request, format, COLUMNAR_MEDIA_TYPES)
+    if fmt is not None:
+        return columnar_response(core_columns(sql, PlayerHiscoreDataLatest), fmt)
+
     # execute query
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
 
 
-@router.get("/v1/hiscore/XPChange", tags=["Hiscore"])
+@router.get("/v1/hiscore/XPChange", tags=["Hiscore"], dependencies=[Depends(read_bulkhead)])
 async def get_account_hiscore_xp_change(
     token: str,
     player_id: int = Query(..., ge=0),
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1)
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    format: Optional[str] = Query(None, regex="^(json|ndjson|csv)$"),
+    request: Request = None,
+    source: str = Query('table', regex="^(table|history)$"),
 ):
     '''
-        Select daily scraped differential in hiscore data by Player ID
+        Select daily scraped differential in hiscore data by Player ID.
+        source=history returns the changes stored in the compact history of the player,
+        their id is the id of the later hiscore in playerHiscoreData.
     '''
     # verify token
     await verify_token(token, verification='verify_ban', route='[GET]/v1/hiscore/XPChange')
 
+    if source == 'history':
+        return await history_response(player_id, decode_deltas, row_count, cursor, page, response)
+
     # query
     table = PlayerHiscoreDataXPChange
     sql = select(table)
@@ -235,16 +298,45 @@ async def get_account_hiscore_xp_change(
         sql = sql.where(table.Player_id == player_id)
 
     # paging
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, table.id, row_count, cursor, page)
+
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, table), fmt)
 
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
+
+
+class XPChangeWindow(BaseModel):
+    '''
+        players and the window to compute their xp gains over, at most 90 days for 1000 players.
+        The snapshots are read in as many selects as the row limit of a select needs.
+    '''
+    player_ids: conlist(int, min_items=1, max_items=1_000)
+    days: int = Field(1, ge=1, le=90)
+    end: Optional[datetime.datetime] = None
+
+
+@router.post("/v1/hiscore/XPChange/bulk", tags=["Hiscore"], dependencies=[Depends(read_bulkhead)])
+async def get_hiscore_xp_change_of_players(token: str, window: XPChangeWindow):
+    '''
+        The gains of every hiscore column over the days before end (now by default), for many players at once.
+        Computed from the scraped hiscores, from the last scrape at or before the start of the window,
+        or the first one in it, to the last scrape at or before end, see start_timestamp and timestamp.
+        Players without a scrape in the window are left out.
+    '''
+    await verify_token(token, verification='verify_ban', route='[POST]/v1/hiscore/XPChange/bulk')
+
+    return await get_window_gains(window.player_ids, window.days, window.end)
 
 
-@router.post("/v1/hiscore", tags=["Hiscore"])
+@router.post("/v1/hiscore", tags=["Hiscore"], dependencies=[Depends(ingest_bulkhead)])
 async def post_hiscore_data_to_database(hiscores: hiscore, token: str):
     '''
         Insert hiscore data.
@@ -262,4 +354,5 @@ async def post_hiscore_data_to_database(hiscores: hiscore, token: str):
         await session.execute(sql_insert)
         await session.commit()
 
+    await mark_hiscores([hiscores.Player_id])
     return {'ok': 'ok'}
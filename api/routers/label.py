@@ -1,7 +1,8 @@
 from api.database.database import EngineType, get_session
 from api.database.functions import sqlalchemy_result, verify_token
 from api.database.models import Label as dbLabel
-from fastapi import APIRouter
+from api.utils.bulkhead import read_bulkhead
+from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from sqlalchemy.sql.expression import insert, select
 
@@ -10,7 +11,7 @@ router = APIRouter()
 class label(BaseModel):
     label_name:str
 
-@router.get("/v1/label/", tags=["Label"])
+@router.get("/v1/label/", tags=["Label"], dependencies=[Depends(read_bulkhead)])
 async def get_labels_from_plugin_database(token:str):
     '''
         Selects all labels.
@@ -25,7 +26,7 @@ async def get_labels_from_plugin_database(token:str):
     data = sqlalchemy_result(data)
     return data.rows2dict()
     
-@router.post("/v1/label/", tags=["Label"])
+@router.post("/v1/label/", tags=["Label"], dependencies=[Depends(read_bulkhead)])
 async def insert_label_into_plugin_database(token:str, label:label):
     '''
         Insert a new label & return the new label.
@@ -52,7 +53,7 @@ async def insert_label_into_plugin_database(token:str, label:label):
     data = sqlalchemy_result(data)
     return data.rows2dict()
 
-@router.put("/v1/label/", tags=["Label"])
+@router.put("/v1/label/", tags=["Label"], dependencies=[Depends(read_bulkhead)])
 async def update_a_currently_existing_label(token:str):
     '''
         Work in progress
@@ -1,17 +1,25 @@
 import logging
 import os
-import pathlib
-import random
 import re
-import string
 import time
 from typing import List, Optional
 
 import pandas as pd
 from api import Config
+from api.database.contributions import (contribution_stats, mark_reported,
+                                        mark_voters)
 from api.database.database import EngineType
-from api.database.functions import execute_sql, list_to_string, verify_token
-from fastapi import APIRouter, HTTPException
+from api.database.exports import (export_jobs,
+                                  sql_get_discord_linked_accounts)
+from api.database.functions import execute_sql, verify_token
+from api.database.heatmaps import get_heatmap, mark_banned
+from api.database.models import PlayerHiscoreDataXPChange
+from api.database.player_names import name_key, player_names
+from api.database.statements import insert_statement, update_statement
+from api.database.xp_changes import get_latest_gains
+from api.utils.bulkhead import export_bulkhead, read_bulkhead
+from api.utils.response_cache import cached
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from sqlalchemy.orm.exc import NoResultFound
@@ -98,10 +106,17 @@ class DiscordVerifyInfo(BaseModel):
 '''
 async def sql_get_player(player_name):
     """Attempts to get data for a player whose names matches player_name."""
-    sql_player_id = 'select * from Players where normalized_name LIKE :normalized_name'
+    normalized_name = await to_jagex_name(player_name)
+
+    # one select on the name_key index, the normalized_name check drops hash collisions
+    sql_player_id = '''
+        select * from Players
+        where name_key = :name_key and normalized_name = :normalized_name
+    '''
 
     param = {
-        'normalized_name': await to_jagex_name(player_name)
+        'name_key': name_key(normalized_name),
+        'normalized_name': normalized_name
     }
 
     # returns a list of players
@@ -111,8 +126,13 @@ async def sql_get_player(player_name):
         player = player.rows2dict()
     except AttributeError:
         raise HTTPException(status_code=500, detail="Player does not exist.")
-        
-    return None if len(player) == 0 else player[0]
+
+    if len(player) == 0:
+        return None
+
+    # fill the name cache, the next resolve of this name skips the database
+    player_names.add(player[:1])
+    return player[0]
 
 
 async def sql_insert_player(player_name):
@@ -123,6 +143,7 @@ async def sql_insert_player(player_name):
     }
 
     await execute_sql(sql_insert, param=param)
+    player_names.forget([await to_jagex_name(player_name)])
     player = await sql_get_player(player_name)
     return player
 
@@ -157,83 +178,30 @@ async def sql_insert_report(data):
         'equip_ge_value': data.get('equipment_ge')
     }
 
-    # list of column values
-    columns = list_to_string(list(param.keys()))
-    values = list_to_string([f':{column}' for column in list(param.keys())])
-
-    sql = f'insert ignore into Reports ({columns}) values ({values});'
+    sql = insert_statement('Reports', param.keys(), ignore=True)
 
     await execute_sql(sql, param=param, debug=False)
     return
 
 
-async def sql_get_contributions(contributors: List):
-
-    query = ("""
-        SELECT
-            rs.manual_detect as detect,
-            rs.reportedID as reported_ids,
-            ban.confirmed_ban as confirmed_ban,
-            ban.possible_ban as possible_ban,
-            ban.confirmed_player as confirmed_player
-        FROM Reports as rs
-        JOIN Players as pl on (pl.id = rs.reportingID)
-        join Players as ban on (ban.id = rs.reportedID)
-        WHERE 1=1
-            AND pl.normalized_name in :contributors
-    """)
-
-    param = {
-        "contributors": await jagexify_names_list(contributors)
-    }
-
-    output = []
-
-    page = 1
-    while True:
-        data = await execute_sql(query, param=param, page=page)
-        data_dict = data.rows2dict()
-        output.extend(data_dict)
-        if len(data_dict) < 100_000:
-            break
-        page += 1
-
-    return output
-
-
-async def sql_get_feedback_submissions(voters: List):
-    sql = '''
-        SELECT 
-            PredictionsFeedback.id
-        FROM PredictionsFeedback 
-        JOIN Players ON Players.id = PredictionsFeedback.voter_id
-        WHERE 1=1
-            AND Players.name IN :voters
-     '''
-
-    params = {
-        "voters": voters
-    }
-
-    data = await execute_sql(sql, param=params, debug=False, row_count=100_000_000)
-    return data.rows2dict() if data is not None else {}
-
 async def sql_get_number_tracked_players():
     sql = 'SELECT COUNT(*) count FROM Players'
     data = await execute_sql(sql, param={}, debug=False)
     return data.rows2dict() if data is not None else {}
 
 
+@cached('projectstats', ttl=300, stale_ttl=3600)
 async def sql_get_report_stats():
     sql = "SELECT * FROM playerdata.xx_stats"
     data = await execute_sql(sql, param={}, debug=False, )
-    return data.rows2dict() if data is not None else {}
+    return data.rows2dict() if data is not None else None
 
 
+@cached('labels', ttl=3600, stale_ttl=86400)
 async def sql_get_player_labels():
     sql = 'select * from Labels'
     data = await execute_sql(sql, param={}, debug=False)
-    return data.rows2dict() if data is not None else {}
+    return data.rows2dict() if data is not None else None
 
 
 async def sql_update_player(player: dict):
@@ -242,38 +210,17 @@ async def sql_update_player(player: dict):
     param['updated_at'] = time_now
 
     exclude = ['player_id', 'name']
-    values = [f'{k}=:{k}' for k,v in param.items() if v is not None and k not in exclude]
-    values = list_to_string(values)
-
-    sql = (f'''
-        update Players 
-        set
-            {values}
-        where 
-            id=:player_id;
-    ''')
+    columns = [k for k,v in param.items() if v is not None and k not in exclude]
+    sql = update_statement('Players', columns, key='id', param='player_id')
     select = "select * from Players where id=:player_id"
 
     await execute_sql(sql, param)
     data = await execute_sql(select, param)
-    return data.rows2dict() if data is not None else {}
-
-
-async def sql_get_latest_xp_gain(player_id: int):
-    sql = '''          
-        SELECT * 
-        FROM playerHiscoreDataXPChange xp
-        WHERE 1 = 1
-            AND xp.Player_id = :player_id
-        ORDER BY xp.timestamp DESC
-    '''
 
-    param = {
-        "player_id": player_id
-    }
-
-    data = await execute_sql(sql, param, row_count=2)
-    return data.rows2dict()
+    # the contributions of everyone who reported this player and the heatmaps depend on its ban labels
+    await mark_reported([param['player_id']])
+    await mark_banned([param['player_id']])
+    return data.rows2dict() if data is not None else {}
 
 
 async def sql_get_discord_verification_status(player_name: str):
@@ -313,17 +260,6 @@ async def sql_insert_verification_request(discord_id: int, player_id: int, code:
     return
 
 
-async def sql_get_discord_linked_accounts(discord_id: int):
-    sql = 'SELECT * FROM verified_players WHERE Discord_id = :discord_id and Verified_status = 1'
-    
-    param = {
-        'discord_id': discord_id
-    }
-
-    data = await execute_sql(sql, param, engine_type=EngineType.DISCORD)
-    return data.rows2dict() if data is not None else {}
-
-
 async def sql_get_user_latest_sighting(player_id: int):
     sql = '''
             SELECT *
@@ -340,25 +276,6 @@ async def sql_get_user_latest_sighting(player_id: int):
     return data.rows2dict() if data is not None else {}
 
 
-async def sql_get_report_data_heatmap(region_id: int):
-    sql = ('''
-        SELECT region_id, x_coord, y_coord, z_coord, confirmed_ban
-            FROM Players pls
-            JOIN Reports rpts ON rpts.reportedID = pls.id
-                WHERE pls.confirmed_ban = 1
-                AND rpts.region_id = :region_id
-        ORDER BY pls.id DESC
-                
-    ''')
-
-    param = {
-        'region_id': region_id
-    }
-
-    data = await execute_sql(sql, param, row_count=100_000)
-    return data.rows2dict() if data is not None else {}
-
-
 async def sql_region_search(region_name: str):
     sql = "SELECT * FROM regionIDNames WHERE region_name LIKE :region"
 
@@ -372,42 +289,6 @@ async def sql_region_search(region_name: str):
     return data.rows2dict() if data is not None else {}
 
 
-async def get_ban_spreadsheet_data(player_name: str):
-    sql = (
-        '''
-        SELECT 
-            pl1.name reporter,
-            lbl.label,
-            hdl.*
-        FROM Reports rp
-        INNER JOIN Players pl1 ON (rp.reportingID = pl1.id)
-        INNER JOIN Players pl2 on (rp.reportedID = pl2.id) 
-        INNER JOIN Labels lbl ON (pl2.label_id = lbl.id)
-        INNER JOIN playerHiscoreDataLatest hdl on (pl2.id = hdl.Player_id)
-        where 1=1
-            and lower(pl1.name) = :player_name
-            and pl2.confirmed_ban = 1
-            and pl2.possible_ban = 1
-        '''
-    )
-
-    param = {'player_name': player_name}
-
-    data = await execute_sql(sql, param, row_count=500_000)
-    return data.rows2dict() if data is not None else {}
-
-
-async def insert_export_link(export_info: dict):
-
-    columns = list_to_string(list(export_info.keys()))
-    values = list_to_string([f':{column}' for column in list(export_info.keys())])
-
-    sql = f"INSERT IGNORE INTO export_links ({columns}) VALUES ({values});"
-
-    await execute_sql(sql, param=export_info, engine_type=EngineType.DISCORD)
-    return
-
-
 async def get_export_link(url_text: str):
     sql = 'SELECT * FROM export_links WHERE url_text IN (:url_text)'
     
@@ -525,89 +406,8 @@ async def insync_detect(detections, manual_detect):
 
 
 async def parse_contributors(contributors, version=None, add_patron_stats:bool=False):
-    contributions = await sql_get_contributions(contributors)
-
-    df = pd.DataFrame(contributions)
-    df.drop_duplicates(inplace=True, subset=["reported_ids", "detect"], keep="last")
-
-    try:
-        df_detect_manual = df.loc[df['detect'] == 1]
-
-        manual_dict = {
-            "reports": len(df_detect_manual.index),
-            "bans": int(df_detect_manual['confirmed_ban'].sum()),
-            "possible_bans": int(df_detect_manual['possible_ban'].sum()),
-            "incorrect_reports": int(df_detect_manual['confirmed_player'].sum())
-        }
-
-        manual_dict["possible_bans"] = manual_dict["possible_bans"] - manual_dict["bans"]
-
-    except KeyError as e:
-        logger.debug(e)
-        manual_dict = {
-            "reports": 0,
-            "bans": 0,
-            "possible_bans": 0,
-            "incorrect_reports": 0
-        }
-
-    try:
-        df_detect_passive = df.loc[df['detect'] == 0]
-
-        passive_dict = {
-            "reports": len(df_detect_passive.index),
-            "bans": int(df_detect_passive['confirmed_ban'].sum()),
-            "possible_bans": int(df_detect_passive['possible_ban'].sum())
-        }
-
-        passive_dict["possible_bans"] = passive_dict["possible_bans"] - passive_dict["bans"]
-
-    except KeyError as e:
-        logger.debug(e)
-        passive_dict = {
-            "reports": 0,
-            "bans": 0,
-            "possible_bans": 0
-        }
-
-
-    total_dict = {
-        "reports": passive_dict['reports'] + manual_dict['reports'],
-        "bans": passive_dict['bans'] + manual_dict['bans'],
-        "possible_bans": passive_dict['possible_bans'] + manual_dict['possible_bans'],
-        'feedback': len(await sql_get_feedback_submissions(contributors))
-    }
-
-    if version in ['1.3','1.3.1'] or None:
-        return total_dict
-
-
-    if add_patron_stats:
-        if df.empty:
-            total_dict["total_xp_removed"] = 0
-        else:
-            banned_df = df[df["confirmed_ban"] == 1]
-            banned_ids = banned_df["reported_ids"].tolist()
-
-            total_xp_sql = '''
-                SELECT
-                    SUM(total) as total_xp
-                FROM playerHiscoreDataLatest
-                WHERE Player_id IN :banned_ids
-            '''
-
-        total_xp_data = await execute_sql(sql=total_xp_sql, param={"banned_ids": banned_ids})
-        total_xp = total_xp_data.rows2dict()[0].get("total_xp") or 0 #eeewwww
-        total_dict["total_xp_removed"] = total_xp
-
-
-    return_dict = {
-        "passive": passive_dict,
-        "manual": manual_dict,
-        "total": total_dict
-    }
-
-    return return_dict
+    # single row lookups on the materialized counters, see api.database.contributions
+    return await contribution_stats(contributors, version=version, add_patron_stats=add_patron_stats)
 
 
 '''
@@ -615,12 +415,13 @@ async def parse_contributors(contributors, version=None, add_patron_stats:bool=F
 '''
 
 async def sql_select_players(names: List):
-    names = [n.lower() for n in names]
-    sql = "SELECT * FROM Players WHERE normalized_name in :names"
-    param = {"names": names}
+    names = set(n.lower() for n in names)
+    sql = "SELECT * FROM Players WHERE name_key in :keys"
+    param = {"keys": list(set(name_key(n) for n in names))}
     data = await execute_sql(sql, param)
 
-    return [] if not data else data.rows2dict()
+    # a key can be shared by other names, keep the exact matches
+    return [] if not data else [p for p in data.rows2dict() if p['normalized_name'] in names]
 
 
 async def parse_detection(data:dict) -> dict:
@@ -701,11 +502,7 @@ async def detect(detections, manual_detect):
     param = [await parse_detection(d) for d in data]
 
     # 4.3) parse query
-    params = list(param[0].keys())
-    columns = list_to_string(params)
-    values = list_to_string([f':{column}' for column in params])
-
-    sql = f'insert ignore into Reports ({columns}) values ({values})'
+    sql = insert_statement('Reports', param[0].keys(), ignore=True)
     await execute_sql(sql, param)
 
 
@@ -741,7 +538,7 @@ async def detect(detections, manual_detect):
 #     return data
 
 
-@router.get('/stats/getcontributorid/{contributor}', tags=["Legacy"])
+@router.get('/stats/getcontributorid/{contributor}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_contributor_id(contributor: str):
     player = await sql_get_player(contributor)
 
@@ -756,9 +553,9 @@ async def get_contributor_id(contributor: str):
     return return_dict
 
 
-@router.get('/site/dashboard/projectstats', tags=["Legacy"])
+@router.get('/site/dashboard/projectstats', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_total_reports():
-    report_stats = await sql_get_report_stats()
+    report_stats = await sql_get_report_stats() or []
 
     output = {
         "total_bans": sum(int(r.player_count) for r in report_stats if r.confirmed_ban == 1),
@@ -770,14 +567,14 @@ async def get_total_reports():
     return output
 
 
-@router.get('/labels/get_player_labels', tags=["Legacy"])
+@router.get('/labels/get_player_labels', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_player_labels():
-    labels = await sql_get_player_labels()
+    labels = await sql_get_player_labels() or []
     df = pd.DataFrame(labels)
     return df.to_dict('records')
 
 
-@router.post('/{version}/plugin/predictionfeedback/', tags=["Legacy"])
+@router.post('/{version}/plugin/predictionfeedback/', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def receive_plugin_feedback(feedback: Feedback, version: str = None):
  
     feedback_params = feedback.dict()
@@ -785,34 +582,31 @@ async def receive_plugin_feedback(feedback: Feedback, version: str = None):
 
     normalized_name = await to_jagex_name(player_name)
 
-    voter_data = await execute_sql(sql=f"select * from Players where normalized_name = :normalized_name", param={"normalized_name": normalized_name})
+    player_ids = await player_names.resolve([normalized_name])
 
-    if voter_data is None:
+    if normalized_name in player_ids:
+        voter_id = player_ids[normalized_name]
+    else:
         voter_data = await sql_insert_player(player_name)
+        voter_id = None if voter_data is None else voter_data.get("id")
 
-    voter_data = voter_data.rows2dict()[0]
+    if voter_id is None:
+        raise HTTPException(status_code=500, detail="Could not find voter in registry.")
 
-    feedback_params["voter_id"] = voter_data.get("id")
+    feedback_params["voter_id"] = voter_id
     exclude = ["player_name"]
 
     columns = [k for k,v in feedback_params.items() if v is not None and k not in exclude]
-    columns = list_to_string(columns)
-
-    values = [f':{k}' for k,v in feedback_params.items() if v is not None and k not in exclude]
-    values = list_to_string(values)
-
-    sql = (f'''
-        insert ignore into PredictionsFeedback ({columns})
-        values ({values}) 
-    ''')
+    sql = insert_statement('PredictionsFeedback', columns, ignore=True)
 
     await execute_sql(sql, param=feedback_params)
+    await mark_voters([voter_id])
     
     return {"OK": "OK"}
 
 
-@router.get('/site/highscores/{token}/{ofInterest}', tags=["Legacy"])
-@router.get('/site/highscores/{token}/{ofInterest}/{row_count}/{page}', tags=["Legacy"])
+@router.get('/site/highscores/{token}/{ofInterest}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
+@router.get('/site/highscores/{token}/{ofInterest}/{row_count}/{page}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_highscores(
         token: str, 
         ofInterest: int = None, 
@@ -843,7 +637,7 @@ async def get_highscores(
     return data.rows2dict() if data is not None else {}
 
 
-@router.get('site/players/{token}/{ofInterest}/{row_count}/{page}', tags=["Legacy"])
+@router.get('site/players/{token}/{ofInterest}/{row_count}/{page}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_players(token:str, ofInterest:int=None, row_count:int=100_000, page:int=1):
     await verify_token(token, verification='request_highscores')
 
@@ -857,16 +651,15 @@ async def get_players(token:str, ofInterest:int=None, row_count:int=100_000, pag
     return data.rows2dict() if data is not None else {}
 
 
-@router.get('/site/labels/{tokens}', tags=["Legacy"])
+@router.get('/site/labels/{tokens}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_labels(token):
     await verify_token(token, verification='request_highscores')
 
-    sql = 'select * from Labels'
-    data = await execute_sql(sql)
-    return data.rows2dict() if data is not None else {}
+    data = await sql_get_player_labels()
+    return data if data is not None else {}
 
 
-@router.post('/site/verify/{token}', tags=["Legacy"])
+@router.post('/site/verify/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def verify_bot(token:str, bots:bots):
     await verify_token(token, verification='verify_ban')
 
@@ -946,7 +739,7 @@ async def set_discord_verification(id, token):
     return 
 
 
-@router.post('/{version}/site/discord_user/{token}', tags=["Legacy"])
+@router.post('/{version}/site/discord_user/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def verify_discord_user(token:str, discord:discord, version:str=None):
     await verify_token(token, verification='verify_players') 
     
@@ -1005,13 +798,18 @@ async def sql_get_prediction_player(player_id):
         raise NoResultFound
     
 
-@router.get('/{version}/site/prediction/{player_name}', tags=["Legacy"])
+@router.get('/{version}/site/prediction/{player_name}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_prediction(player_name, version=None, token=None):
     player_name, bad_name = await name_check(player_name)
 
     if bad_name or player_name is None:
         raise HTTPException(status_code=400, detail="Not a valid RSN.")
-    
+
+    return await get_prediction_response(player_name, version)
+
+
+@cached('site_prediction', ttl=300, stale_ttl=3600, max_size=100_000)
+async def get_prediction_response(player_name, version=None):
     player = await sql_get_player(player_name)
 
     try:
@@ -1049,7 +847,19 @@ async def get_prediction(player_name, version=None, token=None):
 ###
 #  Discord
 ##
-@router.post('/discord/get_xp_gains/{token}', tags=["Legacy"])
+# the keys of the playerHiscoreDataXPChange rows get_xp_gains returned, in their order
+xp_change_keys = [c.name for c in PlayerHiscoreDataXPChange.__table__.columns]
+
+
+def legacy_xp_gain(gain: dict) -> dict:
+    '''
+        a gain shaped like the playerHiscoreDataXPChange row it replaces, without start_id and start_timestamp.
+        id is now the id of the later playerHiscoreData snapshot, not of a playerHiscoreDataXPChange row.
+    '''
+    return {key: gain[key] if key in gain else gain.get(key.lower()) for key in xp_change_keys}
+
+
+@router.post('/discord/get_xp_gains/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_latest_xp_gains(player_info:PlayerName, token:str):
     await verify_token(token, verification='verify_players')
 
@@ -1063,34 +873,24 @@ async def get_latest_xp_gains(player_info:PlayerName, token:str):
 
     player_id = player.get('id')
 
-    last_xp_gains = await sql_get_latest_xp_gain(player_id)
-
-    df = pd.DataFrame(last_xp_gains)
-
-    gains_rows_count = len(df.index)
+    # computed from the last three scrapes, see api.utils.xp_changes
+    last_xp_gains = [legacy_xp_gain(g) for g in await get_latest_gains(player_id, count=2)]
 
+    gains_rows_count = len(last_xp_gains)
 
     if(gains_rows_count > 0):
 
-        output = df.to_dict('records')
-
         output_dict = {
-            "latest": output[0],
+            "latest": last_xp_gains[0],
+            "second": last_xp_gains[1] if gains_rows_count == 2 else {}
         }
 
-        if(gains_rows_count == 2):
-            output_dict["second"] = output[1]
-        elif(gains_rows_count == 1):
-            output_dict["second"] = {}
-        else:
-            return "Server Error: Somehow more than 2 xp gains entries were returned..", 500
-
         return output_dict
     else:
         return "No gains found for this player.", 404
 
 
-@router.get('/discord/verify/player_rsn_discord_account_status/{token}/{player_name}', tags=["Legacy"])
+@router.get('/discord/verify/player_rsn_discord_account_status/{token}/{player_name}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_discord_verification_status_by_name(token: str, player_name: str):
     await verify_token(token, verification='verify_players')
 
@@ -1099,7 +899,7 @@ async def get_discord_verification_status_by_name(token: str, player_name: str):
     return status_info
 
 
-@router.get('/discord/verify/get_verification_attempts/{token}/{player_name}', tags=["Legacy"])
+@router.get('/discord/verify/get_verification_attempts/{token}/{player_name}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_discord_verification_attempts(token: str, player_name: str):
     await verify_token(token, verification='verify_players')
 
@@ -1115,7 +915,7 @@ async def get_discord_verification_attempts(token: str, player_name: str):
     return attempts
 
 
-@router.post('/discord/verify/insert_player_dpc/{token}', tags=["Legacy"])
+@router.post('/discord/verify/insert_player_dpc/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def post_verification_request_information(token: str, verify_info: DiscordVerifyInfo):
     await verify_token(token, verification='verify_players')
 
@@ -1140,7 +940,7 @@ async def post_verification_request_information(token: str, verify_info: Discord
     return
 
 
-@router.get('/discord/get_linked_accounts/{token}/{discord_id}', tags=["Legacy"])
+@router.get('/discord/get_linked_accounts/{token}/{discord_id}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_discord_linked_accounts(token: str, discord_id: int):
     await verify_token(token, verification='verify_players')
 
@@ -1149,7 +949,7 @@ async def get_discord_linked_accounts(token: str, discord_id: int):
     return linked_accounts
 
 
-@router.post('/discord/get_latest_sighting/{token}', tags=["Legacy"])
+@router.post('/discord/get_latest_sighting/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_latest_sighting(token: str, player_info: PlayerName):
     await verify_token(token, verification='verify_players')
 
@@ -1182,7 +982,7 @@ async def get_latest_sighting(token: str, player_info: PlayerName):
     return filtered_sighting
 
 
-@router.post('/discord/region/{token}', tags=["Legacy"])
+@router.post('/discord/region/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_region(token:str, region: RegionName):
     await verify_token(token, verification='verify_players')
 
@@ -1194,60 +994,43 @@ async def get_region(token:str, region: RegionName):
     return regions
 
 
-@router.post('/discord/heatmap/{token}', tags=["Legacy"])
+@router.post('/discord/heatmap/{token}', tags=["Legacy"], dependencies=[Depends(read_bulkhead)])
 async def get_heatmap_data(token: str, region_id: RegionID):
     await verify_token(token, verification='verify_players')
 
     region_data = region_id.dict()
     id = region_data.get('region_id')
 
-    data = await sql_get_report_data_heatmap(id)
-
-    df = pd.DataFrame(data)
-
-    #Remove unnecessary columns
-    df = df.drop(columns=['z_coord', 'region_id'])
-
-    #Group by tiles
-    df = df.groupby(["x_coord", "y_coord"], as_index=False).sum()
-    df = df.astype({"confirmed_ban": int})
-
-    output = df.to_dict('records')
-    
-    return output
+    # precomputed tiles, see api.database.heatmaps. The discord bot can not tell an empty list
+    # from a region without bans, a region that was never computed is computed for it now
+    return await get_heatmap(id, compute=True)
 
 
-@router.post('/discord/player_bans/{token}', tags=["Legacy"])
+@router.post('/discord/player_bans/{token}', tags=["Legacy"], dependencies=[Depends(export_bulkhead)])
 async def generate_excel_export(token: str, export_info: ExportInfo):
     await verify_token(token, verification='verify_players')
-    #get_ban_spreadsheet_data
 
     req_data = export_info.dict()
-    discord_id = req_data.get('discord_id')
-    display_name = req_data.get('display_name')
-    file_type =req_data.get('file_type')
-
-    linked_accounts = await sql_get_discord_linked_accounts(discord_id)
 
-    if len(linked_accounts) == 0:
-        raise HTTPException(status_code=500, detail="User doesn't have any accounts linked.")
-    
+    # the export is built by a background job, see /v1/export for submitting without waiting on it
     try:
-        download_url = await create_ban_export(
-            file_type=file_type,
-            linked_accounts=linked_accounts,
-            display_name=display_name,
-            discord_id=discord_id
+        job = await export_jobs.submit(
+            discord_id=req_data.get('discord_id'),
+            display_name=req_data.get('display_name'),
+            file_type=req_data.get('file_type')
         )
-    except InvalidFileType:
+    except ValueError:
         raise HTTPException(status_code=400, detail="File type specified is invalid.")
-    except NoDataAvailable:
-        raise HTTPException(status_code=500, detail="No ban data available for the linked account(s). Possibly the server timed out.")
 
-    return {"url": download_url}
+    await job.done.wait()
+
+    if job.status == 'failed':
+        raise HTTPException(status_code=500, detail=job.error)
 
+    return {"url": job.url}
 
-@router.get('/discord/download_export/{export_id}', tags=["Legacy"])
+
+@router.get('/discord/download_export/{export_id}', tags=["Legacy"], dependencies=[Depends(export_bulkhead)])
 async def download_export(export_id: str):
     
     download_data = await get_export_link(export_id)
@@ -1272,117 +1055,3 @@ async def download_export(export_id: str):
 
         else:
             raise HTTPException(status_code=500, detail="File is no longer present on our system. Please use !excelban to generate a new file.")
-
-
-#
-# Excelban helper functions
-#
-
-class Error(Exception):
-    pass
-
-
-class NoDataAvailable(Error):
-    pass
-
-
-class InvalidFileType(Error):
-    pass
-
-
-async def create_ban_export(file_type, linked_accounts, display_name, discord_id):
-
-    pathlib.Path(f"{os.getcwd()}/exports/").mkdir(parents=True, exist_ok=True)
-
-    export_data = {}
-
-    export_data["url_text"] = await create_random_link()
-    export_data["discord_id"] = discord_id
-
-    if file_type == "csv":
-        csv_file_name = await create_csv_export(
-            linked_accounts=linked_accounts,
-            display_name=display_name
-        )
-
-        export_data["file_name"] = csv_file_name
-        export_data["is_csv"] = 1
-
-
-    elif file_type == "excel":
-        excel_file_name = await create_excel_export(
-            linked_accounts=linked_accounts, 
-            display_name=display_name
-        )
-
-        export_data["file_name"] = excel_file_name
-        export_data["is_excel"] = 1
-
-    else:
-        raise InvalidFileType
-
-    await insert_export_link(export_data)
-
-    return export_data.get("url_text")
-
-
-async def create_excel_export(linked_accounts, display_name):
-    sheets = []
-    names = []
-
-    for account in linked_accounts:
-        data = await get_ban_spreadsheet_data(account.name)
-        df = pd.DataFrame(data)
-
-        sheets.append(df)
-        names.append(account.name)
-
-    if len(sheets) > 0:
-        totalSheet = pd.concat(sheets)
-        totalSheet = totalSheet.drop_duplicates(inplace=False, subset=["Player_id"], keep="last")
-
-        file_name = f"{display_name}_bans.xlsx"
-        file_path = f"{os.getcwd()}/exports/" + file_name
-
-        writer = pd.ExcelWriter(file_path, engine="xlsxwriter")
-
-        totalSheet.to_excel(writer, sheet_name="Total")
-
-        for idx, name in enumerate(names):
-            sheets[idx].to_excel(writer, sheet_name=names[idx])
-
-        writer.save()
-
-        return file_name
-
-    else:
-        raise NoDataAvailable
-
-
-async def create_csv_export(linked_accounts, display_name):
-    sheets = []
-
-    for account in linked_accounts:
-        data = await get_ban_spreadsheet_data(account.name)
-        df = pd.DataFrame(data)
-
-        sheets.append(df)
-
-    totalSheet = pd.concat(sheets)
-    totalSheet = totalSheet.drop_duplicates(inplace=False, subset=["Player_id"], keep="last")
-
-    file_name = f"{display_name}_bans.csv"
-    file_path = f"{os.getcwd()}/exports/" + file_name
-
-    totalSheet.to_csv(file_path, encoding='utf-8', index=False)
-
-    return file_name
-
-
-async def create_random_link():
-    pool = string.ascii_letters + string.digits
-
-    link = ''.join(random.choice(pool) for i in range(12))
-
-    return link
-
@@ -0,0 +1,13 @@
+from api.utils.metrics import REGISTRY
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter()
+
+
+@router.get("/metrics", tags=["Metrics"], response_class=PlainTextResponse)
+async def get_metrics():
+    '''
+        Prometheus scrape endpoint.
+    '''
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
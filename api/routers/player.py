@@ -1,10 +1,17 @@
 import time
 from typing import List, Optional
 
+from api.database.coalesce import read_sql
+from api.database.contributions import mark_reported
 from api.database.database import Engine, EngineType, get_session
-from api.database.functions import sqlalchemy_result, verify_token
+from api.database.functions import (keyset_paginate, set_next_cursor,
+                                    sqlalchemy_result, verify_token)
+from api.database.heatmaps import mark_banned
 from api.database.models import Player as dbPlayer
-from fastapi import APIRouter, HTTPException, Query
+from api.database.streaming import (core_columns, stream_format,
+                                    streaming_response)
+from api.utils.bulkhead import export_bulkhead, read_bulkhead
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from sqlalchemy.sql.expression import insert, select, update
 
@@ -21,13 +28,15 @@ class Player(BaseModel):
     label_jagex: Optional[int]
 
 
-@router.get("/v1/player", tags=["Player"])
+@router.get("/v1/player", tags=["Player"], dependencies=[Depends(read_bulkhead)])
 async def get_player_information(
     token: str,
     player_name: Optional[str] = None,
     player_id: Optional[int] = Query(None, ge=0),
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1)
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None
 ):
     '''
         Select a player by name or id.
@@ -48,17 +57,17 @@ async def get_player_information(
         sql = sql.where(dbPlayer.id == player_id)
 
     # query pagination
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, dbPlayer.id, row_count, cursor, page)
 
-    # transaction
-    async with get_session(EngineType.PLAYERDATA) as session:
-        data = await session.execute(sql)
+    # identical concurrent lookups share one query
+    data = await read_sql(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
 
 
-@router.get("/v1/player/bulk", tags=["Player"])
+@router.get("/v1/player/bulk", tags=["Player"], dependencies=[Depends(export_bulkhead)])
 async def get_bulk_player_data_from_the_plugin_database(
     token: str,
     possible_ban: Optional[int] = None,
@@ -67,7 +76,11 @@ async def get_bulk_player_data_from_the_plugin_database(
     label_id: Optional[int] = None,
     label_jagex: Optional[int] = None,
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1)
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    format: Optional[str] = Query(None, regex="^(json|ndjson|csv)$"),
+    request: Request = None
     ):
     '''
         Selects bulk player data from the plugin database.
@@ -99,17 +112,23 @@ async def get_bulk_player_data_from_the_plugin_database(
         sql = sql.where(dbPlayer.label_jagex == label_jagex)
 
     # query pagination
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    sql = keyset_paginate(sql, dbPlayer.id, row_count, cursor, page)
+
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, dbPlayer), fmt)
 
     # transaction
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'id', row_count)
+    return data
 
 
-@router.put("/v1/player", tags=["Player"])
+@router.put("/v1/player", tags=["Player"], dependencies=[Depends(read_bulkhead)])
 async def update_existing_player_data(player: Player, token: str):
     '''
         Update player & return updated player.
@@ -136,11 +155,17 @@ async def update_existing_player_data(player: Player, token: str):
         await session.commit()
         data = await session.execute(sql_select)
 
+    # the contributions of everyone who reported this player depend on its ban labels
+    if any(param.get(c) is not None for c in ('possible_ban', 'confirmed_ban', 'confirmed_player')):
+        await mark_reported([player_id])
+    if param.get('confirmed_ban') is not None:
+        await mark_banned([player_id])
+
     data = sqlalchemy_result(data)
     return data.rows2dict()
 
 
-@router.post("/v1/player", tags=["Player"])
+@router.post("/v1/player", tags=["Player"], dependencies=[Depends(read_bulkhead)])
 async def insert_new_player_data_into_plugin_database(player_name: str, token: str):
     '''
         Insert new player & return player.
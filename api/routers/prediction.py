@@ -1,14 +1,21 @@
 from operator import or_
 from typing import List, Optional
 
+from api.database.coalesce import read_sql
+from api.database.columnar import COLUMNAR_MEDIA_TYPES, columnar_response
 from api.database.database import EngineType, get_session
-from api.database.functions import (list_to_string, sqlalchemy_result,
-                                    verify_token)
+from api.database.functions import (keyset_paginate, set_next_cursor,
+                                    sqlalchemy_result, verify_token)
 from api.database.models import Player, PlayerHiscoreDataLatest
 from api.database.models import Prediction as dbPrediction
-from fastapi import APIRouter, HTTPException, Query
+from api.database.statements import insert_statement
+from api.database.streaming import (core_columns, stream_format,
+                                    streaming_response)
+from api.utils.bulkhead import export_bulkhead, ingest_bulkhead, read_bulkhead
+from api.utils.response_cache import cached, clear_caches
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from sqlalchemy.sql.expression import select, text
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql.functions import func
 
 router = APIRouter()
@@ -47,24 +54,28 @@ class Prediction(BaseModel):
     Zulrah_bot: Optional[float] = 0
 
 
-@router.get("/v1/prediction", tags=["Prediction"])
+@router.get("/v1/prediction", tags=["Prediction"], dependencies=[Depends(read_bulkhead)])
 async def get_account_prediction_result(name: str):
     '''
         Selects a player's prediction from the plugin database.\n
         Use: Used to determine the prediction of a player according to the prediction found in the prediction table.
     '''
 
+    return await sql_get_prediction_by_name(name)
+
+
+@cached('prediction', ttl=300, stale_ttl=3600, max_size=100_000)
+async def sql_get_prediction_by_name(name: str):
     sql = select(dbPrediction)
     sql = sql.where(dbPrediction.name == name)
 
-    async with get_session(EngineType.PLAYERDATA) as session:
-        data = await session.execute(sql)
+    data = await read_sql(sql)
 
     data = sqlalchemy_result(data)
     return data.rows2dict()
 
 
-@router.post("/v1/prediction", tags=["Prediction"])
+@router.post("/v1/prediction", tags=["Prediction"], dependencies=[Depends(ingest_bulkhead)])
 async def insert_prediction_into_plugin_database(token: str, prediction: List[Prediction]):
     '''
         Posts a new prediction into the plugin database.\n
@@ -74,23 +85,27 @@ async def insert_prediction_into_plugin_database(token: str, prediction: List[Pr
 
     data = [d.dict() for d in prediction]
 
-    columns = list_to_string([k for k in data[0].keys()])
-    values = list_to_string([f':{k}' for k in data[0].keys()])
-
-    sql = f'''replace into Predictions ({columns}) values ({values})'''
-    sql = text(sql)
+    sql = insert_statement('Predictions', data[0].keys(), replace=True)
 
     async with get_session(EngineType.PLAYERDATA) as session:
         await session.execute(sql, data)
         await session.commit()
 
+    # new predictions replace the old ones, do not serve them from the caches
+    clear_caches('prediction', 'site_prediction')
     return {'ok': 'ok'}
 
 
-@router.get("/v1/prediction/data", tags=["Business"])
-async def get_expired_predictions(token: str, limit: int = Query(50_000, ge=1)):
+@router.get("/v1/prediction/data", tags=["Business"], dependencies=[Depends(export_bulkhead)])
+async def get_expired_predictions(
+    token: str,
+    limit: int = Query(50_000, ge=1),
+    format: Optional[str] = Query(None, regex="^(json|arrow|parquet)$"),
+    request: Request = None
+):
     '''
         Select predictions where prediction data is not from today or null.
+        Use format=arrow or format=parquet for a columnar export.
         Business service: ML
     '''
     await verify_token(token, verification='request_highscores')
@@ -107,6 +122,12 @@ async def get_expired_predictions(token: str, limit: int = Query(50_000, ge=1)):
     sql = sql.limit(limit).offset(0)
     sql = sql.join(Player).join(dbPrediction, isouter=True)
 
+    # columnar export, typed by the PlayerHiscoreDataLatest columns
+    fmt = stream_format(request, format, COLUMNAR_MEDIA_TYPES)
+    if fmt is not None:
+        sql = sql.with_only_columns(*PlayerHiscoreDataLatest.__table__.columns, Player.name)
+        return columnar_response(sql, fmt)
+
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
@@ -124,11 +145,15 @@ async def get_expired_predictions(token: str, limit: int = Query(50_000, ge=1)):
     return output
 
 
-@router.get("/v1/prediction/bulk", tags=["Prediction"])
+@router.get("/v1/prediction/bulk", tags=["Prediction"], dependencies=[Depends(export_bulkhead)])
 async def gets_predictions_by_player_features(
     token: str,
     row_count: int = Query(100_000, ge=1),
-    page: int = Query(1, ge=1),
+    page: int = Query(1, ge=1, deprecated=True),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    format: Optional[str] = Query(None, regex="^(json|ndjson|csv)$"),
+    request: Request = None,
     possible_ban: Optional[int] = Query(None, ge=0, le=1),
     confirmed_ban: Optional[int] = Query(None, ge=0, le=1),
     confirmed_player: Optional[int] = Query(None, ge=0, le=1),
@@ -161,15 +186,21 @@ async def gets_predictions_by_player_features(
     if not label_jagex is None:
         sql = sql.where(Player.label_jagex == label_jagex)
 
-    # paging
-    sql = sql.limit(row_count).offset(row_count*(page-1))
+    # paging, name is the primary key of Predictions
+    sql = keyset_paginate(sql, dbPrediction.name, row_count, cursor, page)
 
     # join
     sql = sql.join(Player)
 
+    # opt-in streaming, rows are sent in chunks while they are read
+    fmt = stream_format(request, format)
+    if fmt is not None:
+        return streaming_response(core_columns(sql, dbPrediction), fmt)
+
     # execute query
     async with get_session(EngineType.PLAYERDATA) as session:
         data = await session.execute(sql)
 
-    data = sqlalchemy_result(data)
-    return data.rows2dict()
+    data = sqlalchemy_result(data).rows2dict()
+    set_next_cursor(response, data, 'name', row_count)
+    return data
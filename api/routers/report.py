@@ -4,18 +4,23 @@ import time
 from datetime import date
 from typing import List, Optional
 
-import pandas as pd
 from pydantic.fields import Field
-from api.database.functions import (EngineType, batch_function, get_session,
-                                    jagexify_names_list, sqlalchemy_result,
-                                    to_jagex_name, verify_token)
+from api import Config
+from api.database.contributions import mark_reports
+from api.database.functions import (EngineType, get_session, is_valid_rsn,
+                                    sqlalchemy_result, verify_token)
+from api.database.heatmaps import mark_heatmap_reports
 from api.database.models import (Player, Prediction, Report, ReportLatest,
                                  stgReport)
-from fastapi import APIRouter, HTTPException, Query, Request, status
+from api.database.player_names import player_names
+from api.utils.bulkhead import export_bulkhead, ingest_bulkhead, read_bulkhead
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from pydantic import BaseModel
 from sqlalchemy import update
 from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import insert, select
+from api.utils.detections import DetectionBatch, join_player_ids
+from api.utils.write_behind import QueueFull, WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -29,22 +34,6 @@ upper_gear_cost = 1_000_000_000_000
 # TODO: cleanup thse functions
 
 
-async def sql_select_players(names: List[str]) -> List:
-    sql = select(Player)
-    sql = sql.where(Player.normalized_name.in_(tuple(await jagexify_names_list(names))))
-    async with get_session(EngineType.PLAYERDATA) as session:
-        data = await session.execute(sql)
-    data = sqlalchemy_result(data)
-    return [] if not data else data.rows2dict()
-
-
-async def sql_insert_player(new_names: List[dict]) -> None:
-    sql = insert(Player)
-    async with get_session(EngineType.PLAYERDATA) as session:
-        await session.execute(sql, new_names)
-        await session.commit()
-
-
 async def sql_insert_report(param: dict) -> None:
     sql = insert(stgReport)
     async with get_session(EngineType.PLAYERDATA) as session:
@@ -52,38 +41,6 @@ async def sql_insert_report(param: dict) -> None:
         await session.commit()
 
 
-async def parse_detection(data: dict) -> dict:
-    gmt = time.gmtime(data['ts'])
-    human_time = time.strftime('%Y-%m-%d %H:%M:%S', gmt)
-
-    equipment = data.get('equipment', {})
-
-    param = {
-        'reportedID': data.get('id'),
-        'reportingID': data.get('reporter_id'),
-        'region_id': data.get('region_id'),
-        'x_coord': data.get('x_coord'),
-        'y_coord': data.get('y_coord'),
-        'z_coord': data.get('z_coord'),
-        'timestamp': human_time,
-        'manual_detect': data.get('manual_detect'),
-        'on_members_world': data.get('on_members_world'),
-        'on_pvp_world': data.get('on_pvp_world'),
-        'world_number': data.get('world_number'),
-        'equip_head_id': equipment.get('equip_head_id'),
-        'equip_amulet_id': equipment.get('equip_amulet_id'),
-        'equip_torso_id': equipment.get('equip_torso_id'),
-        'equip_legs_id': equipment.get('equip_legs_id'),
-        'equip_boots_id': equipment.get('equip_boots_id'),
-        'equip_cape_id': equipment.get('equip_cape_id'),
-        'equip_hands_id': equipment.get('equip_hands_id'),
-        'equip_weapon_id': equipment.get('equip_weapon_id'),
-        'equip_shield_id': equipment.get('equip_shield_id'),
-        'equip_ge_value': data.get('equip_ge_value', 0)
-    }
-    return param
-
-
 class equipment(BaseModel):
     equip_head_id: int = Field(None, ge=0)
     equip_amulet_id: int = Field(None, ge=0)
@@ -112,7 +69,7 @@ class detection(BaseModel):
     equip_ge_value: int = Field(0, ge=0, le=int(upper_gear_cost))
 
 
-@router.get("/v1/report", tags=["Report"])
+@router.get("/v1/report", tags=["Report"], dependencies=[Depends(read_bulkhead)])
 async def get_reports_from_plugin_database(
     token: str,
     reportedID: Optional[int] = Query(None, ge=0),
@@ -151,7 +108,7 @@ async def get_reports_from_plugin_database(
     return data.rows2dict()
 
 
-@router.put("/v1/report", tags=["Report"])
+@router.put("/v1/report", tags=["Report"], dependencies=[Depends(ingest_bulkhead)])
 async def update_reports(old_user_id: int, new_user_id: int, token: str):
     '''
         Update the reports from one reporting user to another.
@@ -169,7 +126,7 @@ async def update_reports(old_user_id: int, new_user_id: int, token: str):
     return {'OK': 'OK'}
 
 
-@router.post("/v1/report", status_code=status.HTTP_201_CREATED, tags=["Report"])
+@router.post("/v1/report", status_code=status.HTTP_201_CREATED, tags=["Report"], dependencies=[Depends(ingest_bulkhead)])
 async def insert_report(
     detections: List[detection],
     manual_detect: int = Query(0, ge=0, le=1),
@@ -177,18 +134,12 @@ async def insert_report(
     '''
         Inserts detections into to the plugin database.
     '''
-
     # remove duplicates
-    df = pd.DataFrame([d.dict() for d in detections])
-    df.drop_duplicates(
-        subset=['reporter', 'reported', 'region_id'],
-        inplace=True
-    )
-
-    sender = list(df["reporter"].unique())
+    batch = DetectionBatch.from_detections(detections).drop_duplicates()
+    sender = batch.reporters()
 
     # data validation, there can only be one reporter, and it is unrealistic to send more then 5k reports.
-    if len(df) > int(report_maximum) or df["reporter"].nunique() > 1:
+    if len(batch) == 0 or len(batch) > int(report_maximum) or len(sender) > 1:
         logger.debug({"message": "Too many reports", "sender": sender})
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -203,82 +154,74 @@ async def insert_report(
         )
 
     # data validation, checks for correct timing
-    now = int(time.time())
-    lower_bound = (now - back_time_buffer)
-    mask = (df['ts'] > now)
-    mask = mask | (df['ts'] < lower_bound)
+    mask = batch.in_time_window(int(time.time()), back_time_buffer)
 
-    if len(df[~mask]) == 0:
+    if not mask.any():
         logger.debug({
             "message": "Data contains out of bounds time",
-            "reporter": df["reporter"].unique(),
-            "time": df[mask].values[0]
+            "reporter": sender,
+            "time": int(batch.columns['ts'][0])
         })
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Your sightings contain out of bounds time. Contact plugin support on our Discord."
         )
 
-    df = df[~mask]
+    batch = batch.take(mask)
 
     # Successful query
-    logger.debug({"message":f"Received: {len(df)} from: {sender}"})
-
-    # 1) Get a list of unqiue reported names and reporter name
-    names = list(df['reported'].unique())
-    names.extend(df['reporter'].unique())
-
-    # 1.1) Normalize and validate all names
-    clean_names = await jagexify_names_list(names)
+    logger.debug({"message":f"Received: {len(batch)} from: {sender}"})
 
-    # 2) Get IDs for all unique names
-    data = await sql_select_players(clean_names)
-
-    # 3) Create entries for players that do not yet exist in Players table
-    existing_names = [d["normalized_name"] for d in data]
-    new_names = set([name for name in clean_names]).difference(existing_names)
-
-    # 3.1) Insert new names and get those player IDs from step 3
-    if new_names:
-        param = [{"name": name, "normalized_name": name} for name in new_names]
+    # the reporter name must be valid, reported names that are not valid are dropped
+    if not await is_valid_rsn(sender[0]):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="There was an error processing your name. Contact plugin support on our Discord."
+        )
 
-        await batch_function(sql_insert_player, param)
-        data.extend(await sql_select_players(new_names))
+    # normalize names, the ids are resolved when the queue is flushed
+    params = batch.normalize().to_params(manual_detect)
 
-    if len(data) == 0:
+    try:
+        await report_queue.put(params)
+    except QueueFull:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Your sightings are incomplete. Contact plugin support on our Discord."
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again later."
         )
+    return {"detail": "ok"}
 
-    # 4) Insert detections into Reports table with user ids
-    # 4.1) add reported & reporter id
-    df_names = pd.DataFrame(data)
 
-    df = df.merge(df_names, left_on="reported", right_on="name")
+async def flush_reports(params: List[dict]) -> None:
+    '''
+        Write-behind flush of queued report parameters, from any number of requests.
+        All names in the batch are resolved at once and the reports are inserted in one statement.
+    '''
+    names = {p['reported'] for p in params}
+    names.update(p['reporter'] for p in params)
 
-    reporter = [await to_jagex_name(n) for n in df['reporter'].unique()]
-    reporter = df_names.query(f"normalized_name == {reporter}")['id'].to_list()
+    # get IDs for all unique names, players that do not yet exist are created
+    player_ids = await player_names.resolve_or_create(list(names))
 
-    if len(reporter) == 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="There was an error processing your name. Contact plugin support on our Discord."
-        )
+    param = join_player_ids(params, player_ids)
 
-    df["reporter_id"] = reporter[0]
-    df['manual_detect'] = manual_detect
+    if param:
+        await sql_insert_report(param)
+        await mark_reports()
+        await mark_heatmap_reports()
+    return
 
-    # 4.2) parse data to param
-    data = df.to_dict('records')
-    param = [await parse_detection(d) for d in data]
 
-    # 4.3) parse query
-    await batch_function(sql_insert_report, param)
-    return {"detail": "ok"}
+report_queue = WriteBehindQueue(
+    name='report',
+    flush_function=flush_reports,
+    batch_size=Config.report_queue_batch_size,
+    flush_interval=Config.report_queue_flush_interval,
+    max_size=Config.report_queue_max_size
+)
 
 
-@router.get("/v1/report/prediction", tags=["Report", "Business"])
+@router.get("/v1/report/prediction", tags=["Report", "Business"], dependencies=[Depends(read_bulkhead)])
 async def get_report_by_prediction(
     token: str,
     label_jagex: int,
@@ -337,7 +280,7 @@ async def get_report_by_prediction(
     return output
 
 
-@router.get("/v1/report/latest", tags=["Report"])
+@router.get("/v1/report/latest", tags=["Report"], dependencies=[Depends(read_bulkhead)])
 async def get_latest_report_of_a_user(
     token: str,
     reported_id: int = Query(..., ge=0)
@@ -362,7 +305,7 @@ async def get_latest_report_of_a_user(
     return data.rows2dict()
 
 
-@router.get("/v1/report/latest/bulk", tags=["Report"])
+@router.get("/v1/report/latest/bulk", tags=["Report"], dependencies=[Depends(export_bulkhead)])
 async def get_bulk_latest_report_data(
     token: str,
     region_id: Optional[int] = Query(None, ge=0, le=25000),
@@ -1,17 +1,23 @@
-import asyncio
 import logging
-import random
 import time
 from typing import List, Optional
 
+from api.database.contributions import mark_reported
 from api.database.database import EngineType, get_session
-from api.database.functions import batch_function, execute_sql, verify_token
+from api.database.functions import (batch_function, list_to_string,
+                                    verify_token)
+from api.database.heatmaps import mark_banned
+from api.database.hiscore_history import mark_hiscores
 from api.database.models import Player as dbPlayer
 from api.database.models import playerHiscoreData
-from fastapi import APIRouter, BackgroundTasks
+from api.database.retry import SqlError, default_policy
+from api.database.statements import insert_statement, text_statement
+from api.database.scrape_scheduler import scrape_scheduler
+from api.utils.bulkhead import ingest_bulkhead, read_bulkhead
+from api.utils.journal import JournalFull, ingest_journal
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from pydantic import BaseModel
-from sqlalchemy.exc import InternalError, OperationalError
-from sqlalchemy.sql.expression import insert, update
+from sqlalchemy.sql.expression import insert, text
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -116,78 +122,168 @@ class scraper(BaseModel):
     hiscores: Optional[hiscore]
     player: Player
 
-async def sql_get_players_to_scrape(page=1, amount=100_000):
-    sql = 'select * from playersToScrape WHERE 1 ORDER BY RAND()'
-    data = await execute_sql(sql, page=page, row_count=amount)
-    return data.rows2dict()
-
-@router.get("/scraper/players/{page}/{amount}/{token}", tags=["Business"])
+@router.get("/scraper/players/{page}/{amount}/{token}", tags=["Business"], dependencies=[Depends(read_bulkhead)])
 async def get_players_to_scrape(token, page:int=1, amount:int=100_000):
+    '''
+        Lease players to scrape, the players are not handed to another scraper
+        until the lease expires or the hiscores are posted.
+        page is deprecated and ignored.
+    '''
     await verify_token(token, verification='verify_ban')
-    return await sql_get_players_to_scrape(page=page, amount=amount)
+    amount = min(max(amount, 1), 100_000)
+    return await scrape_scheduler.lease(amount)
+
+async def retry_chunk(function, chunk: List):
+    '''
+        run function on the whole chunk, on a deadlock or lock wait timeout the chunk is retried.
+        When it still fails the error is raised, the journal keeps the payload and replays it later.
+        The inserts are insert ignore and the updates set values, so a replay can repeat them.
+    '''
+    try:
+        return await default_policy.run(lambda: function(chunk))
+    except SqlError as e:
+        logger.error({"message": "chunk failed", "function": f"{function.__name__}", "rows": len(chunk), "reason": e.reason})
+        raise
+
+
+player_update_columns = ['name', 'possible_ban', 'confirmed_ban', 'confirmed_player', 'label_id', 'label_jagex', 'updated_at']
+
+# the statements of sqla_update_player, the ones per set of columns are built once in the statement registry
+player_update_create = text('''
+    CREATE TEMPORARY TABLE IF NOT EXISTS tmpPlayerUpdate (
+        id INT PRIMARY KEY,
+        name VARCHAR(15),
+        possible_ban TINYINT,
+        confirmed_ban TINYINT,
+        confirmed_player TINYINT,
+        label_id INT,
+        label_jagex INT,
+        updated_at DATETIME
+    ) ENGINE=MEMORY
+''')
+player_update_clear = text('DELETE FROM tmpPlayerUpdate')
+player_update_drop = text('DROP TEMPORARY TABLE IF EXISTS tmpPlayerUpdate')
+
 
-async def handle_lock(function, data):
-    sleep = random.uniform(0.1,1.1)
-    logger.debug({
-        "message": "lock wait timeout exceeded",
-        "function": f"{function.__name__}",
-        "sleep": sleep
-    })
-    await asyncio.sleep(sleep)
-    await function(data)
+def player_update_statements(columns: tuple) -> tuple:
+    '''
+        the insert, ban change select and update of sqla_update_player for players with these columns.
+        Like an update of the player, every given column is set, None included.
+    '''
+    insert_sql = insert_statement('tmpPlayerUpdate', ('id',) + columns)
+    # players whose ban labels change, their reporters' contributions need a refresh
+    changes = [f"NOT (pl.{c} <=> tmp.{c})" for c in ('possible_ban', 'confirmed_ban', 'confirmed_player') if c in columns]
+    changes_sql = text_statement(f'''
+        SELECT tmp.id
+        FROM tmpPlayerUpdate tmp
+        JOIN Players pl ON (pl.id = tmp.id)
+        WHERE {' OR '.join(changes)}
+    ''') if changes else None
+    apply_sql = text_statement(f'''
+        UPDATE Players pl
+        JOIN tmpPlayerUpdate tmp ON (pl.id = tmp.id)
+        SET {list_to_string([f"pl.{c} = tmp.{c}" for c in columns])}
+    ''')
+    return insert_sql, changes_sql, apply_sql
+
+
+def latest_player_updates(players: List[dict]) -> dict:
+    '''
+        the last update of every player, like updating them one after the other,
+        grouped on the columns they set
+    '''
+    latest = {p['id']: p for p in players}
+
+    groups = {}
+    for player in latest.values():
+        columns = tuple(c for c in player_update_columns if c in player)
+        if columns:
+            groups.setdefault(columns, []).append({c: player[c] for c in ('id',) + columns})
+    return groups
 
 
 async def sqla_update_player(players: List):
+    '''
+        update a chunk of players with one set based update per set of given columns,
+        the rows are loaded into a temporary table and joined on Players.
+        Every given column is set, None clears it. A player that is in the chunk twice gets its last update.
+    '''
     logger.debug({"message":f'update players: {len(players)=}'})
 
-    dbplayer = players.copy()
-    try:
-        async with get_session(EngineType.PLAYERDATA) as session:
-            for player in players:
-                player_id = player.get('id')
-                sql = update(dbPlayer).values(player).where(dbPlayer.id==player_id)
-                await session.execute(sql, player)
-                await session.commit()
-                dbplayer.remove(player)
-    except (OperationalError, InternalError) as e:
-        await handle_lock(sqla_update_player, dbplayer)
+    ban_changes = []
+    async with get_session(EngineType.PLAYERDATA) as session:
+        await session.execute(player_update_create)
+        for columns, param in latest_player_updates(players).items():
+            insert_sql, changes_sql, apply_sql = player_update_statements(columns)
+            await session.execute(player_update_clear)
+            await session.execute(insert_sql, param)
+            if changes_sql is not None:
+                ban_changes += [row[0] for row in await session.execute(changes_sql)]
+            await session.execute(apply_sql)
+        await session.execute(player_update_drop)
+        await session.commit()
+
+    if ban_changes:
+        await mark_reported(ban_changes)
+        await mark_banned(ban_changes)
     return
 
 async def sqla_insert_hiscore(hiscores:List):
+    '''
+        insert a chunk of hiscores with one multi-row insert ignore.
+    '''
     logger.debug({"message":f'insert hiscores: {len(hiscores)=}'})
 
     sql = insert(playerHiscoreData).prefix_with('ignore')
-    dbhiscores = hiscores.copy()
-    try:
-        async with get_session(EngineType.PLAYERDATA) as session:
-            for hiscore in hiscores:
-                await session.execute(sql, hiscore)
-                await session.commit()
-                dbhiscores.remove(hiscore)
-    except (OperationalError, InternalError) as e:
-        await handle_lock(sqla_insert_hiscore, dbhiscores)
 
+    async with get_session(EngineType.PLAYERDATA) as session:
+        await session.execute(sql, hiscores)
+        await session.commit()
     return
 
-@router.post("/scraper/hiscores/{token}", tags=["Business"])
+
+async def sqla_insert_hiscore_chunk(hiscores: List):
+    await retry_chunk(sqla_insert_hiscore, hiscores)
+
+
+async def sqla_update_player_chunk(players: List):
+    await retry_chunk(sqla_update_player, players)
+
+
+@router.post("/scraper/hiscores/{token}", tags=["Business"], dependencies=[Depends(ingest_bulkhead)])
 async def receive_scraper_data(token, data: List[scraper]):
     await verify_token(token, verification='verify_ban', route='[POST]/scraper/hiscores/token')
-    # background task will cause lots of duplicates
-    asyncio.create_task(post_hiscores_to_db(data))
+    scrape_scheduler.complete([d.player.id for d in data])
+
+    # the data is journaled to disk before it is acknowledged, the journal replays it into the database.
+    # players are stamped with the time the data was accepted, not the time it is replayed
+    try:
+        await ingest_journal.append('scraper_hiscores', {'data': [d.dict() for d in data], 'accepted_at': int(time.time())})
+    except JournalFull:
+        raise HTTPException(status_code=503, detail="Server is busy, please try again later.")
     return {'detail': f'{len(data)} records to be inserted.'}
 
 
-async def post_hiscores_to_db(data: List[scraper]):
+async def replay_scraper_data(data):
+    # records journaled before accepted_at was stored are a list of the data
+    if isinstance(data, list):
+        data = {'data': data, 'accepted_at': None}
+    await post_hiscores_to_db([scraper.parse_obj(d) for d in data['data']], data['accepted_at'])
+
+
+async def post_hiscores_to_db(data: List[scraper], accepted_at: int = None):
     # get all players & all hiscores
     data = [d.dict() for d in data]
     players, hiscores = [], []
 
+    accepted_at = time.time() if accepted_at is None else accepted_at
+    time_now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(accepted_at))
+
     for d in data:
         player_dict = d['player']
         hiscore_dict = d['hiscores']
 
         # add extra data
-        time_now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
         player_dict['updated_at'] = time_now
         
         players.append(player_dict)
@@ -196,7 +292,11 @@ async def post_hiscores_to_db(data: List[scraper]):
             hiscores.append(hiscore_dict)
     
     # batchwise insert & update
-    await batch_function(sqla_insert_hiscore, hiscores, batch_size=1000)
-    await sqla_update_player(players)
+    await batch_function(sqla_insert_hiscore_chunk, hiscores, batch_size=1000)
+    await batch_function(sqla_update_player_chunk, players, batch_size=1000)
+    await mark_hiscores([h['Player_id'] for h in hiscores])
     return
+
+
+ingest_journal.register('scraper_hiscores', replay_scraper_data)
   
\ No newline at end of file
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+from api import Config
+from api.utils.metrics import Counter, Gauge
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+BULKHEAD_ACTIVE = Gauge('bulkhead_active_requests', 'Requests holding a slot of a bulkhead.', ('bulkhead',))
+BULKHEAD_WAITING = Gauge('bulkhead_waiting_requests', 'Requests waiting for a slot of a bulkhead.', ('bulkhead',))
+BULKHEAD_WAIT_SECONDS = Counter('bulkhead_wait_seconds_total', 'Time requests waited for a slot of a bulkhead.', ('bulkhead',))
+BULKHEAD_REJECTED = Counter('bulkhead_rejected_total', 'Requests rejected after waiting max_wait seconds for a slot.', ('bulkhead',))
+
+
+class Bulkhead:
+    '''
+        Caps how many requests of one kind run at once, so a burst of one kind (ingest, exports)
+        can not take all database connections from the others.
+        Use as a route dependency, the slot is held until the response is sent:
+            @router.get("/v1/...", dependencies=[Depends(export_bulkhead)])
+    '''
+    def __init__(self, name: str, limit: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> None:
+        start = time.perf_counter()
+        BULKHEAD_WAITING.inc(bulkhead=self.name)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            BULKHEAD_REJECTED.inc(bulkhead=self.name)
+            logger.warning({"message": "bulkhead full", "bulkhead": self.name, "limit": self.limit})
+            raise HTTPException(status_code=503, detail="Server busy, try again later.", headers={'Retry-After': '5'})
+        finally:
+            BULKHEAD_WAITING.dec(bulkhead=self.name)
+            BULKHEAD_WAIT_SECONDS.inc(time.perf_counter() - start, bulkhead=self.name)
+        BULKHEAD_ACTIVE.inc(bulkhead=self.name)
+
+    def release(self) -> None:
+        BULKHEAD_ACTIVE.dec(bulkhead=self.name)
+        self._semaphore.release()
+
+    async def __call__(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# ingest: reports, hiscores and bulk writes, export: bulk and file responses, read: everything else
+ingest_bulkhead = Bulkhead('ingest', Config.bulkhead_ingest_limit, Config.bulkhead_max_wait)
+read_bulkhead = Bulkhead('read', Config.bulkhead_read_limit, Config.bulkhead_max_wait)
+export_bulkhead = Bulkhead('export', Config.bulkhead_export_limit, Config.bulkhead_max_wait)
+
+if ingest_bulkhead.limit + read_bulkhead.limit + export_bulkhead.limit > Config.playerdata_connections:
+    logger.warning({
+        "message": "bulkhead limits are more than the connection pool, requests will wait on the pool",
+        "limits": ingest_bulkhead.limit + read_bulkhead.limit + export_bulkhead.limit,
+        "connections": Config.playerdata_connections
+    })
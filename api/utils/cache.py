@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+MISSING = object()
+
+
+class LRUCache:
+    '''
+        Bounded least recently used cache, entries can have a time to live.
+        When max_size is reached the least recently used entry is evicted.
+    '''
+    def __init__(self, max_size: int = 100_000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        entry = self._data.get(key, MISSING)
+
+        if entry is MISSING:
+            self.misses += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = MISSING) -> None:
+        ttl = self.ttl if ttl is MISSING else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
@@ -0,0 +1,48 @@
+'''
+    CPU bound jobs that run in the worker pool, see api.utils.workers.
+    Everything here must be importable without the app (no Config, no database)
+    and take and return picklable values only.
+'''
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import pandas as pd
+
+# same rules as is_valid_rsn and to_jagex_name in api.database.functions
+RSN_REGEX = r'^[\w\d\s_-]{1,13}$'
+
+
+def timed(fn: Callable, *args) -> Tuple[Any, float]:
+    '''run fn and return its result with the execution time, used by the worker pool'''
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def clean_legacy_detections(records: List[dict], now: int) -> Tuple[List[dict], Optional[str]]:
+    '''
+        dedupe, validate and normalize the detections of the legacy detect route.
+        Returns the detections to insert, or an empty list and the reason they were rejected.
+    '''
+    df = pd.DataFrame(records)
+    if df.empty:
+        return [], 'no detections'
+
+    df.drop_duplicates(subset=['reporter', 'reported', 'region_id'], inplace=True)
+
+    # data validation, there can only be one reporter, and it is unrealistic to send more then 5k reports.
+    if len(df) > 5000 or df["reporter"].nunique() > 1:
+        return [], 'Too many reports.'
+
+    # data validation, checks for correct timing
+    mask = (df['ts'] > now + 3600) | (df['ts'] < now - 25200)
+    if mask.any():
+        return [], f"Data contains out of bounds time: {df.loc[mask, 'ts'].iloc[0]}"
+
+    # validate and normalize names, detections of an invalid name are dropped
+    for column in ('reporter', 'reported'):
+        df = df[df[column].str.match(RSN_REGEX)].copy()
+        df[column] = df[column].str.lower().str.replace('_', ' ').str.replace('-', ' ').str.strip()
+
+    return df.to_dict('records'), None
+
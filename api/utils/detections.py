@@ -0,0 +1,148 @@
+import re
+from operator import attrgetter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# same rules as is_valid_rsn and to_jagex_name in api.database.functions
+RSN_PATTERN = re.compile(r'[\w\d\s_-]{1,13}')
+
+INT_COLUMNS = (
+    'region_id', 'x_coord', 'y_coord', 'z_coord', 'ts',
+    'on_members_world', 'on_pvp_world', 'world_number', 'equip_ge_value'
+)
+EQUIPMENT_COLUMNS = (
+    'equip_head_id', 'equip_amulet_id', 'equip_torso_id', 'equip_legs_id', 'equip_boots_id',
+    'equip_cape_id', 'equip_hands_id', 'equip_weapon_id', 'equip_shield_id'
+)
+
+_int_getter = attrgetter(*INT_COLUMNS)
+_equipment_getter = attrgetter(*EQUIPMENT_COLUMNS)
+
+
+def factorize(values: np.ndarray) -> Tuple[list, np.ndarray]:
+    '''
+        distinct values in order of appearance and the code of every value,
+        hashing is a lot cheaper than np.unique on an object array, which sorts.
+    '''
+    codes = {}
+    inverse = np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int64, count=len(values))
+    return list(codes), inverse
+
+
+def normalize_names(names: np.ndarray) -> np.ndarray:
+    '''
+        jagex names for an array of names, None where the name is not valid.
+        Every distinct name is only normalized once.
+    '''
+    unique, inverse = factorize(names)
+    normalized = np.array([
+        n.lower().replace('_', ' ').replace('-', ' ').strip() if RSN_PATTERN.fullmatch(n) else None
+        for n in unique
+    ], dtype=object)
+    return normalized[inverse]
+
+
+class DetectionBatch:
+    '''
+        The detections of one request, stored per column in numpy arrays.
+        The arrays are built once from the request models, dedupe, time checks,
+        name normalization and the insert parameters work on whole columns.
+    '''
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    @classmethod
+    def from_detections(cls, detections: List) -> 'DetectionBatch':
+        # one pass over the models, then the rows are split in columns
+        ints = np.array([_int_getter(d) for d in detections], dtype=np.int64).reshape(-1, len(INT_COLUMNS))
+        # equipment slots are optional, keep them as objects so None survives
+        equipment = np.array([_equipment_getter(d.equipment) for d in detections], dtype=object).reshape(-1, len(EQUIPMENT_COLUMNS))
+
+        columns = {
+            'reporter': np.array([d.reporter for d in detections], dtype=object),
+            'reported': np.array([d.reported for d in detections], dtype=object),
+        }
+        columns.update({name: ints[:, i] for i, name in enumerate(INT_COLUMNS)})
+        columns.update({name: equipment[:, i] for i, name in enumerate(EQUIPMENT_COLUMNS)})
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.columns['ts'])
+
+    def take(self, index: np.ndarray) -> 'DetectionBatch':
+        return DetectionBatch({name: column[index] for name, column in self.columns.items()})
+
+    def drop_duplicates(self) -> 'DetectionBatch':
+        '''keep the first detection of every (reporter, reported, region_id)'''
+        if len(self) == 0:
+            return self
+
+        _, reporter = factorize(self.columns['reporter'])
+        reported_names, reported = factorize(self.columns['reported'])
+        region = self.columns['region_id']
+
+        key = reporter * len(reported_names) + reported
+        key = key * (int(region.max()) + 1) + region
+        _, first = np.unique(key, return_index=True)
+        return self.take(np.sort(first))
+
+    def reporters(self) -> List[str]:
+        return factorize(self.columns['reporter'])[0]
+
+    def in_time_window(self, now: int, back_buffer: int) -> np.ndarray:
+        '''mask of the detections that are not in the future and not older than back_buffer seconds'''
+        ts = self.columns['ts']
+        return (ts <= now) & (ts >= now - back_buffer)
+
+    def normalize(self) -> 'DetectionBatch':
+        '''jagex names for reporter and reported, detections of an invalid reported name are dropped'''
+        columns = dict(self.columns)
+        columns['reporter'] = normalize_names(columns['reporter'])
+        columns['reported'] = normalize_names(columns['reported'])
+        batch = DetectionBatch(columns)
+        return batch.take(np.flatnonzero(columns['reported'] != None))
+
+    def to_params(self, manual_detect: int) -> List[dict]:
+        '''
+            stgReport insert parameters, with the reporter and reported names
+            instead of their ids, see join_player_ids.
+        '''
+        timestamp = np.datetime_as_string(self.columns['ts'].astype('datetime64[s]'))
+        columns = {
+            'reported': self.columns['reported'],
+            'reporter': self.columns['reporter'],
+            'region_id': self.columns['region_id'],
+            'x_coord': self.columns['x_coord'],
+            'y_coord': self.columns['y_coord'],
+            'z_coord': self.columns['z_coord'],
+            'timestamp': np.array([t.replace('T', ' ') for t in timestamp.tolist()]),
+            'manual_detect': np.full(len(self), manual_detect),
+            'on_members_world': self.columns['on_members_world'],
+            'on_pvp_world': self.columns['on_pvp_world'],
+            'world_number': self.columns['world_number'],
+            **{name: self.columns[name] for name in EQUIPMENT_COLUMNS},
+            'equip_ge_value': self.columns['equip_ge_value'],
+        }
+        keys = list(columns.keys())
+        values = [column.tolist() for column in columns.values()]
+        return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def join_player_ids(params: List[dict], player_ids: Dict[str, int]) -> List[dict]:
+    '''
+        replace the reporter and reported names with reportingID and reportedID,
+        parameters of a name that is not resolved are dropped. The input is not modified.
+    '''
+    output = []
+    for param in params:
+        reported_id = player_ids.get(param['reported'])
+        reporting_id = player_ids.get(param['reporter'])
+        if reported_id is None or reporting_id is None:
+            continue
+
+        row = {k: v for k, v in param.items() if k not in ('reported', 'reporter')}
+        row['reportedID'] = reported_id
+        row['reportingID'] = reporting_id
+        output.append(row)
+    return output
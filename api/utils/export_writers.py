@@ -0,0 +1,132 @@
+'''
+    Writers of the ban exports. Rows are written chunk by chunk as they are streamed
+    from the database, neither writer keeps the rows it has written in memory.
+    The write calls are blocking, they are run in a thread by api.database.exports.
+'''
+import abc
+import csv
+import datetime
+import decimal
+from typing import List, Optional, Set
+
+import xlsxwriter
+
+TOTAL_SHEET = 'Total'
+
+
+def cell(value):
+    '''values xlsxwriter can not write as is are written as text'''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    return str(value)
+
+
+class ExportWriter(abc.ABC):
+    '''
+        Every row of every account goes to the total, once per Player_id.
+        The set of written Player_ids is the only state that grows with the export.
+    '''
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.rows = 0
+        self._players: Set[int] = set()
+
+    def _dedupe(self, rows: List[dict]) -> List[dict]:
+        unique = []
+        for row in rows:
+            player_id = row.get('Player_id')
+            if player_id in self._players:
+                continue
+            self._players.add(player_id)
+            unique.append(row)
+        return unique
+
+    @abc.abstractmethod
+    def write(self, account: str, rows: List[dict]) -> None:
+        '''write a chunk of the rows of an account'''
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        '''finish the file'''
+
+
+class CsvExportWriter(ExportWriter):
+    '''csv only has the total'''
+    def __init__(self, file_path: str):
+        super().__init__(file_path)
+        self._file = open(file_path, 'w', newline='', encoding='utf-8')
+        self._writer: Optional[csv.DictWriter] = None
+
+    def write(self, account: str, rows: List[dict]) -> None:
+        rows = self._dedupe(rows)
+        if not rows:
+            return
+
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(rows[0].keys()))
+            self._writer.writeheader()
+
+        self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class XlsxExportWriter(ExportWriter):
+    '''
+        a Total sheet and one sheet per account. The workbook is in constant memory mode,
+        every row is flushed to disk when the next one is written.
+    '''
+    def __init__(self, file_path: str):
+        super().__init__(file_path)
+        self._workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+        self._sheets = {}
+        # the total is the first sheet, it is added before any account sheet
+        self._sheet(TOTAL_SHEET)
+
+    def _sheet(self, name: str) -> list:
+        # [worksheet, next row], the header is written with the first row
+        if name not in self._sheets:
+            self._sheets[name] = [self._workbook.add_worksheet(name[:31]), 0]
+        return self._sheets[name]
+
+    def _write_rows(self, name: str, rows: List[dict]) -> None:
+        if not rows:
+            return
+
+        sheet = self._sheet(name)
+        worksheet, row_number = sheet
+        if row_number == 0:
+            worksheet.write_row(0, 0, list(rows[0].keys()))
+            row_number = 1
+
+        for row in rows:
+            worksheet.write_row(row_number, 0, [cell(v) for v in row.values()])
+            row_number += 1
+        sheet[1] = row_number
+
+    def write(self, account: str, rows: List[dict]) -> None:
+        self._write_rows(account, rows)
+
+        total = self._dedupe(rows)
+        self._write_rows(TOTAL_SHEET, total)
+        self.rows += len(total)
+
+    def close(self) -> None:
+        self._workbook.close()
+
+
+WRITERS = {
+    'csv': CsvExportWriter,
+    'excel': XlsxExportWriter,
+}
+
+EXTENSIONS = {
+    'csv': 'csv',
+    'excel': 'xlsx',
+}
@@ -0,0 +1,81 @@
+'''
+    Bounded fan-out, independent calls run in parallel with a cap on how many run at once.
+    A fixed number of workers take the items in turn, so a thousand items never
+    means a thousand tasks or a thousand checked out connections.
+'''
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+from api.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+FAN_OUT_CALLS = Counter('fan_out_calls_total', 'Calls made by fan_out, by result: ok, error or timeout.', ('name', 'result'))
+
+
+class Outcome:
+    '''result of one call, error is the exception it raised or None'''
+    __slots__ = ('item', 'value', 'error')
+
+    def __init__(self, item: Any, value: Any = None, error: Optional[BaseException] = None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def fan_out(
+    function: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    concurrency: int = 8,
+    timeout: Optional[float] = None,
+    name: str = 'fan_out'
+) -> List[Outcome]:
+    '''
+        await function(item) for every item, at most concurrency at a time and each within timeout seconds.
+        Returns one outcome per item in the order of items, a failed call never cancels the others.
+    '''
+    items = list(items)
+    outcomes = [Outcome(item) for item in items]
+    pending = iter(outcomes)
+
+    async def call(outcome: Outcome):
+        try:
+            outcome.value = await asyncio.wait_for(function(outcome.item), timeout)
+            FAN_OUT_CALLS.inc(name=name, result='ok')
+        except asyncio.TimeoutError as e:
+            outcome.error = e
+            FAN_OUT_CALLS.inc(name=name, result='timeout')
+        except Exception as e:
+            outcome.error = e
+            FAN_OUT_CALLS.inc(name=name, result='error')
+
+    async def worker():
+        # the workers share one iterator, every item is taken by exactly one of them
+        for outcome in pending:
+            await call(outcome)
+
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, len(items)))])
+
+    failed = [o for o in outcomes if not o.ok]
+    if failed:
+        logger.warning({
+            "message": "fan out calls failed",
+            "name": name,
+            "failed": len(failed),
+            "total": len(outcomes),
+            "error": repr(failed[0].error)
+        })
+    return outcomes
+
+
+def raise_failed(outcomes: List[Outcome]) -> List[Any]:
+    '''the values of the outcomes, or the error of the first failed call'''
+    for outcome in outcomes:
+        if not outcome.ok:
+            raise outcome.error
+    return [o.value for o in outcomes]
@@ -0,0 +1,257 @@
+'''
+    Compact hiscore history, the snapshots of one player delta encoded against the previous one.
+
+    A history is a version byte followed by one record per snapshot, in id order.
+    Every number is a varint, signed numbers are zigzag encoded:
+        id - previous id
+        seconds of timestamp - previous seconds
+        flags: 1 ts_date is None, 2 ts_date is not the date of timestamp, 4 a null mask follows
+        [days of ts_date - days of the date of timestamp, if flag 2]
+        changed mask, bit i is set when column i has a new value
+        [null mask, bit i is set when column i is None, if flag 4]
+        the change of every column in the changed mask, in column order
+    Most columns do not change from one day to the next, so a snapshot is mostly its masks.
+    Everything here is importable without the app, there is no database access.
+'''
+import datetime
+from typing import Iterator, List, Optional, Tuple
+
+VERSION = 1
+
+# the order is part of the format, new columns need a new version
+COLUMNS = (
+    'total', 'attack', 'defence', 'strength', 'hitpoints', 'ranged', 'prayer', 'magic', 'cooking',
+    'woodcutting', 'fletching', 'fishing', 'firemaking', 'crafting', 'smithing', 'mining', 'herblore',
+    'agility', 'thieving', 'slayer', 'farming', 'runecraft', 'hunter', 'construction', 'league',
+    'bounty_hunter_hunter', 'bounty_hunter_rogue', 'cs_all', 'cs_beginner', 'cs_easy', 'cs_medium',
+    'cs_hard', 'cs_elite', 'cs_master', 'lms_rank', 'soul_wars_zeal', 'abyssal_sire', 'alchemical_hydra',
+    'barrows_chests', 'bryophyta', 'callisto', 'cerberus', 'chambers_of_xeric',
+    'chambers_of_xeric_challenge_mode', 'chaos_elemental', 'chaos_fanatic', 'commander_zilyana',
+    'corporeal_beast', 'crazy_archaeologist', 'dagannoth_prime', 'dagannoth_rex', 'dagannoth_supreme',
+    'deranged_archaeologist', 'general_graardor', 'giant_mole', 'grotesque_guardians', 'hespori',
+    'kalphite_queen', 'king_black_dragon', 'kraken', 'kreearra', 'kril_tsutsaroth', 'mimic', 'nightmare',
+    'nex', 'phosanis_nightmare', 'obor', 'sarachnis', 'scorpia', 'skotizo', 'tempoross', 'the_gauntlet',
+    'the_corrupted_gauntlet', 'theatre_of_blood', 'theatre_of_blood_hard', 'thermonuclear_smoke_devil',
+    'tzkal_zuk', 'tztok_jad', 'venenatis', 'vetion', 'vorkath', 'wintertodt', 'zalcano', 'zulrah',
+)
+
+TS_DATE_NONE = 1
+TS_DATE_OTHER = 2
+HAS_NULLS = 4
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class HistoryError(ValueError):
+    pass
+
+
+def _write(out: bytearray, n: int) -> None:
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_signed(out: bytearray, n: int) -> None:
+    _write(out, n << 1 if n >= 0 else (-n << 1) - 1)
+
+
+def _read(data: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        try:
+            b = data[pos]
+        except IndexError:
+            raise HistoryError("History ends in the middle of a number.")
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read_signed(data: bytes, pos: int) -> Tuple[int, int]:
+    n, pos = _read(data, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _seconds(ts: datetime.datetime) -> int:
+    return (ts - EPOCH) // datetime.timedelta(seconds=1)
+
+
+class HistoryState:
+    '''
+        where the decoder is at the end of a history, what the next snapshot is encoded against.
+        values are the running values, a column that is None in the last snapshot keeps its last known value.
+    '''
+    __slots__ = ('id', 'seconds', 'values')
+
+    def __init__(self, row_id: int = 0, seconds: int = 0, values: Optional[List[int]] = None):
+        self.id = row_id
+        self.seconds = seconds
+        self.values = [0] * len(COLUMNS) if values is None else list(values)
+
+
+def encode_history(rows: List[dict], state: Optional[HistoryState] = None) -> bytes:
+    '''
+        rows of one player in id order, as they are in playerHiscoreData.
+        Without state this is a whole history, with the state of a history (see history_state)
+        the records can be appended to that history.
+    '''
+    out = bytearray()
+    if state is None:
+        out.append(VERSION)
+        state = HistoryState()
+    else:
+        state = HistoryState(state.id, state.seconds, state.values)
+
+    values = state.values
+    for row in rows:
+        ts = row['timestamp']
+        seconds = _seconds(ts)
+        _write_signed(out, row['id'] - state.id)
+        _write_signed(out, seconds - state.seconds)
+        state.id, state.seconds = row['id'], seconds
+
+        changed = nulls = 0
+        deltas = []
+        for i, column in enumerate(COLUMNS):
+            value = row.get(column)
+            if value is None:
+                nulls |= 1 << i
+            elif value != values[i]:
+                changed |= 1 << i
+                deltas.append(value - values[i])
+                values[i] = value
+
+        ts_date = row.get('ts_date')
+        flags = HAS_NULLS if nulls else 0
+        if ts_date is None:
+            flags |= TS_DATE_NONE
+        elif ts_date != ts.date():
+            flags |= TS_DATE_OTHER
+
+        _write(out, flags)
+        if flags & TS_DATE_OTHER:
+            _write_signed(out, (ts_date - ts.date()).days)
+        _write(out, changed)
+        if nulls:
+            _write(out, nulls)
+        for delta in deltas:
+            _write_signed(out, delta)
+
+    return bytes(out)
+
+
+def _records(data: bytes) -> Iterator[Tuple[int, datetime.datetime, Optional[datetime.date], int, List[Tuple[int, int]]]]:
+    '''(id, timestamp, ts_date, null mask, [(column index, change)]) of every record'''
+    if not data:
+        return
+    if data[0] != VERSION:
+        raise HistoryError(f"Unknown history version: {data[0]}")
+
+    pos, end = 1, len(data)
+    row_id = seconds = 0
+    while pos < end:
+        delta, pos = _read_signed(data, pos)
+        row_id += delta
+        delta, pos = _read_signed(data, pos)
+        seconds += delta
+        ts = EPOCH + datetime.timedelta(seconds=seconds)
+
+        flags, pos = _read(data, pos)
+        if flags & TS_DATE_NONE:
+            ts_date = None
+        elif flags & TS_DATE_OTHER:
+            days, pos = _read_signed(data, pos)
+            ts_date = ts.date() + datetime.timedelta(days=days)
+        else:
+            ts_date = ts.date()
+
+        changed, pos = _read(data, pos)
+        nulls = 0
+        if flags & HAS_NULLS:
+            nulls, pos = _read(data, pos)
+
+        # only the set bits are visited, a snapshot changes a handful of the columns
+        changes = []
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            n = data[pos] if pos < end else 0x80
+            if n < 0x80:
+                pos += 1
+            else:
+                n, pos = _read(data, pos)
+            changes.append((low.bit_length() - 1, (n >> 1) ^ -(n & 1)))
+        yield row_id, ts, ts_date, nulls, changes
+
+
+def _row(row_id: int, ts: datetime.datetime, ts_date: Optional[datetime.date], player_id: int, values: List[int], nulls: int) -> dict:
+    row = {'id': row_id, 'timestamp': ts, 'ts_date': ts_date, 'Player_id': player_id}
+    if nulls:
+        for i, column in enumerate(COLUMNS):
+            row[column] = None if nulls >> i & 1 else values[i]
+    else:
+        row.update(zip(COLUMNS, values))
+    return row
+
+
+def decode_history(data: bytes, player_id: int) -> List[dict]:
+    '''the full rows of a history, like they are in playerHiscoreData'''
+    rows = []
+    values = [0] * len(COLUMNS)
+    for row_id, ts, ts_date, nulls, changes in _records(data):
+        for i, delta in changes:
+            values[i] += delta
+        rows.append(_row(row_id, ts, ts_date, player_id, values, nulls))
+    return rows
+
+
+def decode_deltas(data: bytes, player_id: int) -> List[dict]:
+    '''
+        the change of every column from one snapshot to the next, one row per snapshot after the first.
+        Unchanged columns are 0, a column that is None in either snapshot is None.
+    '''
+    rows = []
+    previous_nulls = None
+    for row_id, ts, ts_date, nulls, changes in _records(data):
+        if previous_nulls is not None:
+            deltas = [0] * len(COLUMNS)
+            for i, delta in changes:
+                deltas[i] = delta
+            rows.append(_row(row_id, ts, ts_date, player_id, deltas, nulls | previous_nulls))
+        previous_nulls = nulls
+    return rows
+
+
+def history_state(data: bytes) -> Optional[HistoryState]:
+    '''the state of the decoder after the last record, what new rows are appended against'''
+    state = None
+    values = [0] * len(COLUMNS)
+    for row_id, ts, _, _, changes in _records(data):
+        for i, delta in changes:
+            values[i] += delta
+        state = (row_id, ts)
+
+    if state is None:
+        return None
+    row_id, ts = state
+    return HistoryState(row_id, _seconds(ts), values)
+
+
+def last_snapshot(data: bytes, player_id: int) -> Optional[dict]:
+    '''the last row of a history'''
+    values = [0] * len(COLUMNS)
+    last = None
+    for record in _records(data):
+        for i, delta in record[4]:
+            values[i] += delta
+        last = record
+
+    if last is None:
+        return None
+
+    row_id, ts, ts_date, nulls, _ = last
+    return _row(row_id, ts, ts_date, player_id, values, nulls)
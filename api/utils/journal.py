@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from api import Config
+from api.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_BYTES = Gauge('journal_pending_bytes', 'Bytes in the journal waiting to be replayed.', ('journal',))
+JOURNAL_RECORDS = Counter('journal_records_total', 'Records handled by the journal.', ('journal', 'status'))
+
+
+class JournalFull(Exception):
+    pass
+
+
+class Journal:
+    '''
+        Append-only journal on disk, split in segments of json lines.
+        A payload is written to the active segment before the request is acknowledged,
+        the replayer seals the active segment every seal_interval seconds and hands
+        the records of sealed segments to their handler, with at most concurrency handlers running.
+        A segment is deleted once all its records are handled, so delivery is at-least-once.
+
+        A failed record goes back in the journal in a segment named after the time it is due,
+        with exponential backoff from retry_base to retry_cap seconds. Records that fail with a
+        transient error (one with a true retryable attribute, like SqlError, or a connection error)
+        are kept until they succeed, other failures are dropped after max_attempts.
+        Lines that can not be decoded, like a line torn by a crash, are moved to a .corrupt file.
+
+        The journal is as durable as its directory, a pod only keeps it over a pod restart
+        when journal_dir is on a volume that outlives the pod.
+    '''
+    def __init__(
+        self,
+        name: str,
+        directory: str,
+        segment_size: int = 16 * 2**20,
+        max_bytes: int = 2**30,
+        seal_interval: float = 1.0,
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        retry_base: float = 1.0,
+        retry_cap: float = 300.0,
+        fsync: bool = False
+    ):
+        self.name = name
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.seal_interval = seal_interval
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.fsync = fsync
+        self.handlers: Dict[str, Callable[[Any], Awaitable[None]]] = {}
+
+        self._active = None
+        self._active_path = None
+        self._active_size = 0
+        self._active_opened = 0
+        self._pending_bytes = 0
+        self._closing = False
+        self._task = None
+        self._lock = None
+        self._wakeup = None
+
+        JOURNAL_BYTES.set_function(lambda: self._pending_bytes, journal=name)
+
+    def register(self, kind: str, handler: Callable[[Any], Awaitable[None]]) -> None:
+        self.handlers[kind] = handler
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        # segments that were still open when the process stopped are sealed and replayed
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.open'):
+                path = os.path.join(self.directory, file_name)
+                os.replace(path, path[:-len('.open')] + '.log')
+
+        self._pending_bytes = sum(os.path.getsize(p) for p in self._sealed_segments())
+        self._closing = False
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        '''stop replaying, records that are not replayed yet stay on disk for the next start'''
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        async with self._lock:
+            self._seal()
+
+    async def append(self, kind: str, payload: Any) -> None:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for {kind}.")
+
+        if self._task is None:
+            # journal is not running, handle the payload directly
+            await self.handlers[kind](payload)
+            return
+
+        line = self._encode({'kind': kind, 'payload': payload, 'attempt': 0})
+
+        if self._pending_bytes + len(line) > self.max_bytes:
+            JOURNAL_RECORDS.inc(journal=self.name, status='rejected')
+            raise JournalFull(f"{self.name} journal is full.")
+
+        async with self._lock:
+            await asyncio.to_thread(self._write, line)
+        JOURNAL_RECORDS.inc(journal=self.name, status='appended')
+
+    def _encode(self, record: dict) -> bytes:
+        return (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode()
+
+    def _write(self, line: bytes) -> None:
+        if self._active is None:
+            self._active_path = os.path.join(self.directory, f'{time.time_ns():020d}.open')
+            self._active = open(self._active_path, 'ab')
+            self._active_size = 0
+            self._active_opened = time.monotonic()
+
+        self._active.write(line)
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+
+        self._active_size += len(line)
+        self._pending_bytes += len(line)
+
+        if self._active_size >= self.segment_size:
+            self._seal()
+
+    def _seal(self) -> None:
+        if self._active is None:
+            return
+        self._active.close()
+        os.replace(self._active_path, self._active_path[:-len('.open')] + '.log')
+        self._active = None
+
+    def _write_segment(self, name: int, lines: List[bytes]) -> None:
+        '''a sealed segment of lines, segments are replayed once the time in their name has passed'''
+        path = os.path.join(self.directory, f'{name:020d}.log')
+        with open(path, 'ab') as f:
+            f.writelines(lines)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._pending_bytes += sum(len(line) for line in lines)
+
+    def _sealed_segments(self) -> List[str]:
+        return sorted(
+            os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.log')
+        )
+
+    def _due_segments(self) -> List[str]:
+        now = time.time_ns()
+        return [p for p in self._sealed_segments() if int(os.path.basename(p)[:-len('.log')]) <= now]
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.retry_cap, self.retry_base * 2 ** (attempt - 1))
+
+    @staticmethod
+    def _transient(e: Exception) -> bool:
+        '''the error can go away on its own, like lock contention or a lost database connection'''
+        return bool(getattr(e, 'retryable', False)) or isinstance(e, (ConnectionError, asyncio.TimeoutError))
+
+    async def _run(self) -> None:
+        while not self._closing:
+            async with self._lock:
+                if self._active is not None and time.monotonic() - self._active_opened >= self.seal_interval:
+                    self._seal()
+
+            for path in self._due_segments():
+                if self._closing:
+                    break
+                try:
+                    await self._replay(path)
+                except Exception as e:
+                    # the segment stays on disk and is tried again on the next round
+                    logger.error({"message": "replay of segment failed", "journal": self.name, "segment": path, "error": str(e)})
+                    break
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.seal_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _replay(self, path: str) -> None:
+        def read():
+            records, corrupt = [], []
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        if not isinstance(record, dict) or 'kind' not in record or 'payload' not in record:
+                            raise ValueError("not a journal record")
+                        records.append(record)
+                    except ValueError:
+                        corrupt.append(line if line.endswith(b'\n') else line + b'\n')
+
+            if corrupt:
+                with open(path[:-len('.log')] + '.corrupt', 'ab') as f:
+                    f.writelines(corrupt)
+            return records, corrupt
+
+        size = os.path.getsize(path)
+        records, corrupt = await asyncio.to_thread(read)
+        if corrupt:
+            JOURNAL_RECORDS.inc(len(corrupt), journal=self.name, status='corrupt')
+            logger.error({"message": "undecodable journal lines quarantined", "journal": self.name, "segment": path, "lines": len(corrupt)})
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed: Dict[int, List[bytes]] = {}
+
+        async def handle(record: dict):
+            async with semaphore:
+                try:
+                    await self.handlers[record['kind']](record['payload'])
+                    JOURNAL_RECORDS.inc(journal=self.name, status='replayed')
+                except Exception as e:
+                    record['attempt'] = record.get('attempt', 0) + 1
+                    transient = self._transient(e)
+                    logger.error({"message": "replay failed", "journal": self.name, "kind": record['kind'], "attempt": record['attempt'], "transient": transient, "error": str(e)})
+
+                    if transient or record['attempt'] < self.max_attempts:
+                        failed.setdefault(record['attempt'], []).append(self._encode(record))
+                        JOURNAL_RECORDS.inc(journal=self.name, status='retried')
+                    else:
+                        JOURNAL_RECORDS.inc(journal=self.name, status='dropped')
+
+        await asyncio.gather(*[handle(record) for record in records])
+
+        # failed records go back in the journal, due after their backoff, then the segment is done
+        async with self._lock:
+            for attempt, lines in failed.items():
+                due = time.time_ns() + int(self._backoff(attempt) * 1e9)
+                await asyncio.to_thread(self._write_segment, due, lines)
+            os.remove(path)
+            self._pending_bytes -= size
+
+ingest_journal = Journal(
+    name='ingest',
+    directory=Config.journal_dir,
+    max_bytes=Config.journal_max_bytes,
+    concurrency=Config.journal_concurrency
+)
@@ -0,0 +1,126 @@
+'''
+    Logging pipeline, records are put on a bounded queue by the calling thread and formatted
+    and written by a listener thread, so file and stdout writes never block the event loop.
+'''
+import atexit
+import copy
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+from api.utils.metrics import Counter
+
+LOG_RECORDS = Counter('log_records_total', 'Log records by what happened to them: queued, sampled out or dropped on a full queue.', ('result',))
+
+
+class JsonFormatter(logging.Formatter):
+    '''one json object per line, dict messages are kept as objects'''
+    def format(self, record: logging.LogRecord) -> str:
+        msg = record.msg if isinstance(record.msg, dict) else record.getMessage()
+        entry = {
+            'ts': self.formatTime(record),
+            'name': record.name,
+            'function': record.funcName,
+            'level': record.levelname,
+            'msg': msg,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    '''keeps 1 in every `every` records at or below level, counted per call site'''
+    def __init__(self, every: int, level: int = logging.DEBUG):
+        super().__init__()
+        self.every = every
+        self.level = level
+        self._seen: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 1 or record.levelno > self.level:
+            return True
+        key = (record.name, record.lineno)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % self.every == 0:
+            return True
+        LOG_RECORDS.inc(result='sampled')
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    '''never blocks the caller, records are dropped when the queue is full'''
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the listener, only what can not cross threads is resolved here
+        record = copy.copy(record)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.inc(result='queued')
+        except queue.Full:
+            LOG_RECORDS.inc(result='dropped')
+
+
+def parse_levels(levels: str) -> Dict[str, str]:
+    '''"aiomysql=ERROR,api.middleware=INFO" to {logger: level}'''
+    parsed = {}
+    for item in levels.split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+listener: Optional[QueueListener] = None
+
+
+def setup_logging(handlers: List[logging.Handler], level: str = 'DEBUG', levels: Dict[str, str] = None, debug_sample: int = 1, max_queue: int = 10_000) -> None:
+    '''
+        route the root logger through a queue to handlers, written by a background listener.
+        levels sets the level per logger, debug_sample keeps 1 in debug_sample debug records per call site.
+    '''
+    global listener
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(max_queue))
+    queue_handler.addFilter(SampleFilter(debug_sample))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    stop_logging()
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+
+def stop_logging() -> None:
+    '''write what is still queued and stop the listener'''
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,139 @@
+'''
+    In-process metrics, rendered in the prometheus text exposition format.
+    Metrics register themselves on creation and are served by /metrics.
+'''
+import bisect
+import math
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, 'Metric'] = {}
+
+    def register(self, metric: 'Metric') -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered.")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    labels = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels.items()
+    )
+    return '{' + labels + '}'
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[l]) for l in self.labelnames)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        '''the gauge is evaluated by calling function at scrape time'''
+        self._functions[self._key(labels)] = function
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        samples = super().samples()
+        for key, function in self._functions.items():
+            samples.append((self.name, dict(zip(self.labelnames, key)), function()))
+        return samples
+
+
+class Histogram(Metric):
+    '''observations counted in cumulative buckets, for percentiles with histogram_quantile()'''
+    type = 'histogram'
+
+    # seconds, from 5ms to 10s
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple, List[int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            # one count per bucket and one for +Inf
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[key] = self._values.get(key, 0.0) + value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        samples = []
+        for key, counts in self._counts.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                samples.append((f'{self.name}_bucket', {**labels, 'le': le}, cumulative))
+            samples.append((f'{self.name}_sum', labels, self._values[key]))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
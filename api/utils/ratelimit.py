@@ -0,0 +1,63 @@
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class SlidingWindowRateLimiter:
+    '''
+        Approximate sliding window counter, per key only the current and previous window are kept.
+        The count over the last window seconds is the current count plus the previous count
+        weighted by how much of the previous window still overlaps.
+    '''
+    def __init__(self, window: float = 3600):
+        self.window = window
+        # key -> (window index, current count, previous count)
+        self._counts: Dict[Hashable, Tuple[int, float, float]] = {}
+        # key -> when it was last seeded
+        self._seeded: Dict[Hashable, float] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._counts
+
+    def _rotate(self, key: Hashable, now: float) -> Tuple[int, float, float]:
+        index = int(now // self.window)
+        entry = self._counts.get(key)
+
+        if entry is None:
+            return index, 0, 0
+
+        entry_index, current, previous = entry
+        if entry_index == index:
+            return entry
+        if entry_index == index - 1:
+            return index, 0, current
+        return index, 0, 0
+
+    def count(self, key: Hashable, now: float = None) -> float:
+        now = time.time() if now is None else now
+        index, current, previous = self._rotate(key, now)
+        overlap = 1 - (now % self.window) / self.window
+        return current + previous * overlap
+
+    def hit(self, key: Hashable, amount: int = 1, now: float = None) -> float:
+        '''count a request for key and return the count over the last window'''
+        now = time.time() if now is None else now
+        index, current, previous = self._rotate(key, now)
+        self._counts[key] = (index, current + amount, previous)
+        return self.count(key, now)
+
+    def seed(self, key: Hashable, count: int, now: float = None) -> None:
+        '''set the count of a key, e.g. from usage stored in the database. It replaces what was counted locally'''
+        now = time.time() if now is None else now
+        self._counts[key] = (int(now // self.window), count, 0)
+        self._seeded[key] = now
+
+    def seeded_at(self, key: Hashable) -> Optional[float]:
+        '''when the key was last seeded, None if it never was'''
+        return self._seeded.get(key)
+
+    def prune(self, now: float = None) -> None:
+        '''drop keys without requests in the last two windows'''
+        now = time.time() if now is None else now
+        index = int(now // self.window)
+        self._counts = {k: v for k, v in self._counts.items() if v[0] >= index - 1}
+        self._seeded = {k: v for k, v in self._seeded.items() if k in self._counts}
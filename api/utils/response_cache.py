@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from api.utils.cache import MISSING, LRUCache
+from api.utils.metrics import Counter, Gauge
+from api.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter('response_cache_requests_total', 'Lookups in a response cache by result: hit, stale, miss or coalesced.', ('cache', 'result'))
+CACHE_ENTRIES = Gauge('response_cache_entries', 'Entries in a response cache.', ('cache',))
+CACHE_REFRESH_ERRORS = Counter('response_cache_refresh_errors_total', 'Background refreshes of a stale entry that failed.', ('cache',))
+
+# every response cache by name, so a write route can clear the caches it makes stale
+caches: Dict[str, 'ResponseCache'] = {}
+
+
+class ResponseCache:
+    '''
+        Cache for read routes whose data changes a few times a day.
+        An entry is fresh for ttl seconds, after that it is served stale for up to stale_ttl seconds
+        while a single background load refreshes it. Concurrent misses for a key share one load.
+    '''
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0, max_size: int = 10_000):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # entries live for ttl + stale_ttl, freshness is checked on the stored timestamp
+        self._entries = LRUCache(max_size, ttl=ttl + stale_ttl)
+        self._flight = SingleFlight()
+        self._refreshes = set()
+
+        CACHE_ENTRIES.set_function(lambda: len(self._entries), cache=name)
+        caches[name] = self
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+
+        if entry is not MISSING:
+            value, loaded_at = entry
+            if time.monotonic() - loaded_at < self.ttl:
+                CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return value
+
+            CACHE_REQUESTS.inc(cache=self.name, result='stale')
+            if key not in self._flight:
+                task = asyncio.create_task(self._refresh(key, load))
+                self._refreshes.add(task)
+                task.add_done_callback(self._refreshes.discard)
+            return value
+
+        CACHE_REQUESTS.inc(cache=self.name, result='coalesced' if key in self._flight else 'miss')
+        return await self._flight.do(key, lambda: self._load(key, load))
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        value = await load()
+        # None means the load failed softly, do not keep it
+        if value is not None:
+            self._entries.set(key, (value, time.monotonic()))
+        return value
+
+    async def _refresh(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            await self._flight.do(key, lambda: self._load(key, load))
+        except Exception as e:
+            # keep serving the stale value until it expires
+            CACHE_REFRESH_ERRORS.inc(cache=self.name)
+            logger.error({"message": "cache refresh failed", "cache": self.name, "error": str(e)})
+
+
+def clear_caches(*names: str) -> None:
+    '''clear the response caches with these names, a name without a cache is ignored'''
+    for name in names:
+        cache = caches.get(name)
+        if cache is not None:
+            cache.clear()
+
+
+def cached(name: str, ttl: float, stale_ttl: float = 0, max_size: int = 10_000):
+    '''
+        cache the result of an async function on its arguments, the cache is available as fn.cache.
+        Callers share the returned value, it must not be modified. None is never cached.
+    '''
+    def decorator(fn):
+        cache = ResponseCache(name, ttl=ttl, stale_ttl=stale_ttl, max_size=max_size)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return await cache.get(key, lambda: fn(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
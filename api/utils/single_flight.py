@@ -0,0 +1,34 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    '''
+        Coalesces concurrent calls with the same key, fn runs once in a task of its own
+        and every caller waits for its result (or exception). Nothing is kept after the call is done.
+    '''
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, fn))
+            # mark the exception as retrieved, every caller may be gone
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._calls[key] = task
+
+        # shield, a cancelled caller, the first one included, must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await fn()
+        finally:
+            del self._calls[key]
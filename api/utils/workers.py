@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, TypeVar
+
+from api import Config
+from api.utils.cpu_jobs import timed
+from api.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+WORKER_JOBS = Counter('worker_jobs_total', 'Jobs run in the worker pool.', ('lane', 'status'))
+WORKER_WAITING = Gauge('worker_jobs_waiting', 'Jobs waiting for a slot in their lane.', ('lane',))
+WORKER_RUNNING = Gauge('worker_jobs_running', 'Jobs submitted to the worker pool and not yet done.', ('lane',))
+WORKER_WAIT_SECONDS = Counter('worker_queue_wait_seconds_total', 'Time jobs spent waiting before they started executing.', ('lane',))
+WORKER_EXEC_SECONDS = Counter('worker_exec_seconds_total', 'Time jobs spent executing in a worker process.', ('lane',))
+WORKER_RESTARTS = Counter('worker_pool_restarts_total', 'Times the worker pool was recreated after a worker died.')
+
+
+class WorkerPool:
+    '''
+        Process pool for CPU bound work, so pandas and file generation do not block the event loop.
+        Jobs are module level functions with picklable arguments, see api.utils.cpu_jobs.
+        Every lane has its own concurrency cap, so a burst of exports can only take
+        the slots of the export lane and never all the worker processes.
+    '''
+    def __init__(self, max_workers: int, lanes: Dict[str, int]):
+        self.max_workers = max_workers
+        self.lanes = lanes
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn, forking a process with a running event loop and open connections is not safe
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def start(self) -> None:
+        self._executor = self._new_executor()
+        self._semaphores = {lane: asyncio.Semaphore(limit) for lane, limit in self.lanes.items()}
+
+    async def stop(self) -> None:
+        '''wait for running jobs, jobs that did not start yet are cancelled'''
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        # concurrent jobs of the same broken pool only restart it once
+        if self._executor is not broken:
+            return
+        WORKER_RESTARTS.inc()
+        logger.error({"message": "worker pool is broken, restarting it"})
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    async def run(self, fn: Callable[..., T], *args, lane: str = 'default') -> T:
+        '''
+            run fn(*args) in a worker process and return its result.
+            When the pool is not started (tests, scripts) fn runs in a thread instead.
+        '''
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown worker lane {lane}.")
+
+        if self._executor is None:
+            return await asyncio.to_thread(fn, *args)
+
+        submitted = time.perf_counter()
+        semaphore = self._semaphores[lane]
+
+        WORKER_WAITING.inc(lane=lane)
+        try:
+            await semaphore.acquire()
+        finally:
+            WORKER_WAITING.dec(lane=lane)
+
+        WORKER_RUNNING.inc(lane=lane)
+        try:
+            result, exec_seconds = await self._submit(fn, args)
+        except BaseException:
+            WORKER_JOBS.inc(lane=lane, status='error')
+            raise
+        finally:
+            WORKER_RUNNING.dec(lane=lane)
+            semaphore.release()
+
+        # waiting for the lane and for a free process both count as queue wait
+        WORKER_WAIT_SECONDS.inc(max(time.perf_counter() - submitted - exec_seconds, 0), lane=lane)
+        WORKER_EXEC_SECONDS.inc(exec_seconds, lane=lane)
+        WORKER_JOBS.inc(lane=lane, status='ok')
+        return result
+
+    async def _submit(self, fn: Callable, args: tuple):
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, timed, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (oom, segfault), jobs are pure so they can run again on a new pool
+            self._restart(executor)
+            return await loop.run_in_executor(self._executor, timed, fn, *args)
+
+
+worker_pool = WorkerPool(
+    max_workers=Config.worker_processes,
+    lanes={
+        'ingest': Config.worker_ingest_concurrency,
+        'default': Config.worker_default_concurrency,
+        'export': Config.worker_export_concurrency,
+    }
+)
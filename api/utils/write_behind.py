@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List
+
+from api.utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = Gauge('write_behind_queue_depth', 'Rows waiting to be flushed.', ('queue',))
+QUEUE_ROWS = Counter('write_behind_rows_total', 'Rows handled by a write-behind queue.', ('queue', 'status'))
+QUEUE_FLUSHES = Counter('write_behind_flushes_total', 'Flushes done by a write-behind queue.', ('queue', 'status'))
+QUEUE_FLUSH_SECONDS = Gauge('write_behind_last_flush_seconds', 'Duration of the last flush.', ('queue',))
+QUEUE_BLOCKED = Counter('write_behind_blocked_puts_total', 'Puts that had to wait for space (backpressure).', ('queue',))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    '''
+        Gathers rows from many concurrent requests and hands them to flush_function in large batches.
+        A flush happens when batch_size rows are waiting or every flush_interval seconds.
+        When max_size rows are waiting, put waits up to put_timeout for space and then raises QueueFull.
+    '''
+    def __init__(
+        self,
+        name: str,
+        flush_function: Callable[[List[dict]], Awaitable[None]],
+        batch_size: int = 5_000,
+        flush_interval: float = 1.0,
+        max_size: int = 100_000,
+        put_timeout: float = 0.5,
+        max_retries: int = 5
+    ):
+        self.name = name
+        self.flush_function = flush_function
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+
+        self._buffer: List[dict] = []
+        self._retries = 0
+        self._task = None
+        self._closing = False
+        # asyncio primitives are created in start, on the running loop
+        self._wakeup = None
+        self._space = None
+        self._lock = None
+
+        QUEUE_DEPTH.set_function(lambda: len(self._buffer), queue=name)
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    def start(self) -> None:
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        '''stop the background flusher and flush everything that is left'''
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush(drain=True)
+
+    async def put(self, rows: List[dict]) -> None:
+        if len(rows) > self.max_size:
+            raise ValueError(f"Can not queue {len(rows)} rows, max_size is {self.max_size}.")
+
+        if self._task is None:
+            # no background flusher (not started or shutting down), write synchronously
+            await self.flush_function(rows)
+            QUEUE_ROWS.inc(len(rows), queue=self.name, status='flushed')
+            return
+
+        deadline = time.monotonic() + self.put_timeout
+        if self.depth + len(rows) > self.max_size:
+            QUEUE_BLOCKED.inc(queue=self.name)
+
+        while self.depth + len(rows) > self.max_size:
+            remaining = deadline - time.monotonic()
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                QUEUE_ROWS.inc(len(rows), queue=self.name, status='rejected')
+                raise QueueFull(f"{self.name} queue is full.")
+
+        self._buffer.extend(rows)
+        QUEUE_ROWS.inc(len(rows), queue=self.name, status='queued')
+
+        if self.depth >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, drain: bool = False) -> None:
+        '''
+            flush waiting rows in batches of batch_size,
+            a failed batch is put back in front of the queue and retried on the next flush.
+        '''
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                self._buffer = self._buffer[self.batch_size:]
+
+                start = time.perf_counter()
+                try:
+                    await self.flush_function(batch)
+                except Exception as e:
+                    self._retries += 1
+                    QUEUE_FLUSHES.inc(queue=self.name, status='error')
+                    logger.error({"message": "flush failed", "queue": self.name, "rows": len(batch), "retry": self._retries, "error": str(e)})
+
+                    if self._retries <= self.max_retries:
+                        self._buffer[:0] = batch
+                        if drain:
+                            await asyncio.sleep(min(self._retries, 5))
+                            continue
+                        break
+
+                    # give up on this batch, it keeps failing
+                    self._retries = 0
+                    QUEUE_ROWS.inc(len(batch), queue=self.name, status='dropped')
+                    continue
+
+                self._retries = 0
+                QUEUE_FLUSH_SECONDS.set(time.perf_counter() - start, queue=self.name)
+                QUEUE_FLUSHES.inc(queue=self.name, status='ok')
+                QUEUE_ROWS.inc(len(batch), queue=self.name, status='flushed')
+                logger.debug({"message": "flushed", "queue": self.name, "rows": len(batch), "depth": self.depth})
+
+                if self._space is not None:
+                    self._space.set()
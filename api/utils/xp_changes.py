@@ -0,0 +1,118 @@
+'''
+    XP changes computed from hiscore snapshots, for a whole batch of players at once.
+    The snapshots are one int64 matrix, sorted on player and time, every gain is a
+    subtraction of two rows of it over all the columns of the hiscore model.
+    Everything here is importable without the app, there is no database access.
+'''
+import datetime
+from operator import itemgetter
+from typing import List, Optional
+
+import numpy as np
+
+from api.utils.hiscore_codec import COLUMNS, EPOCH
+
+
+_values = itemgetter(*COLUMNS)
+
+
+def _seconds(ts: datetime.datetime) -> int:
+    return (ts - EPOCH) // datetime.timedelta(seconds=1)
+
+
+class Snapshots:
+    '''hiscore snapshots of many players, stored per column in numpy arrays, sorted on player and timestamp'''
+    def __init__(self, rows: List[dict]):
+        rows = sorted(rows, key=lambda r: (r['Player_id'], r['timestamp'], r['id']))
+        n = len(rows)
+
+        self.rows = rows
+        self.player_ids = np.fromiter((r['Player_id'] for r in rows), dtype=np.int64, count=n)
+        self.seconds = np.fromiter((_seconds(r['timestamp']) for r in rows), dtype=np.int64, count=n)
+
+        # None becomes nan in a float matrix, then a mask. Hiscore values are far below 2**53, floats hold them exactly
+        values = np.array([_values(r) for r in rows], dtype=np.float64).reshape(n, len(COLUMNS))
+        self.nulls = np.isnan(values)
+        values[self.nulls] = 0
+        self.values = values.astype(np.int64)
+
+        # the first snapshot of every player, and the player of every snapshot as 0, 1, 2...
+        self.starts = np.flatnonzero(np.r_[True, self.player_ids[1:] != self.player_ids[:-1]]) if n else np.zeros(0, dtype=np.int64)
+        self.groups = np.cumsum(np.r_[False, self.player_ids[1:] != self.player_ids[:-1]]) if n else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _at(self, seconds: int) -> np.ndarray:
+        '''per player, the index of their last snapshot at or before seconds, -1 when there is none'''
+        # player and time in one sortable key, the rows are sorted on it already
+        keys = (self.groups << 32) + self.seconds
+        wanted = (np.arange(len(self.starts), dtype=np.int64) << 32) + seconds
+        index = np.searchsorted(keys, wanted, side='right') - 1
+        return np.where(index >= self.starts, index, -1)
+
+
+def _gain_rows(snapshots: Snapshots, start: np.ndarray, end: np.ndarray) -> List[dict]:
+    '''the change of every column from the start to the end snapshot, for pairs of indexes'''
+    gains = (snapshots.values[end] - snapshots.values[start]).tolist()
+    unknown = snapshots.nulls[end] | snapshots.nulls[start]
+    any_unknown = unknown.any(axis=1).tolist()
+
+    rows = []
+    for i, (s, e) in enumerate(zip(start.tolist(), end.tolist())):
+        first, last = snapshots.rows[s], snapshots.rows[e]
+        row = {
+            'Player_id': last['Player_id'],
+            'start_id': first['id'],
+            'start_timestamp': first['timestamp'],
+            'id': last['id'],
+            'timestamp': last['timestamp'],
+            'ts_date': last.get('ts_date'),
+        }
+        row.update(zip(COLUMNS, gains[i]))
+        if any_unknown[i]:
+            for c in np.flatnonzero(unknown[i]).tolist():
+                row[COLUMNS[c]] = None
+        rows.append(row)
+    return rows
+
+
+def consecutive_gains(snapshots: Snapshots, last: Optional[int] = None) -> List[dict]:
+    '''
+        the gains from every snapshot to the next of the same player, in time order.
+        With last, only the last gains of every player are kept.
+    '''
+    if len(snapshots) < 2:
+        return []
+
+    end = np.flatnonzero(snapshots.player_ids[1:] == snapshots.player_ids[:-1]) + 1
+    if last is not None and len(end):
+        # how many gains of the same player come after this one
+        group_end = np.flatnonzero(np.r_[snapshots.player_ids[end[1:]] != snapshots.player_ids[end[:-1]], True])
+        after = group_end[np.searchsorted(group_end, np.arange(len(end)))] - np.arange(len(end))
+        end = end[after < last]
+
+    return _gain_rows(snapshots, end - 1, end)
+
+
+def gains_between(snapshots: Snapshots, start: datetime.datetime, end: datetime.datetime) -> List[dict]:
+    '''
+        per player, the gains from their last snapshot at or before start to their last one at or before end.
+        A player without a snapshot before start is measured from their first one, see start_timestamp.
+        Players without a newer snapshot than that one are left out.
+    '''
+    if len(snapshots) == 0:
+        return []
+
+    last = snapshots._at(_seconds(end))
+    first = snapshots._at(_seconds(start))
+    first = np.where(first == -1, snapshots.starts, first)
+
+    measured = (last != -1) & (first < last)
+    return _gain_rows(snapshots, first[measured], last[measured])
+
+
+def window_gains(snapshots: Snapshots, days: float, end: Optional[datetime.datetime] = None) -> List[dict]:
+    '''per player, the gains over the days before end, now by default'''
+    end = end or datetime.datetime.utcnow()
+    return gains_between(snapshots, end - datetime.timedelta(days=days), end)
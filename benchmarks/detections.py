@@ -0,0 +1,104 @@
+'''
+    Micro-benchmark of the POST /v1/report validation path,
+    the pandas + per row coroutine version against DetectionBatch.
+
+    python benchmarks/detections.py [detections] [repeat]
+'''
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import random
+import time
+import timeit
+
+import pandas as pd
+from api.database.functions import is_valid_rsn, to_jagex_name
+from api.routers.report import back_time_buffer, detection
+from api.utils.detections import DetectionBatch
+
+
+def make_payload(n: int):
+    now = int(time.time())
+    return [
+        detection(
+            reporter='Some_Reporter',
+            reported=f'player {random.randint(0, n)}',
+            region_id=random.randint(0, 100_000),
+            x_coord=random.randint(0, 4000),
+            y_coord=random.randint(0, 4000),
+            ts=now - random.randint(0, 3600),
+            world_number=random.randint(300, 500),
+            equipment={'equip_head_id': random.randint(0, 20_000)},
+            equip_ge_value=random.randint(0, 10**9),
+        )
+        for _ in range(n)
+    ]
+
+
+async def parse_detection(data: dict) -> dict:
+    '''the per row conversion that was used before DetectionBatch'''
+    gmt = time.gmtime(data['ts'])
+    human_time = time.strftime('%Y-%m-%d %H:%M:%S', gmt)
+    equipment = data.get('equipment', {})
+
+    param = {
+        'reportedID': data.get('id'),
+        'reportingID': data.get('reporter_id'),
+        'region_id': data.get('region_id'),
+        'x_coord': data.get('x_coord'),
+        'y_coord': data.get('y_coord'),
+        'z_coord': data.get('z_coord'),
+        'timestamp': human_time,
+        'manual_detect': data.get('manual_detect'),
+        'on_members_world': data.get('on_members_world'),
+        'on_pvp_world': data.get('on_pvp_world'),
+        'world_number': data.get('world_number'),
+        **{k: equipment.get(k) for k in equipment},
+        'equip_ge_value': data.get('equip_ge_value', 0)
+    }
+    return param
+
+
+async def pandas_path(detections, player_ids: dict):
+    df = pd.DataFrame([d.dict() for d in detections])
+    df.drop_duplicates(subset=['reporter', 'reported', 'region_id'], inplace=True)
+
+    now = int(time.time())
+    mask = (df['ts'] > now) | (df['ts'] < now - back_time_buffer)
+    df = df[~mask]
+
+    df['reporter'] = await to_jagex_name(df['reporter'].iloc[0])
+    df['reported'] = [await to_jagex_name(n) if await is_valid_rsn(n) else None for n in df['reported']]
+    df = df[df['reported'].notna()]
+    df['manual_detect'] = 0
+
+    param = []
+    for d in df.to_dict('records'):
+        d['id'] = player_ids.get(d['reported'])
+        d['reporter_id'] = player_ids.get(d['reporter'])
+        param.append(await parse_detection(d))
+    return param
+
+
+def batch_path(detections):
+    batch = DetectionBatch.from_detections(detections).drop_duplicates()
+    batch = batch.take(batch.in_time_window(int(time.time()), back_time_buffer))
+    return batch.normalize().to_params(0)
+
+
+def main(n: int = 5_000, repeat: int = 20):
+    detections = make_payload(n)
+    player_ids = {f'player {i}': i for i in range(n + 1)}
+
+    old = timeit.timeit(lambda: asyncio.run(pandas_path(detections, player_ids)), number=repeat) / repeat
+    new = timeit.timeit(lambda: batch_path(detections), number=repeat) / repeat
+
+    print(f'{n} detections, mean of {repeat} runs')
+    print(f'pandas + parse_detection: {old * 1000:8.2f} ms')
+    print(f'DetectionBatch:           {new * 1000:8.2f} ms  ({old / new:.1f}x)')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,143 @@
+'''
+    Bytes per player-day and read latency of the compact hiscore history against playerHiscoreData.
+
+    python benchmarks/hiscore_history.py synthetic [players] [days]
+        encodes generated histories, no database needed. The table size is estimated
+        from the InnoDB row format of the model's columns.
+
+    python benchmarks/hiscore_history.py database [players] [repeat]
+        needs sql_uri and migrations/004_hiscore_history.sql. Compacts the histories of a sample
+        of players, then compares the table and history sizes from information_schema and the
+        time to read and decode a player's history against selecting their rows.
+'''
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import datetime
+import random
+import statistics
+import time
+
+from api.utils.hiscore_codec import COLUMNS, decode_deltas, decode_history, encode_history
+
+SKILLS = COLUMNS[1:24]
+ACTIVITIES = COLUMNS[24:]
+
+
+def innodb_row_bytes() -> int:
+    '''
+        playerHiscoreData row in the clustered index plus its two unique indexes:
+        5 byte record header, 13 bytes transaction id and roll pointer, 11 bytes null bitmap,
+        4 byte id, 5 byte timestamp, 3 byte ts_date, 4 byte Player_id, 8 byte total, 4 bytes per other column.
+        Unique_player_time and Unique_player_date hold their key, the id and a 5 byte header.
+    '''
+    row = 5 + 13 + 11 + 4 + 5 + 3 + 4 + 8 + 4 * (len(COLUMNS) - 1)
+    indexes = (5 + 5 + 4 + 4) + (5 + 4 + 3 + 4)
+    return row + indexes
+
+
+def synthetic_history(player_id: int, days: int, start_id: int) -> list:
+    '''a player that trains a few skills most days and rarely kills a boss'''
+    values = {c: random.randint(0, 5_000_000) if c in SKILLS else random.choice([-1, 0, random.randint(1, 500)]) for c in COLUMNS}
+    active = random.sample(SKILLS, 4)
+    start = datetime.datetime(2022, 1, 1, random.randint(0, 23), random.randint(0, 59))
+
+    rows, row_id = [], start_id
+    for day in range(days):
+        for skill in active:
+            if random.random() < 0.6:
+                values[skill] += random.randint(1_000, 200_000)
+        for activity in ACTIVITIES:
+            if random.random() < 0.02:
+                values[activity] = max(values[activity], 0) + random.randint(1, 20)
+        values['total'] = sum(values[s] for s in SKILLS)
+
+        # about a hundred thousand hiscores are scraped between two of a player
+        row_id += random.randint(50_000, 150_000)
+        ts = start + datetime.timedelta(days=day, seconds=random.randint(-3600, 3600))
+        rows.append({'id': row_id, 'timestamp': ts, 'ts_date': ts.date(), 'Player_id': player_id, **values})
+    return rows
+
+
+def synthetic(players: int = 1_000, days: int = 365):
+    histories = [synthetic_history(i, days, 1_000_000 + i) for i in range(players)]
+
+    start = time.perf_counter()
+    encoded = [encode_history(rows) for rows in histories]
+    encode_seconds = time.perf_counter() - start
+
+    decode_seconds, delta_seconds = [], []
+    for i, data in enumerate(encoded):
+        start = time.perf_counter()
+        rows = decode_history(data, i)
+        decode_seconds.append(time.perf_counter() - start)
+        assert rows == histories[i]
+
+        start = time.perf_counter()
+        decode_deltas(data, i)
+        delta_seconds.append(time.perf_counter() - start)
+
+    player_days = players * days
+    # the history row adds a 5 byte header, 13 bytes transaction data and its 4 fixed columns
+    history_bytes = sum(len(d) for d in encoded) + players * (5 + 13 + 4 + 4 + 4 + 3 + 4)
+
+    print(f'{players} players, {days} days')
+    print(f'    playerHiscoreData (estimate): {innodb_row_bytes():8.1f} bytes per player-day')
+    print(f'    history:                      {history_bytes / player_days:8.1f} bytes per player-day  ({innodb_row_bytes() * player_days / history_bytes:.1f}x smaller)')
+    print(f'    encode: {encode_seconds / players * 1000:.2f} ms per player')
+    print(f'    decode rows:   median {statistics.median(decode_seconds) * 1000:.2f} ms per player')
+    print(f'    decode deltas: median {statistics.median(delta_seconds) * 1000:.2f} ms per player')
+
+
+async def database(players: int = 200, repeat: int = 5):
+    from api.database.database import EngineType, get_session
+    from api.database.hiscore_history import compact_players, get_history
+    from sqlalchemy import text
+
+    async with get_session(EngineType.PLAYERDATA) as session:
+        sql = text('SELECT DISTINCT Player_id FROM playerHiscoreData ORDER BY RAND() LIMIT :n')
+        player_ids = [r for r, in await session.execute(sql, {'n': players})]
+
+    for i in range(0, len(player_ids), 100):
+        await compact_players(player_ids[i:i + 100])
+
+    async with get_session(EngineType.PLAYERDATA) as session:
+        sql = text('''
+            SELECT table_name, data_length + index_length AS size, table_rows
+            FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name IN ('playerHiscoreData', 'playerHiscoreHistory')
+        ''')
+        sizes = {r.table_name: r for r in await session.execute(sql)}
+        sql = text('SELECT SUM(snapshots) FROM playerHiscoreHistory')
+        snapshots = (await session.execute(sql)).scalar()
+
+    table, history = sizes['playerHiscoreData'], sizes['playerHiscoreHistory']
+    print(f'playerHiscoreData:    {table.size / table.table_rows:8.1f} bytes per player-day')
+    print(f'playerHiscoreHistory: {history.size / snapshots:8.1f} bytes per player-day ({snapshots} compacted)')
+
+    async def from_table(player_id):
+        sql = text('SELECT * FROM playerHiscoreData WHERE Player_id = :player_id ORDER BY id')
+        async with get_session(EngineType.PLAYERDATA) as session:
+            return [dict(r._mapping) for r in await session.execute(sql, {'player_id': player_id})]
+
+    async def from_history(player_id):
+        return decode_history(await get_history(player_id), player_id)
+
+    for name, read in (('table', from_table), ('history', from_history)):
+        runs = []
+        for _ in range(repeat):
+            for player_id in player_ids:
+                start = time.perf_counter()
+                await read(player_id)
+                runs.append(time.perf_counter() - start)
+        print(f'    read {name:8} median {statistics.median(runs) * 1000:7.2f} ms, p99 {statistics.quantiles(runs, n=100)[98] * 1000:7.2f} ms per player')
+
+
+if __name__ == '__main__':
+    mode, args = (sys.argv[1] if len(sys.argv) > 1 else 'synthetic'), [int(a) for a in sys.argv[2:4]]
+    if mode == 'database':
+        asyncio.run(database(*args))
+    else:
+        synthetic(*args)
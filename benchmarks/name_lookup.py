@@ -0,0 +1,71 @@
+'''
+    Benchmark of player name resolution against a database with the Players table,
+    the normalized_name IN lookup against the indexed name_key lookup.
+    Needs sql_uri and migrations/002_players_name_key.sql.
+
+    python benchmarks/name_lookup.py [repeat]
+'''
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import statistics
+import time
+
+from api.database.database import EngineType, get_session
+from api.database.models import Player
+from api.database.player_names import name_key
+from sqlalchemy.sql.expression import select
+from sqlalchemy.sql.functions import func
+
+BATCH_SIZES = (1_000, 5_000, 10_000)
+
+
+async def sample_names(n: int):
+    '''existing names spread over the table, plus 10% that do not exist'''
+    async with get_session(EngineType.PLAYERDATA) as session:
+        max_id = (await session.execute(select(func.max(Player.id)))).scalar()
+        step = max(max_id // n, 1)
+        sql = select(Player.normalized_name).where(Player.id % step == 0).limit(n)
+        names = [r for r, in await session.execute(sql) if r is not None]
+    return names + [f'missing {i}' for i in range(n // 10)]
+
+
+async def by_normalized_name(names):
+    sql = select(Player.id, Player.normalized_name).where(Player.normalized_name.in_(names))
+    async with get_session(EngineType.PLAYERDATA) as session:
+        return (await session.execute(sql)).all()
+
+
+async def by_name_key(names):
+    wanted = set(names)
+    sql = select(Player.id, Player.normalized_name).where(Player.name_key.in_({name_key(n) for n in names}))
+    async with get_session(EngineType.PLAYERDATA) as session:
+        return [r for r in (await session.execute(sql)).all() if r.normalized_name in wanted]
+
+
+async def timed(fn, names, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = await fn(names)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs), len(rows)
+
+
+async def main(repeat: int = 5):
+    print(f'median of {repeat} runs')
+    for size in BATCH_SIZES:
+        names = (await sample_names(size))[:size]
+        old, old_rows = await timed(by_normalized_name, names, repeat)
+        new, new_rows = await timed(by_name_key, names, repeat)
+        assert old_rows == new_rows, (old_rows, new_rows)
+
+        print(f'{size:6} names, {new_rows} found')
+        print(f'    normalized_name IN: {old * 1000:9.2f} ms')
+        print(f'    name_key IN:        {new * 1000:9.2f} ms  ({old / new:.1f}x)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:2]]))
@@ -0,0 +1,76 @@
+-- contribution counters per reporter, see api/database/contributions.py
+CREATE TABLE IF NOT EXISTS reporterContributions (
+    reporter_id INT NOT NULL,
+    manual_reports INT NOT NULL DEFAULT 0,
+    manual_bans INT NOT NULL DEFAULT 0,
+    manual_possible_bans INT NOT NULL DEFAULT 0,
+    manual_incorrect_reports INT NOT NULL DEFAULT 0,
+    passive_reports INT NOT NULL DEFAULT 0,
+    passive_bans INT NOT NULL DEFAULT 0,
+    passive_possible_bans INT NOT NULL DEFAULT 0,
+    feedback INT NOT NULL DEFAULT 0,
+    total_xp_removed BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (reporter_id),
+    CONSTRAINT FK_reporterContributions_Players FOREIGN KEY (reporter_id) REFERENCES Players (id) ON UPDATE RESTRICT ON DELETE RESTRICT
+);
+
+-- backfill, scans Reports once, run it outside of peak hours.
+-- reporters that are missed or changed while this runs are refreshed by the api when they are read.
+INSERT INTO reporterContributions (
+    reporter_id,
+    manual_reports, manual_bans, manual_possible_bans, manual_incorrect_reports,
+    passive_reports, passive_bans, passive_possible_bans,
+    feedback, total_xp_removed, updated_at
+)
+SELECT
+    rs.reportingID,
+    rs.manual_reports, rs.manual_bans, rs.manual_possible_bans, rs.manual_incorrect_reports,
+    rs.passive_reports, rs.passive_bans, rs.passive_possible_bans,
+    COALESCE(fb.feedback, 0),
+    COALESCE(xp.total_xp, 0),
+    CURRENT_TIMESTAMP
+FROM (
+    SELECT
+        d.reportingID,
+        SUM(d.detect = 1) AS manual_reports,
+        SUM(d.detect = 1 AND ban.confirmed_ban = 1) AS manual_bans,
+        SUM(d.detect = 1 AND ban.possible_ban = 1) - SUM(d.detect = 1 AND ban.confirmed_ban = 1) AS manual_possible_bans,
+        SUM(d.detect = 1 AND ban.confirmed_player = 1) AS manual_incorrect_reports,
+        SUM(d.detect = 0) AS passive_reports,
+        SUM(d.detect = 0 AND ban.confirmed_ban = 1) AS passive_bans,
+        SUM(d.detect = 0 AND ban.possible_ban = 1) - SUM(d.detect = 0 AND ban.confirmed_ban = 1) AS passive_possible_bans
+    FROM (
+        SELECT DISTINCT reportingID, reportedID, IFNULL(manual_detect, 0) AS detect
+        FROM Reports
+    ) d
+    JOIN Players ban ON (ban.id = d.reportedID)
+    GROUP BY d.reportingID
+) rs
+LEFT JOIN (
+    SELECT voter_id, COUNT(*) AS feedback
+    FROM PredictionsFeedback
+    GROUP BY voter_id
+) fb ON (fb.voter_id = rs.reportingID)
+LEFT JOIN (
+    SELECT b.reportingID, SUM(hdl.total) AS total_xp
+    FROM (
+        SELECT DISTINCT rp.reportingID, rp.reportedID
+        FROM Reports rp
+        JOIN Players ban ON (ban.id = rp.reportedID)
+        WHERE ban.confirmed_ban = 1
+    ) b
+    JOIN playerHiscoreDataLatest hdl ON (hdl.Player_id = b.reportedID)
+    GROUP BY b.reportingID
+) xp ON (xp.reportingID = rs.reportingID)
+ON DUPLICATE KEY UPDATE
+    manual_reports = VALUES(manual_reports),
+    manual_bans = VALUES(manual_bans),
+    manual_possible_bans = VALUES(manual_possible_bans),
+    manual_incorrect_reports = VALUES(manual_incorrect_reports),
+    passive_reports = VALUES(passive_reports),
+    passive_bans = VALUES(passive_bans),
+    passive_possible_bans = VALUES(passive_possible_bans),
+    feedback = VALUES(feedback),
+    total_xp_removed = VALUES(total_xp_removed),
+    updated_at = VALUES(updated_at);
@@ -0,0 +1,25 @@
+-- indexed 64 bit key for name lookups, see api/database/player_names.py
+-- run before deploying, the Player model selects the column.
+-- the column is virtual, adding it is instant. The index build computes the key for every
+-- existing row (the backfill) and is done online, reads and writes continue while it runs.
+-- the column is invisible (MySQL 8.0.23+), select * from Players leaves it out so the
+-- legacy routes do not return it.
+ALTER TABLE Players
+    ADD COLUMN name_key BIGINT UNSIGNED
+        GENERATED ALWAYS AS (CAST(CONV(LEFT(SHA2(normalized_name, 256), 16), 16, 10) AS UNSIGNED)) VIRTUAL INVISIBLE,
+    ALGORITHM=INSTANT;
+
+-- a database that added the column before it was invisible:
+-- ALTER TABLE Players ALTER COLUMN name_key SET INVISIBLE, ALGORITHM=INSTANT;
+
+ALTER TABLE Players
+    ADD INDEX ix_Players_name_key (name_key),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+-- collision check, names that share a key. Lookups compare normalized_name after the key
+-- so these are still resolved correctly, this is only to keep an eye on it.
+SELECT name_key, COUNT(DISTINCT normalized_name) AS names
+FROM Players
+WHERE name_key IS NOT NULL
+GROUP BY name_key
+HAVING names > 1;
@@ -0,0 +1,15 @@
+-- heatmap tile store, see api/database/heatmaps.py
+-- regions are computed by the api the first time they are read, no backfill is needed.
+CREATE TABLE IF NOT EXISTS heatmapTiles (
+    region_id INT NOT NULL,
+    x_coord INT NOT NULL,
+    y_coord INT NOT NULL,
+    confirmed_ban INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (region_id, x_coord, y_coord)
+);
+
+CREATE TABLE IF NOT EXISTS heatmapRegions (
+    region_id INT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (region_id)
+);
@@ -0,0 +1,11 @@
+-- compact hiscore history, one delta encoded history per player, see api/utils/hiscore_codec.py
+-- histories are built by the api the first time a player is read or scraped, no backfill is needed.
+CREATE TABLE IF NOT EXISTS playerHiscoreHistory (
+    Player_id INT NOT NULL,
+    snapshots INT NOT NULL,
+    last_id INT NOT NULL,
+    last_ts_date DATE NULL,
+    data MEDIUMBLOB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (Player_id)
+);
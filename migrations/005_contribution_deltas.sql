@@ -0,0 +1,37 @@
+-- contribution deltas, see api/database/contributions.py
+-- the labels of reported players as the counters in reporterContributions count them,
+-- a player without a row counts as having no labels and no xp.
+CREATE TABLE IF NOT EXISTS reporterContributionLabels (
+    player_id INT NOT NULL,
+    possible_ban TINYINT NOT NULL DEFAULT 0,
+    confirmed_ban TINYINT NOT NULL DEFAULT 0,
+    confirmed_player TINYINT NOT NULL DEFAULT 0,
+    xp BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id)
+);
+
+-- the last Reports.ID that is counted in reporterContributions
+CREATE TABLE IF NOT EXISTS reporterContributionWatermark (
+    id TINYINT NOT NULL,
+    last_report_id BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (id)
+);
+
+-- backfill, the labels of every player that has one
+INSERT IGNORE INTO reporterContributionLabels (player_id, possible_ban, confirmed_ban, confirmed_player, xp)
+SELECT
+    pl.id,
+    IFNULL(pl.possible_ban, 0),
+    IFNULL(pl.confirmed_ban, 0),
+    IFNULL(pl.confirmed_player, 0),
+    IF(pl.confirmed_ban = 1, COALESCE(hdl.total, 0), 0)
+FROM Players pl
+LEFT JOIN playerHiscoreDataLatest hdl ON (hdl.Player_id = pl.id)
+WHERE pl.possible_ban = 1 OR pl.confirmed_ban = 1 OR pl.confirmed_player = 1;
+
+INSERT IGNORE INTO reporterContributionWatermark (id, last_report_id)
+SELECT 1, COALESCE(MAX(ID), 0) FROM Reports;
+
+-- the counters from 001 were not computed against these labels and this watermark,
+-- every reporter is recomputed the next time it is read
+UPDATE reporterContributions SET updated_at = '2000-01-01';
@@ -0,0 +1,14 @@
+-- heatmap ban transitions, see api/database/heatmaps.py
+-- the players whose reports are counted in heatmapTiles
+CREATE TABLE IF NOT EXISTS heatmapBans (
+    player_id INT NOT NULL,
+    PRIMARY KEY (player_id)
+);
+
+-- backfill, every confirmed ban
+INSERT IGNORE INTO heatmapBans (player_id)
+SELECT id FROM Players WHERE confirmed_ban = 1;
+
+-- the regions computed before this were not computed against heatmapBans,
+-- every region is recomputed the next time it is read
+UPDATE heatmapRegions SET updated_at = '2000-01-01';
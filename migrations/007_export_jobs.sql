@@ -0,0 +1,18 @@
+-- export job status, see api/database/exports.py
+-- this table is in the discord database, next to export_links. Any replica can answer a status poll from it.
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id VARCHAR(32) NOT NULL,
+    discord_id BIGINT NOT NULL,
+    file_type VARCHAR(10) NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    accounts INT NOT NULL DEFAULT 0,
+    accounts_done INT NOT NULL DEFAULT 0,
+    failed_accounts TEXT,
+    row_count INT NOT NULL DEFAULT 0,
+    url VARCHAR(32),
+    error VARCHAR(255),
+    created_at DOUBLE NOT NULL,
+    finished_at DOUBLE,
+    PRIMARY KEY (job_id),
+    KEY created_at (created_at)
+);
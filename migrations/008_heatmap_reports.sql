@@ -0,0 +1,14 @@
+-- new reports on heatmap tiles, see api/database/heatmaps.py
+-- the last Reports.ID that is counted in heatmapTiles
+CREATE TABLE IF NOT EXISTS heatmapWatermark (
+    id TINYINT NOT NULL,
+    last_report_id BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (id)
+);
+
+INSERT IGNORE INTO heatmapWatermark (id, last_report_id)
+SELECT 1, COALESCE(MAX(ID), 0) FROM Reports;
+
+-- the regions computed before this were not computed up to the watermark,
+-- every region is recomputed the next time it is read
+UPDATE heatmapRegions SET updated_at = '2000-01-01';
@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.utils.bulkhead import BULKHEAD_REJECTED, Bulkhead
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+
+def test_rejects_after_max_wait():
+    async def run():
+        bulkhead = Bulkhead('test_reject', limit=1, max_wait=0.01)
+        await bulkhead.acquire()
+        with pytest.raises(HTTPException) as e:
+            await bulkhead.acquire()
+        assert e.value.status_code == 503
+
+        bulkhead.release()
+        await bulkhead.acquire()
+        bulkhead.release()
+
+    asyncio.run(run())
+    assert BULKHEAD_REJECTED.get(bulkhead='test_reject') == 1
+
+
+def test_route_dependency_releases_slot():
+    bulkhead = Bulkhead('test_route', limit=1, max_wait=0.01)
+    app = FastAPI()
+
+    @app.get("/", dependencies=[Depends(bulkhead)])
+    async def root():
+        return {'ok': 'ok'}
+
+    client = TestClient(app)
+    for _ in range(3):
+        assert client.get("/").status_code == 200
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+
+from api.utils.cache import MISSING, LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a is now most recently used
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_ttl_expiry():
+    cache = LRUCache(max_size=10)
+    cache.set('negative', None, ttl=0.01)
+    cache.set('positive', 1)
+    assert cache.get('negative') is None
+    time.sleep(0.02)
+    assert cache.get('negative') is MISSING
+    assert cache.get('positive') == 1
+
+
+def test_hit_miss_counters():
+    cache = LRUCache(max_size=10)
+    cache.get('a')
+    cache.set('a', 1)
+    cache.get('a')
+    assert (cache.hits, cache.misses) == (1, 1)
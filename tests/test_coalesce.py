@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+from api.database import coalesce
+from api.database.database import EngineType
+from api.database.models import Player
+from sqlalchemy import text
+from sqlalchemy.sql.expression import select
+
+
+def test_query_key_includes_params():
+    a = coalesce.query_key(EngineType.PLAYERDATA, select(Player).where(Player.name == 'a'))
+    b = coalesce.query_key(EngineType.PLAYERDATA, select(Player).where(Player.name == 'b'))
+    assert a != b
+    assert a == coalesce.query_key(EngineType.PLAYERDATA, select(Player).where(Player.name == 'a'))
+
+    sql = text('select * from Players where id in :ids')
+    assert coalesce.query_key(EngineType.PLAYERDATA, sql, {'ids': [1, 2]}) is not None
+
+
+def test_identical_reads_share_one_query(monkeypatch):
+    queries = []
+
+    async def read(engine_type, sql, params=None):
+        queries.append(params)
+        await asyncio.sleep(0.01)
+        return lambda: ['row']
+
+    monkeypatch.setattr(coalesce, '_read', read)
+    sql = text('select * from Players where id = :id')
+
+    async def run():
+        return await asyncio.gather(
+            *[coalesce.read_sql(sql, {'id': 1}) for _ in range(5)],
+            coalesce.read_sql(sql, {'id': 2}),
+        )
+
+    results = asyncio.run(run())
+    assert results == [['row']] * 6
+    assert queries == [{'id': 1}, {'id': 2}]
+
+
+def test_bypass_past_max_keys(monkeypatch):
+    queries = []
+
+    async def read(engine_type, sql, params=None):
+        queries.append(params)
+        return lambda: []
+
+    monkeypatch.setattr(coalesce, '_read', read)
+    monkeypatch.setattr(coalesce.Config, 'coalesce_max_keys', 0)
+    sql = text('select * from Players where id = :id')
+
+    asyncio.run(coalesce.read_sql(sql, {'id': 1}))
+    assert queries == [{'id': 1}]
+    assert coalesce.READS.get(engine='playerdata', result='bypassed') >= 1
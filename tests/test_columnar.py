@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import datetime
+import io
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+from api.database import columnar
+from api.database.models import Player, PlayerHiscoreDataLatest
+from sqlalchemy import select
+
+sql = select(
+    PlayerHiscoreDataLatest.Player_id,
+    PlayerHiscoreDataLatest.timestamp,
+    PlayerHiscoreDataLatest.total,
+    Player.name
+).join(Player)
+
+rows = [
+    (1, datetime.datetime(2022, 1, 1), 2**40, 'a'),
+    (2, None, None, 'b'),
+    (3, datetime.datetime(2022, 1, 2), 10, None),
+]
+
+
+async def fake_partitions(sql, engine_type, chunk_size):
+    for i in range(0, len(rows), chunk_size):
+        yield rows[i:i + chunk_size]
+
+
+async def export(fmt):
+    body = b''
+    async for chunk in columnar.columnar_bytes(sql, fmt, None, chunk_size=2):
+        body += chunk
+    return body
+
+
+def test_schema_from_model():
+    schema = columnar.arrow_schema(sql)
+    assert schema.names == ['Player_id', 'timestamp', 'total', 'name']
+    assert schema.types == [pa.int32(), pa.timestamp('us'), pa.int64(), pa.string()]
+
+
+def test_arrow_stream(monkeypatch):
+    monkeypatch.setattr(columnar, 'stream_partitions', fake_partitions)
+    table = pa.ipc.open_stream(asyncio.run(export('arrow'))).read_all()
+    assert table.column('Player_id').to_pylist() == [1, 2, 3]
+    assert table.column('total').to_pylist() == [2**40, None, 10]
+
+
+def test_parquet_file(monkeypatch):
+    monkeypatch.setattr(columnar, 'stream_partitions', fake_partitions)
+    parquet = pq.ParquetFile(io.BytesIO(asyncio.run(export('parquet'))))
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.read().column('name').to_pylist() == ['a', 'b', None]
@@ -0,0 +1,76 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+from api.database import contributions
+
+
+def test_refresh_dispatches_deltas(monkeypatch):
+    calls = []
+
+    async def apply_labels(player_ids):
+        calls.append(('labels', player_ids))
+        return len(player_ids)
+
+    async def apply_reports(batch_size):
+        calls.append(('reports',))
+        return 0
+
+    async def feedback(voter_ids):
+        calls.append(('feedback', voter_ids))
+
+    async def repair(reporter_ids):
+        calls.append(('repair', reporter_ids))
+
+    monkeypatch.setattr(contributions, 'apply_label_changes', apply_labels)
+    monkeypatch.setattr(contributions, 'apply_new_reports', apply_reports)
+    monkeypatch.setattr(contributions, 'sql_refresh_feedback_counts', feedback)
+    monkeypatch.setattr(contributions, 'repair_contributions', repair)
+
+    rows = [
+        {'reporter_id': 1}, {'reporter_id': 1}, {'reported_id': 101}, {'reported_id': 100},
+        {'reports': 1}, {'voter_id': 5}, {'voter_id': 5}
+    ]
+    asyncio.run(contributions.refresh_contributions(rows))
+    # label changes before new reports, so those are counted with the new labels once
+    assert calls == [('labels', [100, 101]), ('reports',), ('feedback', [5]), ('repair', [1])]
+
+
+def test_label_changes():
+    old = [
+        {'player_id': 1, 'possible_ban': 1, 'confirmed_ban': 0, 'confirmed_player': 0, 'xp': 0},
+        {'player_id': 2, 'possible_ban': 1, 'confirmed_ban': 1, 'confirmed_player': 0, 'xp': 500},
+        {'player_id': 3, 'possible_ban': 0, 'confirmed_ban': 0, 'confirmed_player': 0, 'xp': 0},
+    ]
+    new = [
+        {'player_id': 1, 'possible_ban': 1, 'confirmed_ban': 1, 'confirmed_player': 0, 'xp': 800},
+        {'player_id': 2, 'possible_ban': 1, 'confirmed_ban': 1, 'confirmed_player': 0, 'xp': 500},
+        {'player_id': 3, 'possible_ban': None, 'confirmed_ban': None, 'confirmed_player': 1, 'xp': 0},
+        {'player_id': 4, 'possible_ban': 1, 'confirmed_ban': 0, 'confirmed_player': 0, 'xp': 0},
+    ]
+    changes = {c['player_id']: c for c in contributions.label_changes(old, new)}
+
+    assert sorted(changes) == [1, 3, 4]
+    # a possible ban that is confirmed moves from possible_bans to bans
+    assert (changes[1]['bans'], changes[1]['possible_bans'], changes[1]['xp']) == (1, -1, 800)
+    assert (changes[3]['incorrect_reports'], changes[3]['labels']['possible_ban']) == (1, 0)
+    # a player without counted labels is counted from no labels
+    assert (changes[4]['bans'], changes[4]['possible_bans']) == (0, 1)
+
+
+def test_contribution_stats(monkeypatch):
+    counters = {c: 1 for c in contributions.COUNTER_COLUMNS}
+
+    async def get_contributions(names):
+        return counters
+
+    monkeypatch.setattr(contributions, 'get_contributions', get_contributions)
+
+    stats = asyncio.run(contributions.contribution_stats(['a'], add_patron_stats=True))
+    assert stats['manual'] == {'reports': 1, 'bans': 1, 'possible_bans': 1, 'incorrect_reports': 1}
+    assert stats['total'] == {'reports': 2, 'bans': 2, 'possible_bans': 2, 'feedback': 1, 'total_xp_removed': 1}
+
+    total = asyncio.run(contributions.contribution_stats(['a'], version='1.3'))
+    assert 'total_xp_removed' not in total and total['reports'] == 2
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+
+from api.routers.report import detection
+from api.utils.detections import DetectionBatch, join_player_ids
+
+now = int(time.time())
+
+
+def make_detection(reported, region_id=1, ts=now - 10, reporter='Some_Reporter'):
+    return detection(
+        reporter=reporter,
+        reported=reported,
+        region_id=region_id,
+        ts=ts,
+        world_number=302,
+        equipment={'equip_head_id': 10},
+    )
+
+
+def test_drop_duplicates_keeps_first():
+    batch = DetectionBatch.from_detections([
+        make_detection('b', ts=now - 1),
+        make_detection('a'),
+        make_detection('b', ts=now - 2),
+        make_detection('b', region_id=2),
+    ]).drop_duplicates()
+
+    assert batch.columns['reported'].tolist() == ['b', 'a', 'b']
+    assert batch.columns['ts'].tolist() == [now - 1, now - 10, now - 10]
+
+
+def test_time_window():
+    batch = DetectionBatch.from_detections([
+        make_detection('a', ts=now + 60),
+        make_detection('b', ts=now - 60),
+        make_detection('c', ts=now - 30_000),
+    ])
+    assert batch.in_time_window(now, 25_200).tolist() == [False, True, False]
+
+
+def test_params_and_ids():
+    batch = DetectionBatch.from_detections([
+        make_detection('Bad Name!!'),
+        make_detection('Good-Name', ts=0),
+        make_detection('unknown'),
+    ])
+    params = batch.normalize().to_params(manual_detect=1)
+
+    assert [p['reported'] for p in params] == ['good name', 'unknown']
+    assert params[0]['reporter'] == 'some reporter'
+    assert params[0]['timestamp'] == '1970-01-01 00:00:00'
+    assert params[0]['equip_head_id'] == 10 and params[0]['equip_cape_id'] is None
+    assert params[0]['manual_detect'] == 1
+
+    rows = join_player_ids(params, {'good name': 5, 'some reporter': 7})
+    assert len(rows) == 1
+    assert (rows[0]['reportedID'], rows[0]['reportingID']) == (5, 7)
+    assert 'reported' not in rows[0] and 'reported' in params[0]
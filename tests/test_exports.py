@@ -0,0 +1,200 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import csv
+import datetime
+import decimal
+
+from api.database import exports
+from api.utils.export_writers import (CsvExportWriter, ExportWriter,
+                                      XlsxExportWriter, cell)
+
+rows_a = [
+    {'reporter': 'a', 'label': 'Real_Player', 'Player_id': 1, 'attack': 99},
+    {'reporter': 'a', 'label': 'Real_Player', 'Player_id': 2, 'attack': 1},
+]
+rows_b = [
+    {'reporter': 'b', 'label': 'Real_Player', 'Player_id': 2, 'attack': 1},
+    {'reporter': 'b', 'label': 'Real_Player', 'Player_id': 3, 'attack': 50},
+]
+
+
+def test_csv_writer_dedupes_total(tmp_path):
+    path = str(tmp_path / 'bans.csv')
+    writer = CsvExportWriter(path)
+    writer.write('a', rows_a)
+    writer.write('b', rows_b)
+    writer.write('b', [])
+    writer.close()
+
+    with open(path, newline='') as f:
+        written = list(csv.DictReader(f))
+
+    assert writer.rows == 3
+    assert [r['Player_id'] for r in written] == ['1', '2', '3']
+    assert written[1]['reporter'] == 'a'
+
+
+def test_xlsx_writer(tmp_path):
+    path = str(tmp_path / 'bans.xlsx')
+    writer = XlsxExportWriter(path)
+    writer.write('a', rows_a)
+    writer.write('b', rows_b)
+    writer.close()
+
+    assert writer.rows == 3
+    assert [w.name for w in writer._workbook.worksheets()] == ['Total', 'a', 'b']
+    assert os.path.getsize(path) > 0
+
+
+def test_writer_is_abstract(tmp_path):
+    try:
+        ExportWriter(str(tmp_path / 'x'))
+        assert False
+    except TypeError:
+        pass
+
+
+def test_cell():
+    assert cell(None) is None
+    assert cell(decimal.Decimal('1.5')) == 1.5
+    assert cell(datetime.datetime(2022, 1, 2, 3, 4, 5)) == '2022-01-02 03:04:05'
+
+
+def stored_jobs(monkeypatch) -> dict:
+    '''export_jobs in a dict instead of the discord database'''
+    rows = {}
+
+    async def insert(job, job_ttl):
+        rows[job.id] = job.to_row()
+
+    async def save(job):
+        rows[job.id] = job.to_row()
+
+    async def select(job_id, job_ttl):
+        return rows.get(job_id)
+
+    monkeypatch.setattr(exports, 'sql_insert_export_job', insert)
+    monkeypatch.setattr(exports, 'save_export_job', save)
+    monkeypatch.setattr(exports, 'sql_select_export_job', select)
+    return rows
+
+
+def test_job_status(monkeypatch):
+    stored_jobs(monkeypatch)
+
+    async def build(job):
+        job.accounts = 1
+        await asyncio.sleep(0)
+        job.rows = 10
+        job.url = 'abc'
+
+    async def main():
+        jobs = exports.ExportJobs(concurrency=1, job_ttl=60, build=build)
+        job = await jobs.submit(1, 'name', 'csv')
+        assert jobs.get(job.id).status == 'queued'
+        await job.done.wait()
+        # another replica only has the stored status
+        other = exports.ExportJobs(concurrency=1, job_ttl=60, build=build)
+        return await jobs.status(job.id), await other.status(job.id)
+
+    status, stored = asyncio.run(main())
+    assert status['status'] == 'done'
+    assert status['rows'] == 10
+    assert status['url'] == 'abc'
+    assert stored == status
+
+
+def test_job_failures(monkeypatch):
+    stored_jobs(monkeypatch)
+
+    async def no_accounts(job):
+        raise exports.ExportFailed(exports.NO_ACCOUNTS)
+
+    async def broken(job):
+        raise RuntimeError('connection lost')
+
+    async def main():
+        failed = []
+        for build in (no_accounts, broken):
+            jobs = exports.ExportJobs(concurrency=1, job_ttl=60, build=build)
+            job = await jobs.submit(1, 'name', 'excel')
+            await job.done.wait()
+            failed.append((job.status, job.error))
+        return failed
+
+    assert asyncio.run(main()) == [('failed', exports.NO_ACCOUNTS), ('failed', exports.NO_DATA)]
+
+    jobs = exports.ExportJobs(concurrency=1, job_ttl=60)
+    try:
+        asyncio.run(jobs.submit(1, 'name', 'pdf'))
+        assert False
+    except ValueError:
+        pass
+    assert asyncio.run(jobs.status('unknown')) is None
+
+
+def test_build_streams_every_account(monkeypatch, tmp_path):
+    links = []
+
+    class Account:
+        def __init__(self, name):
+            self.name = name
+
+    async def linked_accounts(discord_id):
+        return [Account('a'), Account('b')]
+
+    async def ban_rows(player_name):
+        yield rows_a if player_name == 'a' else rows_b[:1]
+        if player_name == 'b':
+            yield rows_b[1:]
+
+    async def insert_link(export_info):
+        links.append(export_info)
+
+    monkeypatch.chdir(tmp_path)
+    stored_jobs(monkeypatch)
+    monkeypatch.setattr(exports, 'sql_get_discord_linked_accounts', linked_accounts)
+    monkeypatch.setattr(exports, 'ban_rows', ban_rows)
+    monkeypatch.setattr(exports, 'insert_export_link', insert_link)
+
+    job = exports.ExportJob(1, 'name', 'csv')
+    asyncio.run(exports.build_ban_export(job))
+
+    assert (job.accounts, job.accounts_done, job.rows) == (2, 2, 4)
+    assert links[0]['file_name'] == 'name_bans.csv' and links[0]['is_csv'] == 1
+    assert job.url == links[0]['url_text']
+    assert os.listdir(tmp_path / 'exports') == ['name_bans.csv']
+
+
+def test_build_keeps_accounts_that_did_not_fail(monkeypatch, tmp_path):
+    class Account:
+        def __init__(self, name):
+            self.name = name
+
+    async def linked_accounts(discord_id):
+        return [Account('a'), Account('b')]
+
+    async def ban_rows(player_name):
+        if player_name == 'b':
+            raise RuntimeError('connection lost')
+        yield rows_a
+
+    async def insert_link(export_info):
+        pass
+
+    monkeypatch.chdir(tmp_path)
+    stored_jobs(monkeypatch)
+    monkeypatch.setattr(exports, 'sql_get_discord_linked_accounts', linked_accounts)
+    monkeypatch.setattr(exports, 'ban_rows', ban_rows)
+    monkeypatch.setattr(exports, 'insert_export_link', insert_link)
+
+    job = exports.ExportJob(1, 'name', 'excel')
+    asyncio.run(exports.build_ban_export(job))
+
+    assert job.failed_accounts == ['b']
+    assert job.to_dict()['failed_accounts'] == ['b']
+    assert (job.accounts_done, job.rows) == (1, 2)
+    assert os.listdir(tmp_path / 'exports') == ['name_bans.xlsx']
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import time
+
+from api.utils.fan_out import fan_out, raise_failed
+
+
+def test_results_in_order_and_bounded():
+    running, peak = 0, 0
+
+    async def call(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 * (5 - i % 5))
+        running -= 1
+        return i * 2
+
+    outcomes = asyncio.run(fan_out(call, range(20), concurrency=4))
+    assert [o.value for o in outcomes] == [i * 2 for i in range(20)]
+    assert all(o.ok for o in outcomes)
+    assert peak == 4
+
+
+def test_calls_run_in_parallel():
+    async def call(i):
+        await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    asyncio.run(fan_out(call, range(10), concurrency=10))
+    assert time.perf_counter() - start < 0.5
+
+
+def test_partial_failures():
+    async def call(i):
+        if i == 1:
+            raise ValueError('bad item')
+        if i == 2:
+            await asyncio.sleep(1)
+        return i
+
+    outcomes = asyncio.run(fan_out(call, [0, 1, 2, 3], concurrency=2, timeout=0.05))
+    assert [o.ok for o in outcomes] == [True, False, False, True]
+    assert isinstance(outcomes[1].error, ValueError)
+    assert isinstance(outcomes[2].error, asyncio.TimeoutError)
+    assert outcomes[3].value == 3
+
+    try:
+        raise_failed(outcomes)
+        assert False
+    except ValueError:
+        pass
+    assert raise_failed(outcomes[:1]) == [0]
+
+
+def test_no_items():
+    async def call(i):
+        return i
+
+    assert asyncio.run(fan_out(call, [])) == []
@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import time
+
+from api.database import heatmaps
+
+tiles = [
+    {'x_coord': 3200, 'y_coord': 3200, 'confirmed_ban': 2},
+    {'x_coord': 3201, 'y_coord': 3201, 'confirmed_ban': 1},
+    {'x_coord': 3204, 'y_coord': 3200, 'confirmed_ban': 4},
+]
+
+
+def test_zoom_tiles():
+    assert heatmaps.zoom_tiles(tiles, 0) == tiles
+    assert heatmaps.zoom_tiles(tiles, 2) == [
+        {'x_coord': 3200, 'y_coord': 3200, 'confirmed_ban': 3},
+        {'x_coord': 3204, 'y_coord': 3200, 'confirmed_ban': 4},
+    ]
+    assert heatmaps.to_arrays(heatmaps.zoom_tiles(tiles, 3)) == {'x_coord': [3200], 'y_coord': [3200], 'confirmed_ban': [7]}
+
+
+def test_cold_and_expired_regions_are_queued(monkeypatch):
+    queued, store = [], {12851: {'tiles': tiles, 'updated_at': time.time() - heatmaps.Config.heatmap_max_age - 1}}
+
+    async def select_heatmap(region_id):
+        return store.get(region_id, {'tiles': [], 'updated_at': None})
+
+    async def put(rows):
+        queued.extend(rows)
+
+    monkeypatch.setattr(heatmaps, 'sql_select_heatmap', select_heatmap)
+    monkeypatch.setattr(heatmaps.heatmap_queue, 'put', put)
+
+    # nothing is computed on the read, a cold region is pending and an expired one is served as it is
+    assert asyncio.run(heatmaps.get_heatmap(12850)) is None
+    assert asyncio.run(heatmaps.get_heatmap(12851)) == tiles
+    assert queued == [{'region_id': 12850}, {'region_id': 12851}]
+
+
+def test_refresh_applies_transitions_and_recomputes_regions(monkeypatch):
+    calls = []
+
+    async def apply(player_ids):
+        calls.append(('transitions', player_ids))
+        return len(player_ids)
+
+    async def recompute(region_ids):
+        calls.append(('regions', region_ids))
+
+    async def apply_reports(batch_size):
+        calls.append(('reports',))
+        return 0
+
+    monkeypatch.setattr(heatmaps, 'apply_transitions', apply)
+    monkeypatch.setattr(heatmaps, 'apply_new_reports', apply_reports)
+    monkeypatch.setattr(heatmaps, 'recompute_regions', recompute)
+
+    rows = [{'player_id': 7}, {'player_id': 7}, {'reports': 1}, {'region_id': 3}, {'region_id': 1}]
+    asyncio.run(heatmaps.refresh_heatmaps(rows))
+    assert calls == [('transitions', [7]), ('reports',), ('regions', [1, 3])]
+
+
+def test_cold_region_is_computed_on_request(monkeypatch):
+    computed, store = [], {}
+
+    async def select_heatmap(region_id):
+        return store.get(region_id, {'tiles': [], 'updated_at': None})
+
+    async def recompute(region_ids):
+        computed.extend(region_ids)
+        await asyncio.sleep(0.01)
+        store.update({r: {'tiles': tiles, 'updated_at': time.time()} for r in region_ids})
+
+    monkeypatch.setattr(heatmaps, 'sql_select_heatmap', select_heatmap)
+    monkeypatch.setattr(heatmaps, 'recompute_regions', recompute)
+
+    async def main():
+        return await asyncio.gather(*[heatmaps.get_heatmap(12850, compute=True) for _ in range(3)])
+
+    # the legacy route computes a cold region, concurrent reads share the computation
+    assert asyncio.run(main()) == [tiles] * 3
+    assert computed == [12850]
+
+
+def test_split_transitions():
+    rows = [{'id': 1, 'banned': 1}, {'id': 2, 'banned': 0}, {'id': 3, 'banned': 1}]
+    assert heatmaps.split_transitions(rows) == ([1, 3], [2])
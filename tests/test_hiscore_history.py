@@ -0,0 +1,117 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import datetime
+
+from api.database import hiscore_history
+from api.database.functions import encode_cursor, paginate_rows
+from api.database.models import playerHiscoreData
+from api.utils.hiscore_codec import (COLUMNS, HistoryError, decode_deltas,
+                                     decode_history, encode_history,
+                                     history_state, last_snapshot)
+
+
+def history(days: int, player_id: int = 7, start_id: int = 100) -> list:
+    rows = []
+    values = dict.fromkeys(COLUMNS, 0)
+    values['league'] = -1
+    for day in range(days):
+        values = dict(values, attack=values['attack'] + 1_000 * day, zulrah=values['zulrah'] + (day % 3 == 0))
+        values['total'] = values['attack']
+        ts = datetime.datetime(2022, 3, 1, 12, 30) + datetime.timedelta(days=day, seconds=day * 17)
+        rows.append({'id': start_id + day * 250_000, 'timestamp': ts, 'ts_date': ts.date(), 'Player_id': player_id, **values})
+    return rows
+
+
+def test_columns_match_the_table():
+    columns = [c.name for c in playerHiscoreData.__table__.columns]
+    assert tuple(columns[4:]) == COLUMNS
+
+
+def test_round_trip():
+    rows = history(30)
+    rows[4]['nex'] = None
+    rows[5]['ts_date'] = None
+    rows[6]['ts_date'] = rows[6]['timestamp'].date() - datetime.timedelta(days=1)
+
+    data = encode_history(rows)
+    assert decode_history(data, 7) == rows
+    # unchanged columns cost nothing, a day is a few bytes instead of a row of 84 integers
+    assert len(data) < 30 * 20
+
+
+def test_append():
+    rows = history(10)
+    data = encode_history(rows[:6])
+    data += encode_history(rows[6:], history_state(data))
+
+    assert data == encode_history(rows)
+    assert last_snapshot(data, 7) == rows[-1]
+    assert last_snapshot(b'', 7) is None
+    assert history_state(b'') is None
+
+
+def test_append_after_null():
+    rows = history(3)
+    rows[0]['nex'], rows[1]['nex'], rows[2]['nex'] = 10, None, 15
+    data = encode_history(rows[:2])
+    data += encode_history(rows[2:], history_state(data))
+
+    assert [r['nex'] for r in decode_history(data, 7)] == [10, None, 15]
+    assert data == encode_history(rows)
+
+
+def test_deltas():
+    rows = history(4)
+    rows[2]['nex'] = None
+    deltas = decode_deltas(encode_history(rows), 7)
+
+    assert [d['id'] for d in deltas] == [r['id'] for r in rows[1:]]
+    assert [d['attack'] for d in deltas] == [1_000, 2_000, 3_000]
+    assert [d['zulrah'] for d in deltas] == [0, 0, 1]
+    assert [d['nex'] for d in deltas] == [0, None, None]
+    assert deltas[0]['cs_all'] == 0
+
+
+def test_unknown_version():
+    try:
+        decode_history(b'\x09', 7)
+        assert False
+    except HistoryError:
+        pass
+
+
+def test_compact_appends_new_hiscores(monkeypatch):
+    rows = history(5)
+    stored = {7: {'Player_id': 7, 'snapshots': 3, 'last_id': rows[2]['id'], 'last_ts_date': rows[2]['ts_date'], 'data': encode_history(rows[:3])}}
+    written, selected = [], []
+
+    async def select_histories(player_ids):
+        return {p: stored[p] for p in player_ids if p in stored}
+
+    async def select_hiscores(player_ids, since=None):
+        selected.append((player_ids, since))
+        # the day of the last snapshot is read again, it is skipped on its id
+        return [r for r in rows if since is None or r['ts_date'] >= since]
+
+    async def execute(sql, param):
+        written.extend(param)
+
+    monkeypatch.setattr(hiscore_history, 'sql_select_histories', select_histories)
+    monkeypatch.setattr(hiscore_history, 'sql_select_hiscores', select_hiscores)
+    monkeypatch.setattr(hiscore_history, 'execute_sql', execute)
+
+    assert asyncio.run(hiscore_history.compact_players([7])) == 1
+    assert selected == [([7], rows[2]['ts_date'])]
+    assert written[0]['snapshots'] == 5
+    assert written[0]['previous_id'] == rows[2]['id']
+    assert decode_history(written[0]['data'], 7) == rows
+
+
+def test_paginate_rows():
+    rows = [{'id': i} for i in range(1, 8)]
+    assert paginate_rows(rows, 'id', 3) == rows[:3]
+    assert paginate_rows(rows, 'id', 3, page=3) == rows[6:]
+    assert paginate_rows(rows, 'id', 3, cursor=encode_cursor(3)) == rows[3:6]
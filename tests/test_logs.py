@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import logging
+import queue
+
+from api.utils.logs import (LOG_RECORDS, DroppingQueueHandler, JsonFormatter,
+                            SampleFilter, parse_levels)
+
+
+def record(msg, level=logging.DEBUG, lineno=1, args=None):
+    return logging.LogRecord('test', level, __file__, lineno, msg, args, None)
+
+
+def test_json_formatter_keeps_dicts():
+    line = JsonFormatter().format(record({"message": 'quote " and \n newline', "rows": 3}))
+    entry = json.loads(line)
+    assert entry['msg'] == {"message": 'quote " and \n newline', "rows": 3}
+    assert entry['level'] == 'DEBUG'
+
+    assert json.loads(JsonFormatter().format(record('%s rows', args=(3,))))['msg'] == '3 rows'
+
+
+def test_sample_filter():
+    sample = SampleFilter(every=10)
+    kept = [sample.filter(record('x')) for _ in range(100)]
+    assert sum(kept) == 10
+    assert sample.filter(record('x', level=logging.ERROR))
+
+
+def test_queue_handler_drops_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    dropped = LOG_RECORDS.get(result='dropped')
+    handler.handle(record('a'))
+    handler.handle(record('b'))
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS.get(result='dropped') == dropped + 1
+
+
+def test_parse_levels():
+    assert parse_levels('aiomysql=error, api.middleware=INFO,bad') == {'aiomysql': 'ERROR', 'api.middleware': 'INFO'}
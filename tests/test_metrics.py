@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.database import instrumentation
+from api.utils.metrics import Histogram, Registry
+from sqlalchemy import create_engine, text
+
+
+def test_histogram_render():
+    registry = Registry()
+    histogram = Histogram('test_seconds', 'Test.', ('route',), buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, route='/')
+
+    assert histogram.count(route='/') == 4
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{route="/",le="0.1"} 2.0' in lines
+    assert 'test_seconds_bucket{route="/",le="1.0"} 3.0' in lines
+    assert 'test_seconds_bucket{route="/",le="+Inf"} 4.0' in lines
+    assert 'test_seconds_sum{route="/"} 5.65' in lines
+    assert 'test_seconds_count{route="/"} 4.0' in lines
+
+
+def test_db_time_per_request():
+    engine = create_engine('sqlite://')
+    instrumentation.instrument_engine(engine, 'test_request')
+
+    stats = instrumentation.RequestStats()
+    token = instrumentation.request_stats.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('select 1'))
+            conn.execute(text('select 2'))
+    finally:
+        instrumentation.request_stats.reset(token)
+
+    assert stats.db_statements == 2
+    assert stats.db_seconds > 0
+    assert instrumentation.QUERY_SECONDS.count(engine='test_request', statement='select') == 2
+
+
+def test_request_metrics():
+    from api.app import app
+    from api.middleware import REQUEST_SECONDS, RESPONSE_BYTES
+    from fastapi.testclient import TestClient
+
+    client = TestClient(app)
+    response = client.get("/")
+    assert response.status_code == 200
+    assert REQUEST_SECONDS.count(method='GET', route='/', status=200) >= 1
+    assert RESPONSE_BYTES.count(method='GET', route='/') >= 1
+
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/",status="200",le="0.005"}' in body
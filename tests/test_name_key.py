@@ -0,0 +1,76 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import hashlib
+
+from api.database import player_names
+
+
+def test_name_key_matches_sql_expression():
+    # CAST(CONV(LEFT(SHA2(name, 256), 16), 16, 10) AS UNSIGNED)
+    name = 'some player'
+    expected = int(hashlib.sha256(name.encode()).hexdigest()[:16], 16)
+    assert player_names.name_key(name) == expected
+    assert 0 <= expected < 2**64
+
+
+def test_select_players_checks_collisions(monkeypatch):
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def execute(self, sql):
+            class Result:
+                def mappings(self):
+                    # the second row shares a key with 'a', but is another name
+                    return [{'id': 1, 'normalized_name': 'a'}, {'id': 2, 'normalized_name': 'other'}]
+            return Result()
+
+    monkeypatch.setattr(player_names, 'get_session', lambda engine_type: Session())
+    players = asyncio.run(player_names.sql_select_players(['A']))
+    assert players == [{'id': 1, 'normalized_name': 'a'}]
+
+
+def test_name_key_is_not_returned():
+    from api.database.functions import sqlalchemy_result
+    from api.database.models import Player
+    from api.database.streaming import core_columns
+    from sqlalchemy.sql.expression import select
+
+    columns = [c.name for c in core_columns(select(Player), Player).selected_columns]
+    assert 'name_key' not in columns and 'normalized_name' in columns
+    assert 'name_key' not in str(select(Player))
+
+    row = Player(id=1, name='a', normalized_name='a')
+    assert 'name_key' not in sqlalchemy_result([(row,)]).rows2dict()[0]
+
+
+def test_get_player_selects_once_on_name_key(monkeypatch):
+    from api.routers import legacy
+
+    class Result:
+        def rows2dict(self):
+            return [{'id': 7, 'name': 'Some Player', 'normalized_name': 'some player'}]
+
+    queries = []
+
+    async def execute_sql(sql, param=None, **kwargs):
+        queries.append((sql, param))
+        return Result()
+
+    monkeypatch.setattr(legacy, 'execute_sql', execute_sql)
+    monkeypatch.setattr(player_names.player_names, 'cache', type(player_names.player_names.cache)(max_size=10))
+
+    player = asyncio.run(legacy.sql_get_player('Some Player'))
+    assert player['id'] == 7
+    assert len(queries) == 1
+    sql, param = queries[0]
+    assert 'name_key = :name_key' in sql and 'normalized_name = :normalized_name' in sql
+    assert param == {'name_key': player_names.name_key('some player'), 'normalized_name': 'some player'}
+    # the row fills the name cache
+    assert player_names.player_names.cache.get('some player') == 7
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.database import functions
+from api.utils.ratelimit import SlidingWindowRateLimiter
+from fastapi import HTTPException
+
+
+def test_count_in_window():
+    limiter = SlidingWindowRateLimiter(window=100)
+    for _ in range(10):
+        limiter.hit('user', now=1_000)
+    assert limiter.count('user', now=1_050) == 10
+
+
+def test_previous_window_is_weighted():
+    limiter = SlidingWindowRateLimiter(window=100)
+    for _ in range(10):
+        limiter.hit('user', now=1_000)
+    # a quarter into the next window, 75% of the previous window overlaps
+    assert limiter.count('user', now=1_125) == 7.5
+    assert limiter.count('user', now=1_300) == 0
+
+
+def test_seed_and_prune():
+    limiter = SlidingWindowRateLimiter(window=100)
+    assert 'user' not in limiter
+    limiter.seed('user', 40, now=1_000)
+    assert limiter.hit('user', now=1_010) == 41
+    assert limiter.seeded_at('user') == 1_000
+    limiter.prune(now=1_500)
+    assert 'user' not in limiter
+    assert limiter.seeded_at('user') is None
+
+
+@pytest.fixture
+def api_user(monkeypatch):
+    reads = []
+
+    async def get_api_user(token, verification):
+        return {'id': 1, 'is_active': 1, 'ratelimit': 2}
+
+    async def count_usage(user_id):
+        reads.append(user_id)
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def put(rows):
+        pass
+
+    monkeypatch.setattr(functions, 'token_cache', functions.LRUCache())
+    monkeypatch.setattr(functions, 'rate_limiter', SlidingWindowRateLimiter(window=3600))
+    monkeypatch.setattr(functions, 'sql_get_api_user', get_api_user)
+    monkeypatch.setattr(functions, 'sql_count_api_usage', count_usage)
+    monkeypatch.setattr(functions.usage_queue, 'put', put)
+    return reads
+
+
+def test_ratelimit_counts_usage_before_the_request(api_user):
+    async def main():
+        # concurrent first requests share one read of apiUsage
+        await asyncio.gather(*[functions.verify_token('t', 'verify_ban') for _ in range(2)])
+        try:
+            await functions.verify_token('t', 'verify_ban')
+            assert False
+        except HTTPException as e:
+            assert e.status_code == 429
+
+    asyncio.run(main())
+    assert api_user == [1]
+
+
+def test_ratelimit_is_synced_with_the_database(api_user, monkeypatch):
+    monkeypatch.setattr(functions.Config, 'ratelimit_sync_interval', 0)
+
+    async def main():
+        # every sync replaces the local count with the one of apiUsage
+        for _ in range(3):
+            await functions.verify_token('t', 'verify_ban')
+
+    asyncio.run(main())
+    assert len(api_user) == 3
+
+
+def test_invalidate_token(api_user):
+    asyncio.run(functions.verify_token('t', 'verify_ban'))
+    assert len(functions.token_cache) == 1
+    functions.invalidate_token('other')
+    assert len(functions.token_cache) == 1
+    functions.invalidate_token('t')
+    assert len(functions.token_cache) == 0
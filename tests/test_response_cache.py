@@ -0,0 +1,110 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.utils.response_cache import ResponseCache, cached, clear_caches
+
+
+def test_concurrent_misses_share_one_load():
+    calls = []
+
+    @cached('test_coalesce', ttl=60)
+    async def load(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {'key': key}
+
+    async def run():
+        return await asyncio.gather(*[load('a') for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert calls == ['a']
+    assert all(r == {'key': 'a'} for r in results)
+
+
+def test_stale_entry_is_served_and_refreshed():
+    values = iter([1, 2])
+
+    async def load():
+        return next(values)
+
+    async def run():
+        cache = ResponseCache('test_stale', ttl=0.01, stale_ttl=60)
+        first = await cache.get('k', load)
+        await asyncio.sleep(0.02)
+        stale = await cache.get('k', load)
+        # let the background refresh finish
+        await asyncio.sleep(0.01)
+        fresh = await cache.get('k', load)
+        return first, stale, fresh
+
+    assert asyncio.run(run()) == (1, 1, 2)
+
+
+def test_errors_and_none_are_not_cached():
+    calls = []
+
+    async def run():
+        cache = ResponseCache('test_errors', ttl=60)
+
+        async def fail():
+            calls.append('fail')
+            raise RuntimeError('db down')
+
+        async def empty():
+            calls.append('empty')
+            return None
+
+        async def ok():
+            calls.append('ok')
+            return 'ok'
+
+        with pytest.raises(RuntimeError):
+            await cache.get('k', fail)
+        assert await cache.get('k', empty) is None
+        assert await cache.get('k', ok) == 'ok'
+        assert await cache.get('k', fail) == 'ok'
+
+    asyncio.run(run())
+    assert calls == ['fail', 'empty', 'ok']
+
+
+def test_cancelled_first_caller_does_not_fail_the_others():
+    calls = []
+
+    @cached('test_cancel', ttl=60)
+    async def load(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return {'key': key}
+
+    async def run():
+        first = asyncio.create_task(load('a'))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(load('a'))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == {'key': 'a'}
+    assert calls == ['a']
+
+
+def test_clear_caches_by_name():
+    values = iter([1, 2])
+
+    @cached('test_clear', ttl=60)
+    async def load():
+        return next(values)
+
+    async def run():
+        first = await load()
+        clear_caches('test_clear', 'no_such_cache')
+        return first, await load()
+
+    assert asyncio.run(run()) == (1, 2)
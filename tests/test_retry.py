@@ -0,0 +1,71 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.database import retry
+from api.database.retry import RetryPolicy, SqlError
+from sqlalchemy.exc import OperationalError
+
+
+def mysql_error(code: int) -> OperationalError:
+    return OperationalError('select 1', {}, Exception(code, 'mysql error'))
+
+
+def failing(errors):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 'ok'
+    return fn, calls
+
+
+def test_retries_deadlocks_then_succeeds():
+    fn, calls = failing([mysql_error(1213), mysql_error(1205)])
+    policy = RetryPolicy(attempts=5, base=0.001, cap=0.001)
+    assert asyncio.run(policy.run(fn)) == 'ok'
+    assert len(calls) == 3
+    assert retry.SQL_RETRIES.get(reason='deadlock') >= 1
+
+
+def test_other_errors_are_not_retried():
+    fn, calls = failing([mysql_error(1062)])
+    with pytest.raises(SqlError) as e:
+        asyncio.run(RetryPolicy(base=0.001).run(fn))
+    assert e.value.reason == 'error' and not e.value.retryable
+    assert len(calls) == 1
+
+
+def test_connection_errors_are_retryable_later():
+    fn, calls = failing([mysql_error(2013)])
+    with pytest.raises(SqlError) as e:
+        asyncio.run(RetryPolicy(base=0.001).run(fn))
+    assert e.value.reason == 'connection' and e.value.retryable
+    assert len(calls) == 1
+
+
+def test_gives_up_after_attempts():
+    fn, calls = failing([mysql_error(1213)] * 5)
+    with pytest.raises(SqlError) as e:
+        asyncio.run(RetryPolicy(attempts=3, base=0.001, cap=0.001).run(fn))
+    assert e.value.reason == 'deadlock'
+    assert len(calls) == 3
+
+
+def test_request_deadline():
+    fn, calls = failing([mysql_error(1205)] * 5)
+    policy = RetryPolicy(attempts=5, base=1, cap=1, deadline=60)
+
+    async def run():
+        with retry.deadline(0):
+            await policy.run(fn)
+
+    with pytest.raises(SqlError) as e:
+        asyncio.run(run())
+    assert e.value.reason == 'deadline'
+    assert len(calls) == 1
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.routers.scraper import latest_player_updates, player_update_statements
+
+
+def test_latest_player_update_wins():
+    players = [
+        {'id': 1, 'name': 'a', 'confirmed_ban': 1},
+        {'id': 2, 'name': 'b', 'confirmed_ban': None},
+        {'id': 1, 'name': 'a', 'confirmed_ban': None},
+        {'id': 3, 'label_id': 5},
+    ]
+    groups = latest_player_updates(players)
+
+    # None is kept, it clears the column like an update of the player did
+    assert groups[('name', 'confirmed_ban')] == [
+        {'id': 1, 'name': 'a', 'confirmed_ban': None},
+        {'id': 2, 'name': 'b', 'confirmed_ban': None},
+    ]
+    assert groups[('label_id',)] == [{'id': 3, 'label_id': 5}]
+
+
+def test_player_update_sets_the_given_columns():
+    insert_sql, changes_sql, apply_sql = player_update_statements(('name', 'confirmed_ban'))
+    assert 'pl.confirmed_ban = tmp.confirmed_ban' in str(apply_sql)
+    assert 'COALESCE' not in str(apply_sql)
+    assert 'possible_ban' not in str(changes_sql)
+
+    assert player_update_statements(('label_id',))[1] is None
@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from api.database import instrumentation, statements
+from sqlalchemy import create_engine
+
+
+def test_statements_are_built_once():
+    a = statements.insert_statement('Reports', ['reportedID', 'reportingID'], ignore=True)
+    b = statements.insert_statement('Reports', {'reportedID': 1, 'reportingID': 2}.keys(), ignore=True)
+    assert a is b
+    assert str(a) == 'insert ignore into Reports (reportedID, reportingID) values (:reportedID, :reportingID)'
+
+    assert statements.insert_statement('Reports', ['reportedID', 'reportingID']) is not a
+    assert str(statements.insert_statement('Predictions', ['name'], replace=True)) == 'replace into Predictions (name) values (:name)'
+    assert str(statements.update_statement('Players', ['label_id'], key='id', param='player_id')) == 'update Players set label_id=:label_id where id=:player_id'
+
+
+def test_rejects_identifiers():
+    with pytest.raises(ValueError):
+        statements.insert_statement('Reports', ['id) values (1); drop table Reports; --'])
+
+
+def test_compiled_cache_metric():
+    engine = create_engine('sqlite://')
+    instrumentation.instrument_engine(engine, 'test')
+
+    sql = statements.text_statement('select :a')
+    with engine.connect() as conn:
+        for _ in range(3):
+            conn.execute(sql, {'a': 1})
+
+    assert instrumentation.COMPILED_CACHE.get(engine='test', result='miss') == 1
+    assert instrumentation.COMPILED_CACHE.get(engine='test', result='hit') == 2
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+
+from api.database.streaming import csv_lines, ndjson_lines
+
+
+async def chunks():
+    yield [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+    yield []
+    yield [{'id': 3, 'name': 'c,d'}]
+
+
+async def collect(lines):
+    return ''.join([line async for line in lines])
+
+
+def test_ndjson_lines():
+    body = asyncio.run(collect(ndjson_lines(chunks())))
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row['id'] for row in rows] == [1, 2, 3]
+
+
+def test_csv_lines_single_header():
+    body = asyncio.run(collect(csv_lines(chunks())))
+    assert body.splitlines() == ['id,name', '1,a', '2,b', '3,"c,d"']
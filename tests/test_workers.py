@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.utils.cpu_jobs import clean_legacy_detections
+from api.utils.workers import WorkerPool
+
+
+detections = [
+    {'reporter': 'Some_Reporter', 'reported': 'Player-1', 'region_id': 1, 'ts': 1_000},
+    {'reporter': 'Some_Reporter', 'reported': 'Player-1', 'region_id': 1, 'ts': 1_000},
+]
+
+
+def test_runs_in_worker_process():
+    async def run():
+        pool = WorkerPool(max_workers=1, lanes={'default': 1})
+        pool.start()
+        try:
+            return await asyncio.gather(*[pool.run(clean_legacy_detections, detections, 1_000) for _ in range(3)])
+        finally:
+            await pool.stop()
+
+    for records, reason in asyncio.run(run()):
+        assert reason is None
+        assert records == [{'reporter': 'some reporter', 'reported': 'player 1', 'region_id': 1, 'ts': 1_000}]
+
+
+def test_not_started_runs_in_thread():
+    pool = WorkerPool(max_workers=1, lanes={'default': 1})
+    assert asyncio.run(pool.run(clean_legacy_detections, [], 0)) == ([], 'no detections')
+
+
+def test_unknown_lane():
+    pool = WorkerPool(max_workers=1, lanes={'default': 1})
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run(clean_legacy_detections, [], 0, lane='export'))
@@ -0,0 +1,79 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+
+import pytest
+from api.utils.write_behind import QueueFull, WriteBehindQueue
+
+
+def test_flush_on_batch_size():
+    flushed = []
+
+    async def flush(rows):
+        flushed.append(list(rows))
+
+    async def run():
+        queue = WriteBehindQueue('test_batch_size', flush, batch_size=10, flush_interval=60)
+        queue.start()
+        await queue.put([{'i': i} for i in range(25)])
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert [len(batch) for batch in flushed] == [10, 10, 5]
+
+
+def test_stop_drains_queue():
+    flushed = []
+
+    async def flush(rows):
+        flushed.extend(rows)
+
+    async def run():
+        queue = WriteBehindQueue('test_drain', flush, batch_size=1_000, flush_interval=60)
+        queue.start()
+        await queue.put([{'i': i} for i in range(50)])
+        assert queue.depth == 50
+        await queue.stop()
+        assert queue.depth == 0
+
+    asyncio.run(run())
+    assert len(flushed) == 50
+
+
+def test_backpressure():
+    async def flush(rows):
+        await asyncio.sleep(10)
+
+    async def run():
+        queue = WriteBehindQueue('test_backpressure', flush, batch_size=1_000, flush_interval=60, max_size=10, put_timeout=0.01)
+        queue.start()
+        await queue.put([{'i': i} for i in range(10)])
+        with pytest.raises(QueueFull):
+            await queue.put([{'i': 10}])
+        queue._task.cancel()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_retried():
+    calls = []
+
+    async def flush(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError('deadlock')
+
+    async def run():
+        queue = WriteBehindQueue('test_retry', flush, batch_size=1_000, flush_interval=60)
+        queue.start()
+        await queue.put([{'i': i} for i in range(5)])
+        await queue.flush()
+        assert queue.depth == 5
+        await queue.stop()
+        assert queue.depth == 0
+
+    asyncio.run(run())
+    assert calls == [5, 5]
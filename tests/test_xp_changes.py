@@ -0,0 +1,97 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import datetime
+
+from api.database import xp_changes
+from api.utils.hiscore_codec import COLUMNS
+from api.utils.xp_changes import (Snapshots, consecutive_gains, gains_between,
+                                  window_gains)
+
+START = datetime.datetime(2022, 1, 1, 12)
+
+
+def snapshot(player_id: int, row_id: int, day: int, attack: int, **values) -> dict:
+    ts = START + datetime.timedelta(days=day)
+    row = {'id': row_id, 'Player_id': player_id, 'timestamp': ts, 'ts_date': ts.date(), **dict.fromkeys(COLUMNS, 0)}
+    row.update(attack=attack, total=attack, **values)
+    return row
+
+
+rows = [
+    snapshot(2, 6, 3, 160, nex=None),
+    snapshot(1, 1, 0, 10),
+    snapshot(1, 5, 1, 15, zulrah=2),
+    snapshot(1, 9, 2, 30, zulrah=3),
+    snapshot(2, 2, 0, 100),
+    snapshot(3, 3, 0, 1),
+]
+
+
+def test_consecutive_gains():
+    gains = consecutive_gains(Snapshots(rows))
+
+    assert [(g['Player_id'], g['start_id'], g['id']) for g in gains] == [(1, 1, 5), (1, 5, 9), (2, 2, 6)]
+    assert [g['attack'] for g in gains] == [5, 15, 60]
+    assert [g['zulrah'] for g in gains] == [2, 1, 0]
+    assert gains[2]['nex'] is None
+
+    latest = consecutive_gains(Snapshots(rows), last=1)
+    assert [(g['Player_id'], g['attack']) for g in latest] == [(1, 15), (2, 60)]
+
+
+def test_window_gains():
+    gains = window_gains(Snapshots(rows), days=2, end=START + datetime.timedelta(days=2, hours=1))
+
+    # player 2 has no scrape in the window and player 3 only one
+    assert [(g['Player_id'], g['attack'], g['start_id'], g['id']) for g in gains] == [(1, 20, 1, 9)]
+
+    # a window that starts before the first scrape is measured from it
+    gains = gains_between(Snapshots(rows), START - datetime.timedelta(days=10), START + datetime.timedelta(days=5))
+    assert [(g['Player_id'], g['attack']) for g in gains] == [(1, 20), (2, 60)]
+
+
+def test_no_snapshots():
+    assert consecutive_gains(Snapshots([])) == []
+    assert window_gains(Snapshots([]), days=1) == []
+    assert consecutive_gains(Snapshots(rows[-1:])) == []
+
+
+def test_latest_gains_newest_first(monkeypatch):
+    async def latest_snapshots(player_id, count):
+        assert count == 3
+        return [r for r in rows if r['Player_id'] == player_id][::-1]
+
+    monkeypatch.setattr(xp_changes, 'sql_select_latest_snapshots', latest_snapshots)
+
+    gains = asyncio.run(xp_changes.get_latest_gains(1, count=2))
+    assert [g['id'] for g in gains] == [9, 5]
+
+
+def test_window_gains_split_the_selects(monkeypatch):
+    selects = []
+
+    async def select_snapshots(player_ids, since, until):
+        selects.append(list(player_ids))
+        return [snapshot(p, p * 10 + d, d, 100 * d) for p in player_ids for d in (1, 2)]
+
+    monkeypatch.setattr(xp_changes, 'sql_select_snapshots', select_snapshots)
+    # 2 + 7 lookback days are 10 dates, 25 players fit in a select of 250 rows
+    monkeypatch.setattr(xp_changes, 'ROW_LIMIT', 250)
+    monkeypatch.setattr(xp_changes.Config, 'xp_change_lookback_days', 7)
+
+    gains = asyncio.run(xp_changes.get_window_gains(list(range(1, 61)), 2, START + datetime.timedelta(days=2)))
+    assert [len(s) for s in selects] == [25, 25, 10]
+    assert len(gains) == 60
+
+
+def test_legacy_gain_keeps_the_xp_change_shape():
+    from api.routers.legacy import legacy_xp_gain, xp_change_keys
+
+    rows = [snapshot(1, 10, 0, 100, tempoross=3), snapshot(1, 20, 1, 150, tempoross=5)]
+    gain = legacy_xp_gain(consecutive_gains(Snapshots(rows))[0])
+
+    assert list(gain) == xp_change_keys
+    assert gain['id'] == 20 and gain['attack'] == 50 and gain['Tempoross'] == 2